@@ -105,6 +105,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'apps.security.middleware.IPLoggingMiddleware',  # IP tracking middleware
+    'apps.security.middleware.RateLimitMiddleware',  # Token-bucket rate limits (after IP logging so 429s are logged)
 ]
 
 
@@ -332,6 +333,9 @@ except Exception:
         }
     }
 
+# Seconds property facet counts are cached per filter set, 0 disables (see apps/properties/facets.py)
+PROPERTY_FACETS_CACHE_TIMEOUT = int(os.environ.get('PROPERTY_FACETS_CACHE_TIMEOUT', '300'))
+
 
 # ============================================
 # CELERY CONFIGURATION
@@ -366,10 +370,34 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.security.tasks.detect_suspicious_ips',
         'schedule': 3600.0,  # Every hour
     },
+    'drain-request-log-stream': {
+        'task': 'apps.security.tasks.drain_request_log_stream',
+        'schedule': 5.0,  # Every 5 seconds (returns at once unless a 'stream' log sink is configured)
+    },
+    'score-recent-traffic': {
+        'task': 'apps.security.tasks.score_recent_traffic',
+        'schedule': 300.0,  # Every 5 minutes
+    },
+    'train-anomaly-model-daily': {
+        'task': 'apps.security.tasks.train_anomaly_model',
+        'schedule': 86400.0,  # Daily
+    },
+    'enrich-request-log-geo': {
+        'task': 'apps.security.tasks.enrich_request_log_geo',
+        'schedule': 30.0,  # Every 30 seconds (no-op unless GeoIP mode is 'deferred')
+    },
+    'update-traffic-rollups': {
+        'task': 'apps.security.tasks.update_traffic_rollups',
+        'schedule': 300.0,  # Every 5 minutes
+    },
     'cleanup-old-logs-daily': {
         'task': 'apps.security.tasks.cleanup_old_logs',
         'schedule': 86400.0,  # Daily
     },
+    'maintain-request-log-partitions-daily': {
+        'task': 'apps.security.tasks.maintain_request_log_partitions',
+        'schedule': 86400.0,  # Daily
+    },
 }
 
 
@@ -380,6 +408,88 @@ CELERY_BEAT_SCHEDULE = {
 RATELIMIT_USE_CACHE = 'default'
 RATELIMIT_ENABLE = True
 
+# Route-level token-bucket policies (see apps/security/rate_limits.py).
+# The first policy matching the URL pattern and method applies; a role
+# mapped to None is not limited.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+RATE_LIMIT_POLICIES = [
+    {
+        'name': 'auth',
+        'routes': [
+            'api/auth/login/', 'api/auth/register/', 'api/token/', 'api/token/refresh/',
+            'api/messaging/register/',
+        ],
+        'methods': ['POST'],
+        'rate': '10/m',
+        'burst': 5,
+        'key': 'ip',
+    },
+    {
+        'name': 'security-login',
+        'routes': ['api/security/login/'],
+        'methods': ['POST'],
+        'rate': '5/m',
+        'key': 'ip',
+    },
+    {
+        'name': 'security-sensitive',
+        'routes': ['api/security/sensitive/'],
+        'rate': '10/m',
+    },
+    {
+        'name': 'security-logs',
+        'routes': ['api/security/logs/'],
+        'rate': '10/m',
+        'key': 'user',
+    },
+    {
+        'name': 'security-suspicious',
+        'routes': ['api/security/suspicious/'],
+        'rate': '10/m',
+        'key': 'user',
+    },
+    {
+        'name': 'security-blocked',
+        'routes': ['api/security/blocked/'],
+        'rate': '10/m',
+        'key': 'user',
+    },
+    {
+        'name': 'security-traffic',
+        'routes': ['api/security/traffic/<str:dimension>/'],
+        'rate': '30/m',
+        'key': 'user',
+    },
+    {
+        # apps.properties is mounted under both api/properties/ and
+        # properties/; router routes are matched in their resolved regex form
+        'name': 'writes',
+        'routes': [
+            'api/travel/bookings/create/',
+            'api/travel/bookings/$',
+            'api/properties/api/<int:pk>/add-review/',
+            'properties/api/<int:pk>/add-review/',
+            'api/properties/api/create/',
+            'properties/api/create/',
+            'api/properties/api/properties/$',
+            'properties/api/properties/$',
+            'api/properties/api/properties/(?P<pk>[^/.]+)/add_review/$',
+            'properties/api/properties/(?P<pk>[^/.]+)/add_review/$',
+            'api/properties/api/reviews/$',
+            'properties/api/reviews/$',
+        ],
+        'methods': ['POST'],
+        'rate': {'anonymous': '5/m', 'authenticated': '30/m', 'staff': None},
+        'burst': 10,
+    },
+    {
+        'name': 'api',
+        'prefixes': ['api/', 'properties/api/', 'graphql/'],
+        'rate': {'anonymous': '120/m', 'authenticated': '600/m', 'staff': None},
+        'burst': 60,
+    },
+]
+
 
 # ============================================
 # IP TRACKING SETTINGS
@@ -389,8 +499,92 @@ IP_TRACKING_ENABLED = True
 IP_TRACKING_ANONYMIZE = os.environ.get('IP_TRACKING_ANONYMIZE', 'False').lower() == 'true'
 IP_TRACKING_RETENTION_DAYS = int(os.environ.get('IP_TRACKING_RETENTION_DAYS', '90'))
 
+# RequestLog retention (see apps/security/partitioning.py)
+IP_TRACKING_PARTITION_INTERVAL = os.environ.get('IP_TRACKING_PARTITION_INTERVAL', 'day')  # 'day' or 'month'
+IP_TRACKING_PARTITIONS_AHEAD = int(os.environ.get('IP_TRACKING_PARTITIONS_AHEAD', '7'))
+IP_TRACKING_CLEANUP_BATCH_SIZE = int(os.environ.get('IP_TRACKING_CLEANUP_BATCH_SIZE', '5000'))
+IP_TRACKING_CLEANUP_SLEEP = float(os.environ.get('IP_TRACKING_CLEANUP_SLEEP', '0.1'))
+
+# Anomaly detection thresholds (shared by the real-time counters and the hourly task)
+IP_TRACKING_REALTIME_COUNTERS = os.environ.get('IP_TRACKING_REALTIME_COUNTERS', 'True').lower() == 'true'
+IP_TRACKING_DETECTION_WINDOW = 3600  # seconds
+IP_TRACKING_VOLUME_THRESHOLD = 100  # requests per window
+IP_TRACKING_SENSITIVE_THRESHOLD = 10  # sensitive path hits per window
+IP_TRACKING_SENSITIVE_PATHS = ['/admin', '/login', '/api/admin', '/api/login']
+
+# Persisted anomaly model (see apps/security/anomaly.py)
+IP_TRACKING_MODEL_DIR = os.environ.get('IP_TRACKING_MODEL_DIR', str(BASE_DIR / 'ml_models'))
+IP_TRACKING_MODEL_CONTAMINATION = float(os.environ.get('IP_TRACKING_MODEL_CONTAMINATION', '0.05'))
+IP_TRACKING_SCORING_WINDOW_MINUTES = int(os.environ.get('IP_TRACKING_SCORING_WINDOW_MINUTES', '10'))
+
+# Seconds between checks of the shared blocklist version (see apps/security/blocklist.py)
+BLOCKLIST_VERSION_CHECK_INTERVAL = int(os.environ.get('BLOCKLIST_VERSION_CHECK_INTERVAL', '5'))
+
+# Route interning (see apps/security/routes.py). RequestLog stores the route id;
+# the raw path is kept only for unresolved requests unless STORE_RAW_PATH is set.
+IP_TRACKING_STORE_RAW_PATH = os.environ.get('IP_TRACKING_STORE_RAW_PATH', 'False').lower() == 'true'
+IP_TRACKING_ROUTE_CACHE_SIZE = int(os.environ.get('IP_TRACKING_ROUTE_CACHE_SIZE', '10000'))
+
+# Request-log sampling policy (see apps/security/sampling.py). The real-time
+# counters always see every request; logged rows carry a sample_weight.
+IP_TRACKING_SAMPLING = {
+    'default_rate': float(os.environ.get('IP_TRACKING_SAMPLE_RATE', '1.0')),
+    # Per-route rates, keyed by URL pattern
+    'routes': {
+        'properties/': float(os.environ.get('IP_TRACKING_PROPERTY_LIST_SAMPLE_RATE', '1.0')),
+        'api/properties/api/list/': float(os.environ.get('IP_TRACKING_PROPERTY_LIST_SAMPLE_RATE', '1.0')),
+    },
+    'always_log': {
+        'blocked': True,
+        'sensitive': True,
+        'authenticated_writes': True,
+        'errors': True,
+    },
+    'error_status': 400,
+    # First N requests per IP per window are always logged
+    'per_ip_minimum': int(os.environ.get('IP_TRACKING_SAMPLE_PER_IP_MINIMUM', '5')),
+    'per_ip_window': 60,
+}
+
+# Database alias export_request_logs reads from (point at a replica in production)
+IP_TRACKING_EXPORT_DATABASE = os.environ.get('IP_TRACKING_EXPORT_DATABASE', 'default')
+
+# Buffered request-log writer (see apps/security/log_writer.py)
+IP_TRACKING_LOG_SYNC_WRITES = os.environ.get('IP_TRACKING_LOG_SYNC_WRITES', 'False').lower() == 'true'
+IP_TRACKING_LOG_BATCH_SIZE = int(os.environ.get('IP_TRACKING_LOG_BATCH_SIZE', '200'))
+IP_TRACKING_LOG_FLUSH_INTERVAL = float(os.environ.get('IP_TRACKING_LOG_FLUSH_INTERVAL', '5'))
+IP_TRACKING_LOG_MAX_BUFFER = int(os.environ.get('IP_TRACKING_LOG_MAX_BUFFER', '10000'))
+
+# Request-log ingestion mode: 'buffered' (in-process writer) or 'stream'
+# (Redis stream drained by the drain_request_log_stream Celery task)
+IP_TRACKING_LOG_INGESTION = os.environ.get('IP_TRACKING_LOG_INGESTION', 'buffered')
+# Stream length at which the stream sink falls back to the database writer (see apps/security/log_stream.py)
+IP_TRACKING_LOG_STREAM_MAXLEN = int(os.environ.get('IP_TRACKING_LOG_STREAM_MAXLEN', '1000000'))
+IP_TRACKING_LOG_STREAM_BATCH_SIZE = int(os.environ.get('IP_TRACKING_LOG_STREAM_BATCH_SIZE', '1000'))
+IP_TRACKING_LOG_STREAM_MAX_RETRIES = int(os.environ.get('IP_TRACKING_LOG_STREAM_MAX_RETRIES', '5'))
+
+# Request-log destinations, several may be active: 'database', 'stream',
+# 'file' or a dotted RequestLogSink path (see apps/security/sinks.py).
+# Unset, the sink follows IP_TRACKING_LOG_INGESTION.
+IP_TRACKING_LOG_SINKS = [
+    {'backend': name.strip()}
+    for name in os.environ.get('IP_TRACKING_LOG_SINKS', '').split(',') if name.strip()
+]
+# Rotating JSON-lines files of the 'file' sink, loaded with load_request_log_files
+IP_TRACKING_LOG_FILE_DIR = os.environ.get('IP_TRACKING_LOG_FILE_DIR', str(BASE_DIR / 'request_logs'))
+IP_TRACKING_LOG_FILE_MAX_BYTES = int(os.environ.get('IP_TRACKING_LOG_FILE_MAX_BYTES', str(64 * 1024 * 1024)))
+IP_TRACKING_LOG_FILE_MAX_AGE = int(os.environ.get('IP_TRACKING_LOG_FILE_MAX_AGE', '300'))  # seconds
+
 # GeoIP2 Configuration
 GEOIP_PATH = os.environ.get('GEOIP_PATH', BASE_DIR / 'geoip')
+# Per-process LRU of resolved IPs in front of the shared cache
+GEOIP_LRU_SIZE = int(os.environ.get('GEOIP_LRU_SIZE', '50000'))
+# 'inline' resolves in the middleware; 'deferred' writes RequestLog rows
+# without geolocation and enriches them in batches (see apps/security/enrichment.py)
+IP_TRACKING_GEOIP_MODE = os.environ.get('IP_TRACKING_GEOIP_MODE', 'inline')
+# Rollups and enrichment only advance past rows inserted this many seconds
+# ago, so batches still committing are never skipped (see apps/security/watermarks.py)
+IP_TRACKING_WATERMARK_GRACE = int(os.environ.get('IP_TRACKING_WATERMARK_GRACE', '60'))
 
 
 # ============================================
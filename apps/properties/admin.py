@@ -7,7 +7,7 @@ class PropertyAdmin(admin.ModelAdmin):
     list_display = ('title', 'host', 'property_type', 'price_per_night', 'location', 'is_active', 'is_featured', 'created_at')
     list_filter = ('property_type', 'is_active', 'is_featured', 'location', 'created_at')
     search_fields = ('title', 'description', 'location', 'city', 'country', 'host__email', 'host__first_name', 'host__last_name')
-    readonly_fields = ('created_at', 'updated_at', 'average_rating', 'review_count')
+    readonly_fields = ('created_at', 'updated_at', 'average_rating', 'review_count', 'rating_histogram')
     fieldsets = (
         ('Basic Information', {
             'fields': ('host', 'title', 'description', 'property_type')
@@ -32,7 +32,7 @@ class PropertyAdmin(admin.ModelAdmin):
             'fields': ('is_active', 'is_featured')
         }),
         ('Statistics', {
-            'fields': ('average_rating', 'review_count'),
+            'fields': ('average_rating', 'review_count', 'rating_histogram'),
             'classes': ('collapse',)
         }),
         ('Timestamps', {
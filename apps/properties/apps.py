@@ -5,3 +5,6 @@ class PropertiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.properties'
     verbose_name = 'Properties & Caching'
+
+    def ready(self):
+        import apps.properties.signals  # noqa
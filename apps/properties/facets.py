@@ -0,0 +1,139 @@
+"""
+Facet counts for property browsing.
+
+``get_facets(queryset, params)`` returns, for the listing a filter set
+selects, the number of properties per property type, price bucket,
+bedroom count and amenity. Every count is one ``COUNT(*) FILTER (WHERE
+...)`` (a CASE expression on SQLite) in a single aggregate query, so the
+table is scanned once however many facets there are.
+
+Results are cached per filter set for PROPERTY_FACETS_CACHE_TIMEOUT
+seconds. The cache key includes a shared version that the Property
+save/delete signals bump (see signals.py), so a property change makes
+every cached facet set stale at once. Map queries (``bbox``/``near``)
+are not cached: their coordinates rarely repeat.
+"""
+import hashlib
+import logging
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .filters import FILTER_PARAMS
+from .models import Property
+
+logger = logging.getLogger('properties')
+
+VERSION_CACHE_KEY = 'property_facets:version'
+
+# (label, lower bound inclusive, upper bound exclusive) in USD per night
+PRICE_BUCKETS = (
+    ('0-50', None, 50),
+    ('50-100', 50, 100),
+    ('100-200', 100, 200),
+    ('200-500', 200, 500),
+    ('500+', 500, None),
+)
+# Exact bedroom counts; larger properties are counted together
+BEDROOM_COUNTS = (0, 1, 2, 3, 4)
+AMENITIES = (
+    'wifi', 'kitchen', 'parking', 'pool', 'air_conditioning',
+    'heating', 'tv', 'washer', 'dryer',
+)
+UNCACHED_PARAMS = ('bbox', 'near')
+
+
+def _price_filter(low, high):
+    bounds = Q()
+    if low is not None:
+        bounds &= Q(price_per_night__gte=Decimal(low))
+    if high is not None:
+        bounds &= Q(price_per_night__lt=Decimal(high))
+    return bounds
+
+
+def facet_aggregates():
+    """``{alias: Count(filter=...)}`` for every facet value."""
+    aggregates = {'total': Count('pk')}
+    for value, _ in Property.PROPERTY_TYPES:
+        aggregates[f'type__{value}'] = Count('pk', filter=Q(property_type=value))
+    for index, (_, low, high) in enumerate(PRICE_BUCKETS):
+        aggregates[f'price__{index}'] = Count('pk', filter=_price_filter(low, high))
+    for bedrooms in BEDROOM_COUNTS:
+        aggregates[f'bedrooms__{bedrooms}'] = Count('pk', filter=Q(bedrooms=bedrooms))
+    aggregates['bedrooms__more'] = Count('pk', filter=Q(bedrooms__gt=BEDROOM_COUNTS[-1]))
+    for amenity in AMENITIES:
+        aggregates[f'amenity__{amenity}'] = Count('pk', filter=Q(**{amenity: True}))
+    return aggregates
+
+
+def compute_facets(queryset):
+    """Facet counts for ``queryset`` from one aggregate query."""
+    row = queryset.order_by().aggregate(**facet_aggregates())
+    return {
+        'total': row['total'],
+        'property_type': {value: row[f'type__{value}'] for value, _ in Property.PROPERTY_TYPES},
+        'price': [
+            {'label': label, 'min': low, 'max': high, 'count': row[f'price__{index}']}
+            for index, (label, low, high) in enumerate(PRICE_BUCKETS)
+        ],
+        'bedrooms': {
+            **{str(bedrooms): row[f'bedrooms__{bedrooms}'] for bedrooms in BEDROOM_COUNTS},
+            f'{BEDROOM_COUNTS[-1] + 1}+': row['bedrooms__more'],
+        },
+        'amenities': {amenity: row[f'amenity__{amenity}'] for amenity in AMENITIES},
+    }
+
+
+def get_version():
+    """Current facet cache version, shared by all workers."""
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def bump_version():
+    """Invalidate every cached facet set (called when a property changes)."""
+    try:
+        cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+    except Exception as e:
+        logger.warning(f"Could not invalidate cached facets: {e}")
+
+
+def cache_key(params):
+    """Cache key for a filter set, or None if it should not be cached."""
+    if any(params.get(name, '').strip() for name in UNCACHED_PARAMS):
+        return None
+    # Normalize so parameter order and unrelated parameters share an entry
+    filters = '&'.join(
+        f'{name}={params.get(name, "").strip()}'
+        for name in FILTER_PARAMS if params.get(name, '').strip()
+    )
+    digest = hashlib.sha1(filters.encode()).hexdigest()
+    return f'property_facets:{get_version()}:{digest}'
+
+
+def get_facets(queryset, params):
+    """Facet counts for ``queryset`` (filtered by ``params``), cached per filter set."""
+    timeout = getattr(settings, 'PROPERTY_FACETS_CACHE_TIMEOUT', 300)
+    try:
+        key = cache_key(params) if timeout else None
+        facets = cache.get(key) if key else None
+    except Exception as e:
+        logger.warning(f"Facet cache unavailable: {e}")
+        key = facets = None
+    if facets is not None:
+        return facets
+
+    facets = compute_facets(queryset)
+    if key:
+        try:
+            cache.set(key, facets, timeout)
+        except Exception as e:
+            logger.warning(f"Facet cache unavailable: {e}")
+    return facets
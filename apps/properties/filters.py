@@ -0,0 +1,86 @@
+"""
+Query-parameter filters for property listings.
+
+Shared by PropertyViewSet's list and facets endpoints so facet counts
+always describe the listing the same parameters return.
+"""
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+
+from . import geo
+from .search import search
+
+# Every query parameter filter_properties reads
+FILTER_PARAMS = (
+    'host', 'location', 'type', 'min_price', 'max_price', 'featured',
+    'bbox', 'near', 'radius_km', 'q',
+)
+
+
+def _price(params, name):
+    value = params.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        price = None
+    if price is None or not price.is_finite() or price < 0:
+        raise ValueError(f'{name} must be a non-negative number')
+    return price
+
+
+def filter_properties(queryset, params):
+    """
+    Apply the listing filters in ``params`` to a Property queryset.
+
+    Raises ValueError for malformed host, price or geo (see geo.py)
+    parameters.
+    """
+    # Filter by host if provided
+    host_id = params.get('host', None)
+    if host_id:
+        try:
+            host_id = uuid.UUID(host_id)
+        except ValueError:
+            raise ValueError('host must be a user id (UUID)')
+        queryset = queryset.filter(host__user_id=host_id)
+
+    # Filter by location
+    location = params.get('location', None)
+    if location:
+        queryset = queryset.filter(
+            Q(location__icontains=location) |
+            Q(city__icontains=location) |
+            Q(country__icontains=location)
+        )
+
+    # Filter by property type
+    property_type = params.get('type', None)
+    if property_type:
+        queryset = queryset.filter(property_type=property_type)
+
+    # Filter by price range
+    min_price = _price(params, 'min_price')
+    max_price = _price(params, 'max_price')
+    if min_price is not None:
+        queryset = queryset.filter(price_per_night__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price_per_night__lte=max_price)
+
+    # Filter featured
+    featured = params.get('featured', None)
+    if featured and featured.lower() == 'true':
+        queryset = queryset.filter(is_featured=True)
+
+    # Map area / radius (see geo.py)
+    queryset = geo.filter_queryset(queryset, params)
+
+    # Full-text search, ranked (see search.py)
+    q = params.get('q', '').strip()
+    if q:
+        queryset = search(queryset, q)
+
+    return queryset
@@ -0,0 +1,257 @@
+"""
+Geospatial property lookups.
+
+Every property with coordinates stores its geohash (``Property.geohash``,
+precision 9, about 5 m) behind a ``(is_active, geohash)`` index. Nearby
+points share a geohash prefix, so a map area is covered by a handful of
+cells and each cell is one index range scan (``cell000 <= geohash <= cellzzz``).
+The exact bounds and distances are then checked in SQL on that small
+candidate set:
+
+- ``bbox=west,south,east,north`` (GeoJSON order, degrees) keeps properties
+  inside the box; a box with ``west > east`` crosses the antimeridian.
+- ``near=lat,lng&radius_km=`` keeps properties within ``radius_km``
+  (default 10) great-circle km and annotates ``distance_km``; results are
+  sorted nearest first (see pagination.DistancePagination).
+
+Geohashes are maintained by ``Property.save()``. Writes that bypass it
+(``bulk_create``, ``QuerySet.update()``) need
+``python manage.py rebuild_geohashes``.
+"""
+import math
+import operator
+from decimal import Decimal
+from functools import reduce
+
+from django.db.models import FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+PRECISION = 9
+DEFAULT_RADIUS_KM = 10.0
+MAX_RADIUS_KM = 500.0
+# Upper bound on range scans per query; finer cells would mean more of them
+MAX_CELLS = 12
+EARTH_RADIUS_KM = 6371.0088
+# First ring of the nearest-first search (see search_radii)
+RING_STEP_KM = 0.25
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Geohash of a point, or '' when either coordinate is missing."""
+    if latitude is None or longitude is None:
+        return ''
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            interval, coordinate = lng_range, longitude
+        else:
+            interval, coordinate = lat_range, latitude
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """``(height, width)`` in degrees of a geohash cell at ``precision``."""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def _cell_span(low, high, limit, size):
+    """First and last cell index covering ``[low, high]`` on an axis spanning ``[-limit, limit]``."""
+    last = int(2 * limit / size) - 1
+    return min(int((low + limit) // size), last), min(int((high + limit) // size), last)
+
+
+def cover(south, west, north, east, max_cells=MAX_CELLS):
+    """
+    Geohash prefixes whose cells together cover the box (``west <= east``).
+
+    Uses the finest precision that needs at most ``max_cells`` cells.
+    """
+    best = None
+    for precision in range(1, PRECISION + 1):
+        height, width = cell_size(precision)
+        rows = _cell_span(south, north, 90.0, height)
+        cols = _cell_span(west, east, 180.0, width)
+        if (rows[1] - rows[0] + 1) * (cols[1] - cols[0] + 1) > max_cells:
+            break
+        best = precision, height, width, rows, cols
+    if best is None:
+        return ['']
+    precision, height, width, rows, cols = best
+    cells = set()
+    for row in range(rows[0], rows[1] + 1):
+        for col in range(cols[0], cols[1] + 1):
+            cells.add(encode(-90.0 + (row + 0.5) * height, -180.0 + (col + 0.5) * width, precision))
+    return sorted(cells)
+
+
+def cell_range(cell):
+    """Lowest and highest stored geohash inside ``cell`` (all are PRECISION long)."""
+    pad = PRECISION - len(cell)
+    return cell + _BASE32[0] * pad, cell + _BASE32[-1] * pad
+
+
+def _boxes(south, west, north, east):
+    # Split a box that crosses the antimeridian into two that do not
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def _decimal(value):
+    return Decimal(f'{value:.6f}')
+
+
+def within_box(south, west, north, east):
+    """Q matching properties inside the box, served by the geohash index."""
+    matches = []
+    for box in _boxes(south, west, north, east):
+        cells = reduce(operator.or_, (
+            Q(geohash__range=cell_range(cell)) for cell in cover(*box)
+        ))
+        b_south, b_west, b_north, b_east = box
+        matches.append(cells & Q(
+            latitude__gte=_decimal(b_south), latitude__lte=_decimal(b_north),
+            longitude__gte=_decimal(b_west), longitude__lte=_decimal(b_east),
+        ))
+    return reduce(operator.or_, matches)
+
+
+def radius_box(latitude, longitude, radius_km):
+    """``(south, west, north, east)`` of the box circumscribing a circle."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = latitude - dlat, latitude + dlat
+    if south <= -90.0 or north >= 90.0:
+        # The circle contains a pole: every longitude is in range
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    dlng = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    west, east = longitude - dlng, longitude + dlng
+    if dlng >= 180.0:
+        return south, -180.0, north, 180.0
+    if west < -180.0:
+        west += 360.0
+    if east > 180.0:
+        east -= 360.0
+    return south, west, north, east
+
+
+def within_circle(latitude, longitude, radius_km):
+    """Q matching properties within ``radius_km``; needs the ``distance_km`` annotation."""
+    return within_box(*radius_box(latitude, longitude, radius_km)) & Q(distance_km__lte=radius_km)
+
+
+def search_radii(start_km, radius_km, first_step_km=RING_STEP_KM):
+    """
+    Growing search radii from ``start_km`` out to ``radius_km``.
+
+    A nearest-first page only needs the closest rows beyond the cursor, so
+    callers try each circle in turn and stop at the first holding a full
+    page; in dense areas that is a small fraction of the whole radius.
+    """
+    step = first_step_km
+    while start_km + step < radius_km:
+        yield start_km + step
+        step *= 4
+    yield radius_km
+
+
+def distance_km(latitude, longitude):
+    """Haversine great-circle distance in km from the point to each property, in SQL."""
+    lat = math.radians(latitude)
+    lng = math.radians(longitude)
+    row_lat = Radians(Cast('latitude', FloatField()))
+    row_lng = Radians(Cast('longitude', FloatField()))
+    a = (
+        Power(Sin((row_lat - Value(lat)) / Value(2.0)), 2)
+        + Value(math.cos(lat)) * Cos(row_lat) * Power(Sin((row_lng - Value(lng)) / Value(2.0)), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)), output_field=FloatField())
+
+
+def _floats(value, count, name):
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count or not all(math.isfinite(number) for number in numbers):
+        raise ValueError(f'{name} must be {count} comma-separated numbers')
+    return numbers
+
+
+def _check_point(latitude, longitude, name):
+    if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+        raise ValueError(f'{name} is outside -90..90 latitude / -180..180 longitude')
+
+
+def parse_bbox(value):
+    """``'west,south,east,north'`` -> ``(south, west, north, east)``; raises ValueError."""
+    west, south, east, north = _floats(value, 4, 'bbox')
+    _check_point(south, west, 'bbox')
+    _check_point(north, east, 'bbox')
+    if south > north:
+        raise ValueError('bbox south must not be greater than north')
+    return south, west, north, east
+
+
+def parse_near(value, radius=None):
+    """``('lat,lng', radius_km)`` -> ``(lat, lng, radius_km)``; raises ValueError."""
+    latitude, longitude = _floats(value, 2, 'near')
+    _check_point(latitude, longitude, 'near')
+    radius_km = DEFAULT_RADIUS_KM if radius in (None, '') else _floats(str(radius), 1, 'radius_km')[0]
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        raise ValueError(f'radius_km must be greater than 0 and at most {MAX_RADIUS_KM:g}')
+    return latitude, longitude, radius_km
+
+
+def filter_queryset(queryset, params):
+    """
+    Apply the ``bbox`` and ``near``/``radius_km`` query parameters.
+
+    With ``near`` the queryset is annotated with ``distance_km``. Raises
+    ValueError for malformed parameters.
+    """
+    bbox = params.get('bbox', '').strip()
+    if bbox:
+        queryset = queryset.filter(within_box(*parse_bbox(bbox)))
+    near = params.get('near', '').strip()
+    if near:
+        latitude, longitude, radius_km = parse_near(near, params.get('radius_km'))
+        queryset = queryset.annotate(
+            distance_km=distance_km(latitude, longitude),
+        ).filter(within_circle(latitude, longitude, radius_km))
+    return queryset
+
+
+def rebuild_geohashes(batch_size=2000):
+    """Recompute every property's geohash; returns the number changed."""
+    from .models import Property
+
+    changed = []
+    rows = Property.objects.values_list('pk', 'latitude', 'longitude', 'geohash').iterator(chunk_size=batch_size)
+    for pk, latitude, longitude, geohash in rows:
+        expected = encode(latitude, longitude)
+        if expected != geohash:
+            changed.append(Property(pk=pk, geohash=expected))
+    Property.objects.bulk_update(changed, ['geohash'], batch_size=batch_size)
+    return len(changed)
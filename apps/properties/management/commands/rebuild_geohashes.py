@@ -0,0 +1,19 @@
+"""
+Management command to recompute property geohashes.
+
+Geohashes are set by Property.save(); run this after bulk imports or other
+writes that bypass it (``bulk_create``, ``QuerySet.update()``, raw SQL):
+
+    python manage.py rebuild_geohashes
+"""
+from django.core.management.base import BaseCommand
+
+from apps.properties.geo import rebuild_geohashes
+
+
+class Command(BaseCommand):
+    help = 'Recompute the geohash of every property from its coordinates'
+
+    def handle(self, *args, **options):
+        count = rebuild_geohashes()
+        self.stdout.write(self.style.SUCCESS(f'Updated {count} property geohash(es)'))
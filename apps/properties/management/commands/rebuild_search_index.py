@@ -0,0 +1,20 @@
+"""
+Management command to rebuild the property full-text search index.
+
+Properties are reindexed on save; run this after bulk imports or other
+writes that bypass signals (``bulk_create``, ``QuerySet.update()``, raw SQL):
+
+    python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+
+from apps.properties.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all properties'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} property(ies) with {type(backend).__name__}'))
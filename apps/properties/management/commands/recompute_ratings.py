@@ -0,0 +1,30 @@
+"""
+Management command to rebuild Property rating aggregates from reviews.
+
+The aggregates are maintained incrementally on every Review change; run
+this after bulk edits that bypass signals (``QuerySet.update()``, raw SQL,
+fixtures) or to verify them:
+
+    python manage.py recompute_ratings
+    python manage.py recompute_ratings --property 12 --property 15
+"""
+from django.core.management.base import BaseCommand
+
+from apps.properties.ratings import recompute
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized rating sums, counts and histograms on Property'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--property',
+            type=int,
+            action='append',
+            dest='property_ids',
+            help='Only recompute this property id (may be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        changed = recompute(options['property_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed ratings: {changed} property(ies) corrected'))
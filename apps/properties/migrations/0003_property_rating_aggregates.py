@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:12
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_ratings(apps, schema_editor):
+    Property = apps.get_model('properties', 'Property')
+    Review = apps.get_model('properties', 'Review')
+    annotations = {'rating_sum': Sum('rating'), 'rating_count': Count('id')}
+    for stars in range(1, 6):
+        annotations[f'rating_{stars}_count'] = Count('id', filter=Q(rating=stars))
+    rows = Review.objects.filter(is_approved=True).values('property_id').annotate(**annotations).order_by()
+    for row in rows:
+        Property.objects.filter(pk=row.pop('property_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0002_review_alter_property_options_remove_property_price_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
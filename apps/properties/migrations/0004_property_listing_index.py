@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0003_property_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['is_active', '-is_featured', '-created_at', '-id'], name='property_listing_idx'),
+        ),
+    ]
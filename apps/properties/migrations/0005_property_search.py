@@ -0,0 +1,74 @@
+import logging
+
+import django.contrib.postgres.search
+from django.db import migrations, transaction
+
+logger = logging.getLogger('properties')
+
+FTS_TABLE = 'properties_property_fts'
+TRIGRAM_FIELDS = ('location', 'city', 'country', 'title')
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS property_search_vector_idx '
+            'ON properties_property USING gin (search_vector)'
+        )
+        try:
+            with transaction.atomic(using=connection.alias):
+                schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except Exception as e:
+            logger.warning(f"pg_trgm unavailable, skipping trigram indexes: {e}")
+        else:
+            for field in TRIGRAM_FIELDS:
+                schema_editor.execute(
+                    f'CREATE INDEX IF NOT EXISTS property_{field}_trgm_idx '
+                    f'ON properties_property USING gin (upper({field}) gin_trgm_ops)'
+                )
+        schema_editor.execute(
+            "UPDATE properties_property SET search_vector = "
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', concat_ws(' ', location, city, country)), 'B') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'C')"
+        )
+    elif connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(title, location, description, tokenize='porter unicode61')"
+            )
+        except Exception as e:
+            logger.warning(f"SQLite FTS5 unavailable, property search will use icontains: {e}")
+            return
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, location, description) "
+            f"SELECT id, title, trim(location || ' ' || city || ' ' || country), description FROM properties_property"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS property_search_vector_idx')
+        for field in TRIGRAM_FIELDS:
+            schema_editor.execute(f'DROP INDEX IF EXISTS property_{field}_trgm_idx')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0004_property_listing_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
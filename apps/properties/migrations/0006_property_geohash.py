@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:36
+
+from django.db import migrations, models
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(latitude, longitude, precision=9):
+    """Geohash of a point (a frozen copy of apps.properties.geo.encode)."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            interval, coordinate = lng_range, longitude
+        else:
+            interval, coordinate = lat_range, latitude
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def backfill_geohashes(apps, schema_editor):
+    Property = apps.get_model('properties', 'Property')
+    rows = Property.objects.exclude(latitude=None).exclude(longitude=None).values_list('pk', 'latitude', 'longitude')
+    for pk, latitude, longitude in rows.iterator(chunk_size=2000):
+        Property.objects.filter(pk=pk).update(geohash=encode(latitude, longitude))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0005_property_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['is_active', 'geohash'], name='property_geohash_idx'),
+        ),
+        migrations.RunPython(backfill_geohashes, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,14 @@
-from django.db import models
+from django.db import DatabaseError, models, transaction
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
 
+from . import geo
+
+# Denormalized rating columns; only ratings.py writes them
+RATING_FIELDS = frozenset({'rating_sum', 'rating_count', *(f'rating_{stars}_count' for stars in range(1, 6))})
+
 
 class Property(models.Model):
     """Property listing model with host, amenities, and images"""
@@ -39,6 +45,8 @@ class Property(models.Model):
     country = models.CharField(max_length=100, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Derived from latitude/longitude in save(), '' without coordinates (see geo.py)
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     
     # Property details
     bedrooms = models.PositiveIntegerField(default=1)
@@ -65,7 +73,20 @@ class Property(models.Model):
     # Status
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
+
+    # Denormalized approved-review ratings, maintained by the Review signal
+    # handlers (see signals.py) and repaired by `manage.py recompute_ratings`
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
     
+    # Weighted full-text document, PostgreSQL only (see search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -73,18 +94,58 @@ class Property(models.Model):
     def __str__(self):
         return self.title
     
+    def save(self, *args, **kwargs):
+        """
+        Keep the geohash in step with the coordinates.
+
+        A plain save() of an existing property never writes the rating
+        columns: review signals update them in place, so this instance's copy
+        may be stale. Callers that pass update_fields write exactly those
+        fields, and a row that no longer exists is inserted again as a plain
+        save() would.
+        """
+        self.geohash = geo.encode(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        elif (update_fields is None and not args and not self._state.adding
+                and not kwargs.get('force_insert') and not kwargs.get('force_update')):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in RATING_FIELDS and field.attname not in deferred
+            ]
+            try:
+                # A savepoint, so a failed update leaves an enclosing
+                # transaction usable for the fallback
+                with transaction.atomic(using=kwargs.get('using')):
+                    super().save(*args, **kwargs)
+            except DatabaseError as exc:
+                # Backend errors are wrapped with their cause; Django raises a
+                # bare DatabaseError when the UPDATE matched no row
+                if exc.__cause__ is not None:
+                    raise
+                del kwargs['update_fields']
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+    
     @property
     def average_rating(self):
-        """Calculate average rating from reviews"""
-        reviews = self.reviews.filter(is_approved=True)
-        if reviews.exists():
-            return round(reviews.aggregate(models.Avg('rating'))['rating__avg'] or 0, 2)
+        """Average rating of approved reviews (from the stored aggregates)"""
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 2)
         return 0.0
     
     @property
     def review_count(self):
-        """Get count of approved reviews"""
-        return self.reviews.filter(is_approved=True).count()
+        """Count of approved reviews (from the stored aggregates)"""
+        return self.rating_count
+
+    @property
+    def rating_histogram(self):
+        """Approved review counts per star rating, e.g. {'1': 0, ..., '5': 12}"""
+        return {str(stars): getattr(self, f'rating_{stars}_count') for stars in range(1, 6)}
     
     @property
     def display_price(self):
@@ -104,6 +165,10 @@ class Property(models.Model):
             models.Index(fields=['host', 'is_active']),
             models.Index(fields=['location', 'is_active']),
             models.Index(fields=['property_type', 'is_active']),
+            # Keyset pagination of listings (see pagination.py)
+            models.Index(fields=['is_active', '-is_featured', '-created_at', '-id'], name='property_listing_idx'),
+            # Geohash cell range scans for bbox/radius search (see geo.py)
+            models.Index(fields=['is_active', 'geohash'], name='property_geohash_idx'),
         ]
 
 
@@ -143,6 +208,16 @@ class Review(models.Model):
         reviewer = self.user.get_full_name() if self.user else self.guest_name or 'Anonymous'
         return f"Review by {reviewer} for {self.property.title} - {self.rating} stars"
 
+    def save(self, *args, **kwargs):
+        # The signal handlers update Property's rating aggregates; keep them
+        # in the same transaction as the review itself.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
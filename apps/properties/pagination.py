@@ -0,0 +1,209 @@
+"""
+Keyset pagination for property listings.
+
+Listings are ordered by ``(-is_featured, -created_at, -id)``. A page is the
+next ``page_size`` rows after the cursor's position in that ordering, so
+every page is one index range scan however deep the client scrolls, and
+rows added meanwhile never shift later pages. Responses look like
+``{"next": <url or null>, "results": [...]}``.
+
+Pages larger than ``stream_threshold`` are sent as a StreamingHttpResponse
+that serializes rows one at a time from a chunked iterator, so memory use
+stays flat regardless of ``page_size``.
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import geo
+
+ORDERING = ('-is_featured', '-created_at', '-id')
+
+
+class PropertyKeysetPagination(BasePagination):
+    """Forward-only cursor pagination on ``(is_featured, created_at, id)``, newest first."""
+    ordering = ORDERING
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    stream_threshold = 200
+    stream_chunk_size = 100
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        """Return the position encoded in the request's cursor, or None on the first page."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return self.parse_position(base64.urlsafe_b64decode(encoded.encode()).decode().split('|'))
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+
+    def encode_cursor(self, row):
+        raw = '|'.join(self.position_of(row))
+        encoded = base64.urlsafe_b64encode(raw.encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def position_of(self, row):
+        return [str(int(row.is_featured)), row.created_at.isoformat(), str(row.pk)]
+
+    def parse_position(self, parts):
+        featured, created_at, pk = parts
+        created_at = parse_datetime(created_at)
+        if featured not in ('0', '1') or created_at is None:
+            raise ValueError('invalid position')
+        return featured == '1', created_at, int(pk)
+
+    def after(self, position):
+        """Q matching the rows that follow ``position`` in ORDERING."""
+        featured, created_at, pk = position
+        after = Q(is_featured=featured, created_at=created_at, id__lt=pk) | Q(is_featured=featured, created_at__lt=created_at)
+        if featured:
+            after |= Q(is_featured=False)
+        return after
+
+    def page_queryset(self, queryset, request):
+        """Order ``queryset`` and restrict it to rows after the request's cursor."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return queryset
+
+    def should_stream(self, request):
+        return self.get_page_size(request) > self.stream_threshold
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # One extra row tells whether there is a further page
+        page = list(self.page_queryset(queryset, request)[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_streaming_response(self, queryset, request, serializer_class, context=None):
+        """
+        Stream one page as JSON, serializing rows as they are fetched.
+
+        ``next`` comes after ``results`` because it depends on the last row.
+        """
+        rows = self.page_queryset(queryset, request)[:self.page_size + 1]
+        context = context or {'request': request}
+
+        def stream():
+            encoder = JSONEncoder()
+            yield '{"results":['
+            last = None
+            has_next = False
+            for index, row in enumerate(rows.iterator(chunk_size=self.stream_chunk_size)):
+                if index == self.page_size:
+                    has_next = True
+                    break
+                if last is not None:
+                    yield ','
+                yield encoder.encode(serializer_class(row, context=context).data)
+                last = row
+            next_link = self.encode_cursor(last) if has_next else None
+            yield f'],"next":{json.dumps(next_link)}}}'
+
+        return StreamingHttpResponse(stream(), content_type='application/json')
+
+
+class SearchResultPagination(PropertyKeysetPagination):
+    """
+    Cursor pagination of ranked search results on ``(-search_rank, -id)``.
+
+    The rank is recomputed for the same query on every page, so it is a
+    stable sort key; the cursor carries its exact float value.
+    """
+    ordering = ('-search_rank', '-id')
+
+    def position_of(self, row):
+        return [repr(float(row.search_rank)), str(row.pk)]
+
+    def parse_position(self, parts):
+        rank, pk = parts
+        return float(rank), int(pk)
+
+    def after(self, position):
+        rank, pk = position
+        return Q(search_rank__lt=rank) | Q(search_rank=rank, id__lt=pk)
+
+
+class DistancePagination(PropertyKeysetPagination):
+    """
+    Cursor pagination of ``?near=`` results on ``(distance_km, id)``, nearest first.
+
+    Each page is read from the smallest circle around the cursor position
+    that holds a full page (see geo.search_radii), so a page in a dense
+    city computes distances for nearby rows only.
+    """
+    ordering = ('distance_km', 'id')
+
+    def page_queryset(self, queryset, request):
+        queryset = super().page_queryset(queryset, request)
+        latitude, longitude, radius_km = geo.parse_near(
+            request.query_params.get('near', ''), request.query_params.get('radius_km'),
+        )
+        position = self.decode_cursor(request)
+        start_km = position[0] if position is not None else 0.0
+        for ring_km in geo.search_radii(start_km, radius_km):
+            if ring_km >= radius_km:
+                break
+            ring = queryset.filter(geo.within_circle(latitude, longitude, ring_km))
+            if ring.order_by()[:self.page_size + 1].count() > self.page_size:
+                return ring
+        return queryset
+
+    def position_of(self, row):
+        return [repr(float(row.distance_km)), str(row.pk)]
+
+    def parse_position(self, parts):
+        distance, pk = parts
+        return float(distance), int(pk)
+
+    def after(self, position):
+        distance, pk = position
+        return Q(distance_km__gt=distance) | Q(distance_km=distance, id__gt=pk)
+
+
+def pagination_for(request):
+    """
+    Distance pagination for ``?near=``, ranked pagination for search
+    requests (``?q=``), keyset pagination otherwise.
+    """
+    if request.query_params.get('near', '').strip():
+        return DistancePagination()
+    if request.query_params.get('q', '').strip():
+        return SearchResultPagination()
+    return PropertyKeysetPagination()
@@ -0,0 +1,60 @@
+"""
+Denormalized rating aggregates on Property.
+
+Property stores the sum, count and per-star histogram of its approved
+reviews, so listings read ratings from the row itself instead of running
+an aggregate per property. Review changes apply deltas with a single
+``UPDATE ... SET col = col + n`` (see signals.py); ``recompute`` rebuilds
+the columns from the reviews table and repairs any drift (for example
+after ``QuerySet.update()`` calls, which bypass signals).
+"""
+from django.db.models import Count, F, Q, Sum
+
+from .models import Property, Review
+
+STARS = range(1, 6)
+
+
+def apply_delta(property_id, rating, sign):
+    """Add (``sign=1``) or remove (``sign=-1``) one approved ``rating``."""
+    rating = int(rating)
+    updates = {
+        'rating_sum': F('rating_sum') + sign * rating,
+        'rating_count': F('rating_count') + sign,
+    }
+    if rating in STARS:
+        updates[f'rating_{rating}_count'] = F(f'rating_{rating}_count') + sign
+    Property.objects.filter(pk=property_id).update(**updates)
+
+
+def recompute(property_ids=None, batch_size=1000):
+    """
+    Rebuild the rating columns from approved reviews in one GROUP BY.
+
+    Limits the work to ``property_ids`` when given. Returns the number of
+    properties whose stored values changed.
+    """
+    reviews = Review.objects.filter(is_approved=True)
+    properties = Property.objects.all()
+    if property_ids is not None:
+        reviews = reviews.filter(property_id__in=property_ids)
+        properties = properties.filter(pk__in=property_ids)
+
+    annotations = {'rating_sum': Sum('rating'), 'rating_count': Count('id')}
+    for stars in STARS:
+        annotations[f'rating_{stars}_count'] = Count('id', filter=Q(rating=stars))
+    totals = {
+        row.pop('property_id'): row
+        for row in reviews.values('property_id').annotate(**annotations).order_by()
+    }
+
+    fields = list(annotations)
+    changed = []
+    for prop in properties.only('id', *fields).iterator(chunk_size=batch_size):
+        expected = totals.get(prop.pk) or dict.fromkeys(fields, 0)
+        if any(getattr(prop, field) != expected[field] for field in fields):
+            for field in fields:
+                setattr(prop, field, expected[field])
+            changed.append(prop)
+    Property.objects.bulk_update(changed, fields, batch_size=batch_size)
+    return len(changed)
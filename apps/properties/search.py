@@ -0,0 +1,227 @@
+"""
+Full-text property search.
+
+``search(queryset, q)`` filters a Property queryset to listings matching
+``q`` and annotates ``search_rank`` (higher is better). Matches are
+weighted title > location/city/country > description. The backend is
+chosen by database vendor:
+
+- PostgreSQL: a weighted ``tsvector`` stored in ``Property.search_vector``
+  with a GIN index, queried with ``websearch_to_tsquery`` and ranked with
+  ``ts_rank``. Trigram GIN indexes on location, city and country (pg_trgm)
+  also serve the ``icontains`` location filter.
+- SQLite: an FTS5 table (``properties_property_fts``, rowid = property id)
+  ranked with ``bm25``. Terms are prefix-matched.
+- Anything else: ``icontains`` over the same fields, ranked by field.
+
+The index is refreshed from the Property post_save/post_delete signals
+(see signals.py). Writes that bypass signals (``bulk_create``,
+``QuerySet.update()``) need ``python manage.py rebuild_search_index``.
+"""
+import logging
+import re
+
+from django.db import connection
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+logger = logging.getLogger('properties')
+
+# Fields that feed the index, and their weights
+TITLE_FIELDS = ('title',)
+LOCATION_FIELDS = ('location', 'city', 'country')
+BODY_FIELDS = ('description',)
+INDEXED_FIELDS = TITLE_FIELDS + LOCATION_FIELDS + BODY_FIELDS
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'properties_property_fts'
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def _no_matches(queryset):
+    # Still annotated, so callers can order by the rank
+    return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class PostgresSearchBackend:
+    """tsvector + GIN full-text search with ts_rank ranking."""
+
+    @staticmethod
+    def vector():
+        from django.contrib.postgres.search import SearchVector
+
+        return (
+            SearchVector(*TITLE_FIELDS, weight='A', config=SEARCH_CONFIG)
+            + SearchVector(*LOCATION_FIELDS, weight='B', config=SEARCH_CONFIG)
+            + SearchVector(*BODY_FIELDS, weight='C', config=SEARCH_CONFIG)
+        )
+
+    def search(self, queryset, q):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        query = SearchQuery(q, search_type='websearch', config=SEARCH_CONFIG)
+        # ts_rank returns float4; as double precision the value survives the
+        # round trip through the pagination cursor exactly
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+        )
+
+    def index(self, property_ids):
+        from .models import Property
+
+        Property.objects.filter(pk__in=property_ids).update(search_vector=self.vector())
+
+    def remove(self, property_ids):
+        pass
+
+    def rebuild(self):
+        from .models import Property
+
+        return Property.objects.update(search_vector=self.vector())
+
+
+class SQLiteSearchBackend:
+    """FTS5 full-text search with bm25 ranking (development fallback)."""
+
+    @staticmethod
+    def match_expression(q):
+        # Quote every term so user input can never be FTS5 query syntax
+        terms = _TERM.findall(q)
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def search(self, queryset, q):
+        match = self.match_expression(q)
+        if not match:
+            return _no_matches(queryset)
+        table = queryset.model._meta.db_table
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        # bm25() is lower-is-better; negate it so higher ranks are better
+        rank = RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id',
+            (match,),
+            output_field=FloatField(),
+        )
+        matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+        return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+    def _rows(self, properties):
+        for pk, title, location, city, country, description in properties:
+            yield pk, title, ' '.join(filter(None, (location, city, country))), description
+
+    def index(self, property_ids):
+        from .models import Property
+
+        properties = Property.objects.filter(pk__in=property_ids).values_list('pk', *INDEXED_FIELDS)
+        with connection.cursor() as cursor:
+            self._delete(cursor, property_ids)
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, location, description) VALUES (%s, %s, %s, %s)',
+                list(self._rows(properties)),
+            )
+
+    def remove(self, property_ids):
+        with connection.cursor() as cursor:
+            self._delete(cursor, property_ids)
+
+    def _delete(self, cursor, property_ids):
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in property_ids])
+
+    def rebuild(self):
+        from .models import Property
+
+        properties = Property.objects.values_list('pk', *INDEXED_FIELDS).iterator(chunk_size=2000)
+        count = 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            batch = []
+            for row in self._rows(properties):
+                batch.append(row)
+                if len(batch) >= 2000:
+                    count += self._insert(cursor, batch)
+                    batch = []
+            count += self._insert(cursor, batch)
+        return count
+
+    def _insert(self, cursor, rows):
+        if rows:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, location, description) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+        return len(rows)
+
+
+class BasicSearchBackend:
+    """icontains fallback for databases without a full-text backend here."""
+
+    def search(self, queryset, q):
+        terms = _TERM.findall(q)
+        if not terms:
+            return _no_matches(queryset)
+        rank = Value(0, output_field=IntegerField())
+        for term in terms:
+            in_title = Q(**{f'{TITLE_FIELDS[0]}__icontains': term})
+            in_location = Q()
+            for field in LOCATION_FIELDS:
+                in_location |= Q(**{f'{field}__icontains': term})
+            in_body = Q(**{f'{BODY_FIELDS[0]}__icontains': term})
+            queryset = queryset.filter(in_title | in_location | in_body)
+            rank = rank + Case(
+                When(in_title, then=Value(3)),
+                When(in_location, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        return queryset.annotate(search_rank=rank)
+
+    def index(self, property_ids):
+        pass
+
+    def remove(self, property_ids):
+        pass
+
+    def rebuild(self):
+        return 0
+
+
+def get_search_backend():
+    """Return the search backend for the default database."""
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite' and fts_available():
+        return SQLiteSearchBackend()
+    return BasicSearchBackend()
+
+
+_fts_available = None
+
+
+def fts_available():
+    """True if the SQLite FTS5 table exists (created by the properties migrations)."""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+def search(queryset, q):
+    """Filter ``queryset`` to properties matching ``q``, annotated with ``search_rank``."""
+    return get_search_backend().search(queryset, q)
+
+
+def index_properties(property_ids):
+    """Refresh the search index for ``property_ids`` (called on save)."""
+    get_search_backend().index(list(property_ids))
+
+
+def remove_properties(property_ids):
+    """Drop ``property_ids`` from the search index (called on delete)."""
+    get_search_backend().remove(list(property_ids))
+
+
+def rebuild_index():
+    """Rebuild the search index for every property; returns the rows indexed."""
+    return get_search_backend().rebuild()
@@ -39,6 +39,7 @@ class PropertySerializer(serializers.ModelSerializer):
     reviews = ReviewSerializer(many=True, read_only=True)
     average_rating = serializers.ReadOnlyField()
     review_count = serializers.ReadOnlyField()
+    rating_histogram = serializers.ReadOnlyField()
     display_price = serializers.ReadOnlyField()
     
     # Backward compatibility
@@ -52,10 +53,10 @@ class PropertySerializer(serializers.ModelSerializer):
             'latitude', 'longitude', 'bedrooms', 'bathrooms', 'beds', 'max_guests',
             'square_feet', 'wifi', 'kitchen', 'parking', 'pool', 'air_conditioning',
             'heating', 'tv', 'washer', 'dryer', 'image', 'image_url', 'is_active',
-            'is_featured', 'reviews', 'average_rating', 'review_count',
+            'is_featured', 'reviews', 'average_rating', 'review_count', 'rating_histogram',
             'display_price', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'average_rating', 'review_count']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'average_rating', 'review_count', 'rating_histogram']
     
     def create(self, validated_data):
         """Create property with host from request"""
@@ -77,7 +78,12 @@ class PropertySerializer(serializers.ModelSerializer):
 
 
 class PropertyListSerializer(serializers.ModelSerializer):
-    """Simplified serializer for property listings"""
+    """
+    Simplified serializer for property listings.
+
+    Ratings come from Property's stored aggregates; with
+    ``select_related('host')`` a page of any size is a single query.
+    """
     host_name = serializers.SerializerMethodField()
     average_rating = serializers.ReadOnlyField()
     review_count = serializers.ReadOnlyField()
@@ -88,11 +94,19 @@ class PropertyListSerializer(serializers.ModelSerializer):
         model = Property
         fields = [
             'id', 'title', 'description', 'property_type', 'price_per_night', 'price',
-            'location', 'city', 'country', 'bedrooms', 'bathrooms', 'beds', 'max_guests',
+            'location', 'city', 'country', 'latitude', 'longitude', 'bedrooms', 'bathrooms', 'beds', 'max_guests',
             'wifi', 'kitchen', 'parking', 'pool', 'image_url', 'is_featured',
             'host_name', 'average_rating', 'review_count', 'display_price', 'created_at'
         ]
     
+    def to_representation(self, instance):
+        """Add distance_km for ?near= results"""
+        data = super().to_representation(instance)
+        distance = getattr(instance, 'distance_km', None)
+        if distance is not None:
+            data['distance_km'] = round(distance, 3)
+        return data
+    
     def get_host_name(self, obj):
         """Get host name"""
         if obj.host:
@@ -0,0 +1,74 @@
+"""
+Signal handlers for the properties app.
+
+Keep Property's denormalized rating aggregates in step with its approved
+reviews (see ratings.py). Review.save() and delete() run in a transaction,
+so a review and its rating deltas are committed together.
+
+Keep the full-text search index in step with property text (see search.py)
+and drop cached facet counts when any property changes (see facets.py).
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .facets import bump_version as invalidate_facets
+from .models import Property, Review
+from .ratings import apply_delta
+from .search import INDEXED_FIELDS, index_properties, remove_properties
+
+
+@receiver(post_save, sender=Property)
+def update_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Reindex a property when any of its searchable fields may have changed."""
+    if raw:
+        return
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    index_properties([instance.pk])
+
+
+@receiver(post_delete, sender=Property)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_properties([instance.pk])
+
+
+@receiver(post_save, sender=Property)
+@receiver(post_delete, sender=Property)
+def invalidate_facet_counts(sender, **kwargs):
+    invalidate_facets()
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    """Record what the review contributed before this save."""
+    instance._previous_rating = None
+    if raw or instance.pk is None:
+        return
+    instance._previous_rating = (
+        Review.objects.select_for_update()
+        .filter(pk=instance.pk)
+        .values_list('property_id', 'rating', 'is_approved')
+        .first()
+    )
+
+
+@receiver(post_save, sender=Review)
+def update_ratings_on_save(sender, instance, raw=False, **kwargs):
+    """Move the review's contribution from its previous state to the new one."""
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    current = (instance.property_id, instance.rating, instance.is_approved)
+    if previous == current:
+        return
+    if previous is not None and previous[2]:
+        apply_delta(previous[0], previous[1], -1)
+    if instance.is_approved:
+        apply_delta(instance.property_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def update_ratings_on_delete(sender, instance, **kwargs):
+    """Remove a deleted approved review from its property's aggregates."""
+    if instance.is_approved:
+        apply_delta(instance.property_id, instance.rating, -1)
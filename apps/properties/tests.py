@@ -1,3 +1,478 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from . import facets, geo, ratings
+from .models import Property, Review
+from .search import BasicSearchBackend, search
+
+
+LIST_URL = '/api/properties/api/properties/'
+
+
+def make_property(**fields):
+    fields.setdefault('title', 'Loft')
+    fields.setdefault('description', 'A bright loft')
+    fields.setdefault('price_per_night', Decimal('100.00'))
+    fields.setdefault('location', 'Lisbon')
+    return Property.objects.create(**fields)
+
+
+def list_properties(client, url=LIST_URL, **params):
+    response = client.get(url, params)
+    assert response.status_code == 200, response.content
+    return response.json()
+
+
+def review(prop, rating, **fields):
+    fields.setdefault('comment', 'Nice stay')
+    return Review.objects.create(property=prop, rating=rating, **fields)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.property = make_property()
+
+    def ratings(self, prop=None):
+        prop = Property.objects.get(pk=(prop or self.property).pk)
+        return prop.rating_count, prop.rating_sum, prop.rating_histogram
+
+    def test_reviews_update_the_aggregates(self):
+        review(self.property, 5)
+        review(self.property, 3)
+        review(self.property, 5)
+
+        prop = Property.objects.get(pk=self.property.pk)
+        self.assertEqual(self.ratings(), (3, 13, {'1': 0, '2': 0, '3': 1, '4': 0, '5': 2}))
+        self.assertEqual(prop.average_rating, 4.33)
+        self.assertEqual(prop.review_count, 3)
+
+    def test_only_approved_reviews_count(self):
+        pending = review(self.property, 2, is_approved=False)
+        self.assertEqual(self.ratings()[:2], (0, 0))
+
+        pending.is_approved = True
+        pending.save()
+        self.assertEqual(self.ratings()[:2], (1, 2))
+
+        pending.is_approved = False
+        pending.save()
+        self.assertEqual(self.ratings()[:2], (0, 0))
+
+    def test_edits_moves_and_deletions(self):
+        other = make_property(title='Cabin')
+        rated = review(self.property, 4)
+
+        rated.rating = 1
+        rated.save()
+        self.assertEqual(self.ratings(), (1, 1, {'1': 1, '2': 0, '3': 0, '4': 0, '5': 0}))
+
+        rated.property = other
+        rated.save()
+        self.assertEqual(self.ratings()[:2], (0, 0))
+        self.assertEqual(self.ratings(other)[:2], (1, 1))
+
+        rated.delete()
+        self.assertEqual(self.ratings(other)[:2], (0, 0))
+
+    def test_saving_a_stale_property_keeps_its_ratings(self):
+        stale = Property.objects.get(pk=self.property.pk)
+        review(self.property, 5)
+
+        stale.title = 'Renamed loft'
+        stale.save()
+
+        prop = Property.objects.get(pk=self.property.pk)
+        self.assertEqual((prop.title, prop.rating_count, prop.rating_sum), ('Renamed loft', 1, 5))
+
+    def test_update_fields_can_write_the_ratings(self):
+        self.property.rating_count = 3
+        self.property.save(update_fields=['rating_count'])
+
+        self.assertEqual(self.ratings()[0], 3)
+
+    def test_saving_a_deleted_property_inserts_it_again(self):
+        stale = Property.objects.get(pk=self.property.pk)
+        Property.objects.filter(pk=stale.pk).delete()
+
+        stale.title = 'Restored loft'
+        stale.save()
+
+        self.assertEqual(Property.objects.get(pk=stale.pk).title, 'Restored loft')
+
+    def test_recompute_repairs_drift(self):
+        other = make_property(title='Cabin')
+        review(self.property, 4)
+        review(other, 2)
+        # Bypasses the signals
+        Review.objects.filter(property=self.property).update(rating=1)
+        Property.objects.filter(pk=other.pk).update(rating_count=7)
+
+        self.assertEqual(ratings.recompute([self.property.pk]), 1)
+        self.assertEqual(self.ratings(), (1, 1, {'1': 1, '2': 0, '3': 0, '4': 0, '5': 0}))
+        self.assertEqual(self.ratings(other)[0], 7)
+
+        out = io.StringIO()
+        call_command('recompute_ratings', stdout=out)
+        self.assertIn('1 property(ies) corrected', out.getvalue())
+        self.assertEqual(self.ratings(other)[0], 1)
+        self.assertEqual(ratings.recompute(), 0)
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class APITestCase(TestCase):
+    """Requests go through the security middleware; keep them out of RequestLog."""
+
+    def setUp(self):
+        patcher = mock.patch('apps.security.middleware.get_sinks', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ListingPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.properties = [make_property(title=f'Home {i}', is_featured=i in (2, 5)) for i in range(7)]
+        # Ties on created_at are broken by id
+        Property.objects.filter(pk__in=[prop.pk for prop in self.properties[:4]]).update(
+            created_at=datetime(2024, 3, 10, tzinfo=dt_timezone.utc)
+        )
+        self.expected = list(
+            Property.objects.order_by('-is_featured', '-created_at', '-id').values_list('id', flat=True)
+        )
+
+    def walk(self, page):
+        ids = [row['id'] for row in page['results']]
+        while page['next']:
+            page = list_properties(self.client, page['next'])
+            ids += [row['id'] for row in page['results']]
+        return ids
+
+    def test_featured_first_then_newest(self):
+        self.assertEqual(self.expected[:2], [self.properties[5].pk, self.properties[2].pk])
+        self.assertEqual(self.walk(list_properties(self.client, page_size=2)), self.expected)
+
+    def test_new_listings_do_not_shift_later_pages(self):
+        first = list_properties(self.client, page_size=2)
+        # Sorts before the cursor, so it is not seen; the newest regular
+        # listing sorts after it and is, without skipping or repeating rows
+        make_property(title='Newcomer', is_featured=True)
+        newest = make_property(title='Newcomer 2')
+
+        self.assertEqual(self.walk(first), self.expected[:2] + [newest.pk] + self.expected[2:])
+
+    def test_large_pages_are_streamed(self):
+        response = self.client.get(LIST_URL, {'page_size': 500})
+
+        self.assertTrue(response.streaming)
+        page = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(([row['id'] for row in page['results']], page['next']), (self.expected, None))
+
+    def test_invalid_cursors_are_rejected(self):
+        self.assertEqual(self.client.get(LIST_URL, {'cursor': 'garbage'}).status_code, 404)
+
+    def test_listing_parameters_do_not_apply_to_details(self):
+        prop = self.properties[0]
+        self.assertEqual(self.client.get(LIST_URL, {'near': 'abc'}).status_code, 400)
+
+        response = self.client.get(f'{LIST_URL}{prop.pk}/', {'near': 'abc', 'min_price': 'abc'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], prop.pk)
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.in_title = make_property(title='Porto riverside flat', location='Gaia', description='Quiet street')
+        self.in_location = make_property(title='Old town loft', location='Porto', description='Near the river')
+        self.in_description = make_property(title='Beach house', location='Foz', description='A bus to Porto')
+        self.unrelated = make_property(title='Mountain cabin', location='Manteigas', description='Snow')
+
+    def ids(self, **params):
+        return [row['id'] for row in list_properties(self.client, **params)['results']]
+
+    def test_ranked_by_field(self):
+        expected = [self.in_title.pk, self.in_location.pk, self.in_description.pk]
+        self.assertEqual(self.ids(q='porto'), expected)
+        self.assertEqual(
+            list(search(Property.objects.all(), 'porto').order_by('-search_rank').values_list('id', flat=True)),
+            expected,
+        )
+
+    def test_all_terms_are_required(self):
+        self.assertEqual(self.ids(q='porto quiet'), [self.in_title.pk])
+
+    def test_query_syntax_never_errors(self):
+        for q in ('porto OR "cabin', '"*:(', 'NEAR(porto cabin)', '!!', "porto & | ! ':*"):
+            with self.subTest(q=q):
+                self.assertEqual(self.client.get(LIST_URL, {'q': q}).status_code, 200)
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 backend')
+    def test_sqlite_terms_are_literal_prefixes(self):
+        self.assertEqual(self.ids(q='riv'), [self.in_title.pk, self.in_location.pk])
+        self.assertEqual(self.ids(q='porto OR "cabin'), [])
+        self.assertEqual(self.ids(q='"*:('), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.unrelated.title = 'Porto hideaway'
+        self.unrelated.save()
+        self.in_title.delete()
+
+        self.assertEqual(self.ids(q='porto')[0], self.unrelated.pk)
+        self.assertNotIn(self.in_title.pk, self.ids(q='porto'))
+
+    def test_rebuild_picks_up_writes_that_bypass_signals(self):
+        Property.objects.filter(pk=self.unrelated.pk).update(title='Porto hideaway')
+        self.assertNotIn(self.unrelated.pk, self.ids(q='hideaway'))
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+
+        self.assertIn('Indexed 4 property(ies)', out.getvalue())
+        self.assertEqual(self.ids(q='hideaway'), [self.unrelated.pk])
+
+    def test_result_pages_follow_the_ranking(self):
+        # Equal ranks are broken by id
+        extra = [make_property(title='Porto studio', location='Gaia', description='Quiet street') for _ in range(3)]
+        expected = self.ids(q='porto', page_size=50)
+
+        page = list_properties(self.client, q='porto', page_size=2)
+        ids = [row['id'] for row in page['results']]
+        while page['next']:
+            page = list_properties(self.client, page['next'])
+            ids += [row['id'] for row in page['results']]
+
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(ids), 6)
+        tied = [pk for pk in ids if pk in {prop.pk for prop in extra}]
+        self.assertEqual(tied, [prop.pk for prop in reversed(extra)])
+        self.assertEqual(ids.index(tied[-1]) - ids.index(tied[0]), 2)
+
+    def test_search_combines_with_filters(self):
+        self.assertEqual(self.ids(q='porto', location='gaia'), [self.in_title.pk])
+
+    def test_basic_backend(self):
+        results = BasicSearchBackend().search(Property.objects.all(), 'porto').order_by('-search_rank', '-id')
+
+        self.assertEqual(
+            [(prop.pk, prop.search_rank) for prop in results],
+            [(self.in_title.pk, 3), (self.in_location.pk, 2), (self.in_description.pk, 1)],
+        )
+        self.assertFalse(BasicSearchBackend().search(Property.objects.all(), '!!').exists())
+
+
+class GeohashTests(TestCase):
+    def test_encode(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744), 'u4pruydqq')
+        self.assertEqual(geo.encode(Decimal('-33.868820'), Decimal('151.209296'), 5), 'r3gx2')
+        self.assertEqual(geo.encode(None, 10.0), '')
+
+    def test_migration_uses_the_same_encoding(self):
+        migration = importlib.import_module('apps.properties.migrations.0006_property_geohash')
+        for point in ((57.64911, 10.40744), (-90, -180), (90, 180), (0, 0), (38.7223, -9.1393)):
+            self.assertEqual(migration.encode(*point), geo.encode(*point))
+
+    def test_cover_contains_the_box(self):
+        south, west, north, east = 38.69, -9.23, 38.80, -9.09
+        cells = geo.cover(south, west, north, east)
+
+        self.assertLessEqual(len(cells), geo.MAX_CELLS)
+        for lat in (south, (south + north) / 2, north):
+            for lng in (west, (west + east) / 2, east):
+                self.assertTrue(any(geo.encode(lat, lng).startswith(cell) for cell in cells), (lat, lng))
+        self.assertEqual(geo.cover(-90, -180, 90, 180, max_cells=1), [''])
+
+    def test_save_keeps_the_geohash_current(self):
+        prop = make_property(latitude=Decimal('38.722300'), longitude=Decimal('-9.139300'))
+        self.assertEqual(prop.geohash, geo.encode(38.7223, -9.1393))
+
+        prop.latitude = Decimal('41.149600')
+        prop.save(update_fields=['latitude'])
+        self.assertEqual(Property.objects.get(pk=prop.pk).geohash, geo.encode(41.1496, -9.1393))
+
+    def test_rebuild_geohashes(self):
+        prop = make_property(latitude=Decimal('38.722300'), longitude=Decimal('-9.139300'))
+        make_property()
+        Property.objects.filter(pk=prop.pk).update(latitude=Decimal('41.149600'))
+
+        out = io.StringIO()
+        call_command('rebuild_geohashes', stdout=out)
+
+        self.assertIn('Updated 1 property geohash(es)', out.getvalue())
+        self.assertEqual(Property.objects.get(pk=prop.pk).geohash, geo.encode(41.1496, -9.1393))
+        self.assertEqual(geo.rebuild_geohashes(), 0)
+
+    def test_parse_errors(self):
+        for value in ('', '1,2,3', '1,2,3,x', 'nan,0,1,1', '-10,50,10,40', '-200,0,10,10'):
+            with self.subTest(bbox=value), self.assertRaises(ValueError):
+                geo.parse_bbox(value)
+        for value, radius in (('abc', None), ('91,0', None), ('0,0', '0'), ('0,0', '501'), ('0,0', 'x')):
+            with self.subTest(near=value, radius_km=radius), self.assertRaises(ValueError):
+                geo.parse_near(value, radius)
+        self.assertEqual(geo.parse_near('1,2', ''), (1.0, 2.0, geo.DEFAULT_RADIUS_KM))
+
+
+def place(title, latitude, longitude, **fields):
+    return make_property(title=title, latitude=Decimal(f'{latitude:.6f}'), longitude=Decimal(f'{longitude:.6f}'), **fields)
+
+
+class GeoQueryTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.baixa = place('Baixa', 38.7110, -9.1370)
+        self.alfama = place('Alfama', 38.7117, -9.1300)
+        self.belem = place('Belem', 38.6970, -9.2060)
+        self.porto = place('Porto', 41.1496, -8.6110)
+        self.fiji = place('Fiji', -17.7134, 178.0650)
+        self.samoa = place('Samoa', -13.7590, -172.1046)
+        make_property(title='Nowhere')
+
+    def ids(self, **params):
+        return [row['id'] for row in list_properties(self.client, **params)['results']]
+
+    def test_bbox(self):
+        self.assertEqual(
+            set(self.ids(bbox='-9.25,38.65,-9.10,38.75')), {self.baixa.pk, self.alfama.pk, self.belem.pk},
+        )
+        self.assertEqual(set(self.ids(bbox='-9.135,38.70,-9.10,38.75')), {self.alfama.pk})
+
+    def test_bbox_across_the_antimeridian(self):
+        self.assertEqual(set(self.ids(bbox='170,-20,-170,-10')), {self.fiji.pk, self.samoa.pk})
+
+    def test_near_sorts_by_distance(self):
+        results = list_properties(self.client, near='38.7110,-9.1370', radius_km='10')['results']
+
+        self.assertEqual([row['id'] for row in results], [self.baixa.pk, self.alfama.pk, self.belem.pk])
+        self.assertEqual(results[0]['distance_km'], 0)
+        self.assertAlmostEqual(results[1]['distance_km'], 0.613, delta=0.01)
+        self.assertNotIn(self.porto.pk, self.ids(near='38.7110,-9.1370', radius_km='250'))
+        self.assertIn(self.porto.pk, self.ids(near='38.7110,-9.1370', radius_km='300'))
+
+    def test_distance_pages(self):
+        # Spread out so the walk crosses several search rings
+        spread = [place(f'Ring {i}', 38.7110 + i * 0.01, -9.1370) for i in range(1, 8)]
+        expected = list_properties(self.client, near='38.7110,-9.1370', radius_km='50', page_size=50)['results']
+
+        page = list_properties(self.client, near='38.7110,-9.1370', radius_km='50', page_size=2)
+        rows = page['results']
+        while page['next']:
+            page = list_properties(self.client, page['next'])
+            rows += page['results']
+
+        self.assertEqual(rows, expected)
+        self.assertEqual(len(rows), 3 + len(spread))
+        distances = [row['distance_km'] for row in rows]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_geo_filters_combine_with_others(self):
+        self.assertEqual(self.ids(near='38.7110,-9.1370', q='alfama'), [self.alfama.pk])
+
+    def test_malformed_parameters(self):
+        for params in ({'bbox': '1,2,3'}, {'near': 'abc'}, {'near': '0,0', 'radius_km': '900'}):
+            with self.subTest(params=params):
+                response = self.client.get(LIST_URL, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+FACETS_URL = f'{LIST_URL}facets/'
+
+
+class FacetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.host = get_user_model().objects.create_user('host@example.com', 'secret-pass-1')
+        make_property(price_per_night=Decimal('49.99'), bedrooms=0, property_type='studio', wifi=True)
+        make_property(price_per_night=Decimal('50.00'), bedrooms=2, wifi=True, pool=True, host=self.host)
+        make_property(price_per_night=Decimal('150.00'), bedrooms=5, property_type='villa', location='Porto')
+        make_property(price_per_night=Decimal('900.00'), bedrooms=7, property_type='villa', pool=True)
+        make_property(price_per_night=Decimal('75.00'), is_active=False, wifi=True)
+
+    def get_facets(self, **params):
+        response = self.client.get(FACETS_URL, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_counts(self):
+        counts = self.get_facets()
+
+        self.assertEqual(counts['total'], 4)
+        self.assertEqual(
+            counts['property_type'],
+            {'apartment': 1, 'house': 0, 'condo': 0, 'villa': 2, 'studio': 1, 'other': 0},
+        )
+        self.assertEqual([bucket['count'] for bucket in counts['price']], [1, 1, 1, 0, 1])
+        self.assertEqual(counts['price'][1], {'label': '50-100', 'min': 50, 'max': 100, 'count': 1})
+        self.assertEqual(counts['bedrooms'], {'0': 1, '1': 0, '2': 1, '3': 0, '4': 0, '5+': 2})
+        self.assertEqual((counts['amenities']['wifi'], counts['amenities']['pool']), (2, 2))
+
+    def test_counts_follow_the_listing_filters(self):
+        counts = self.get_facets(type='villa', min_price='100')
+        self.assertEqual((counts['total'], counts['property_type']['villa']), (2, 2))
+
+        self.assertEqual(self.get_facets(location='porto')['total'], 1)
+        self.assertEqual(self.get_facets(host=str(self.host.user_id))['total'], 1)
+        self.assertEqual(self.get_facets(q='loft', max_price='50')['total'], 2)
+
+    def test_counts_are_cached_until_a_property_changes(self):
+        self.assertEqual(self.get_facets(min_price='100')['total'], 2)
+        queryset = Property.objects.filter(is_active=True)
+        with self.assertNumQueries(0):
+            cached = facets.get_facets(queryset, {'min_price': '100', 'page_size': '5'})
+        self.assertEqual(cached['total'], 2)
+
+        make_property(price_per_night=Decimal('300.00'))
+
+        self.assertEqual(self.get_facets(min_price='100')['total'], 3)
+
+    def test_cache_keys(self):
+        self.assertEqual(
+            facets.cache_key({'location': 'porto', 'type': 'villa', 'cursor': 'abc'}),
+            facets.cache_key({'type': 'villa', 'location': 'porto'}),
+        )
+        self.assertNotEqual(facets.cache_key({'type': 'villa'}), facets.cache_key({'type': 'house'}))
+        self.assertIsNone(facets.cache_key({'bbox': '-10,35,0,45'}))
+        self.assertIsNone(facets.cache_key({'near': '38.7,-9.1'}))
+
+        key = facets.cache_key({'type': 'villa'})
+        facets.bump_version()
+        self.assertNotEqual(facets.cache_key({'type': 'villa'}), key)
+
+    @override_settings(PROPERTY_FACETS_CACHE_TIMEOUT=0)
+    def test_caching_can_be_disabled(self):
+        self.get_facets()
+        with self.assertNumQueries(1):
+            facets.get_facets(Property.objects.filter(is_active=True), {})
+
+
+class ListingFilterErrorTests(APITestCase):
+    def test_malformed_filters_are_rejected(self):
+        bad = (
+            {'min_price': 'abc'}, {'max_price': '-1'}, {'min_price': 'Infinity'}, {'max_price': 'NaN'},
+            {'host': 'not-a-uuid'}, {'host': '42'},
+            {'bbox': '1,2,3'}, {'bbox': '0,50,10,40'}, {'near': 'abc'}, {'near': '0,0', 'radius_km': '-1'},
+        )
+        for url in (LIST_URL, FACETS_URL):
+            for params in bad:
+                with self.subTest(url=url, params=params):
+                    response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('error', response.json())
+
+    def test_blank_filters_are_ignored(self):
+        make_property()
+        for url in (LIST_URL, FACETS_URL):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'min_price': ' ', 'max_price': '', 'host': '', 'bbox': ''})
+                self.assertEqual(response.status_code, 200)
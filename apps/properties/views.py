@@ -6,8 +6,12 @@ from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.viewsets import ModelViewSet
-from django.db.models import Q
+from . import geo
+from .facets import get_facets
+from .filters import filter_properties
 from .models import Property, Review
+from .pagination import PropertyKeysetPagination, pagination_for
+from .search import search
 from .serializers import PropertySerializer, PropertyListSerializer, ReviewSerializer
 from .utils import get_all_properties, get_redis_cache_metrics
 
@@ -16,6 +20,14 @@ class PropertyViewSet(ModelViewSet):
     """ViewSet for Property model"""
     queryset = Property.objects.filter(is_active=True)
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = PropertyKeysetPagination
+    
+    @property
+    def paginator(self):
+        """Distance pagination for ?near=, ranked for ?q=, keyset pagination otherwise"""
+        if not hasattr(self, '_paginator'):
+            self._paginator = pagination_for(self.request)
+        return self._paginator
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -24,40 +36,28 @@ class PropertyViewSet(ModelViewSet):
     
     def get_queryset(self):
         queryset = Property.objects.filter(is_active=True)
+        if self.action != 'list':
+            # Listing parameters (and their ordering) only apply to list()
+            return queryset
         
-        # Filter by host if provided
-        host_id = self.request.query_params.get('host', None)
-        if host_id:
-            queryset = queryset.filter(host__user_id=host_id)
+        # Listing filters, shared with facets(); raises ValueError on bad input
+        queryset = filter_properties(queryset.select_related('host'), self.request.query_params)
         
-        # Filter by location
-        location = self.request.query_params.get('location', None)
-        if location:
-            queryset = queryset.filter(
-                Q(location__icontains=location) |
-                Q(city__icontains=location) |
-                Q(country__icontains=location)
+        return queryset.order_by(*self.paginator.ordering)
+    
+    def list(self, request, *args, **kwargs):
+        """Keyset-paginated listing; large pages are streamed"""
+        try:
+            queryset = self.filter_queryset(self.get_queryset())
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if self.paginator.should_stream(request):
+            return self.paginator.get_streaming_response(
+                queryset, request, self.get_serializer_class(), self.get_serializer_context()
             )
-        
-        # Filter by property type
-        property_type = self.request.query_params.get('type', None)
-        if property_type:
-            queryset = queryset.filter(property_type=property_type)
-        
-        # Filter by price range
-        min_price = self.request.query_params.get('min_price', None)
-        max_price = self.request.query_params.get('max_price', None)
-        if min_price:
-            queryset = queryset.filter(price_per_night__gte=min_price)
-        if max_price:
-            queryset = queryset.filter(price_per_night__lte=max_price)
-        
-        # Filter featured
-        featured = self.request.query_params.get('featured', None)
-        if featured and featured.lower() == 'true':
-            queryset = queryset.filter(is_featured=True)
-        
-        return queryset.order_by('-is_featured', '-created_at')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     def perform_create(self, serializer):
         """Set host to current user if authenticated"""
@@ -66,6 +66,18 @@ class PropertyViewSet(ModelViewSet):
         else:
             serializer.save()
     
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Facet counts (property type, price bucket, bedrooms, amenities) for
+        the listing the same query parameters return; see facets.py
+        """
+        try:
+            queryset = filter_properties(Property.objects.filter(is_active=True), request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_facets(queryset, request.query_params))
+    
     @action(detail=True, methods=['get'])
     def reviews(self, request, pk=None):
         """Get reviews for a property"""
@@ -125,10 +137,29 @@ class ReviewViewSet(ModelViewSet):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def property_list_api(request):
-    """API endpoint to list all properties (public)"""
-    properties = Property.objects.filter(is_active=True).order_by('-is_featured', '-created_at')
-    serializer = PropertyListSerializer(properties, many=True)
-    return Response(serializer.data)
+    """
+    API endpoint to list active properties (public).
+
+    Keyset-paginated: follow ``next`` to load further pages; pages larger
+    than PropertyKeysetPagination.stream_threshold are streamed. ``q``
+    runs a ranked full-text search over title, location and description.
+    ``bbox=west,south,east,north`` limits results to a map area and
+    ``near=lat,lng&radius_km=`` to a radius, nearest first (see geo.py).
+    """
+    properties = Property.objects.filter(is_active=True).select_related('host')
+    try:
+        properties = geo.filter_queryset(properties, request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    q = request.query_params.get('q', '').strip()
+    if q:
+        properties = search(properties, q)
+    paginator = pagination_for(request)
+    if paginator.should_stream(request):
+        return paginator.get_streaming_response(properties, request, PropertyListSerializer)
+    page = paginator.paginate_queryset(properties, request)
+    serializer = PropertyListSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
@@ -2,24 +2,41 @@
 Django Admin configuration for IP Tracking models.
 """
 from django.contrib import admin
-from .models import RequestLog, BlockedIP, SuspiciousIP
+from .models import (
+    RequestLog, RequestRoute, BlockedIP, SuspiciousIP,
+    HourlyIPTraffic, HourlyPathTraffic, HourlyCountryTraffic,
+    AnomalyBackfillRun, AnomalyBackfillScore,
+)
 
 
 @admin.register(RequestLog)
 class RequestLogAdmin(admin.ModelAdmin):
     """Admin interface for RequestLog model."""
-    list_display = ['ip_address', 'path', 'method', 'country', 'city', 'timestamp', 'user']
-    list_filter = ['method', 'country', 'timestamp', 'path']
-    search_fields = ['ip_address', 'path', 'country', 'city']
+    list_display = [
+        'ip_address', 'route', 'path', 'method', 'status_code', 'duration_us', 'db_queries',
+        'country', 'city', 'timestamp', 'user',
+    ]
+    list_filter = ['method', 'status_code', 'country', 'timestamp']
+    list_select_related = ['route', 'user']
+    search_fields = ['ip_address', 'path', 'route__route', 'country', 'city']
     readonly_fields = ['timestamp']
     date_hierarchy = 'timestamp'
     list_per_page = 50
 
 
+@admin.register(RequestRoute)
+class RequestRouteAdmin(admin.ModelAdmin):
+    """Admin interface for RequestRoute model."""
+    list_display = ['route', 'view_name', 'is_sensitive', 'first_seen']
+    list_filter = ['is_sensitive']
+    search_fields = ['route', 'view_name']
+    readonly_fields = ['first_seen']
+
+
 @admin.register(BlockedIP)
 class BlockedIPAdmin(admin.ModelAdmin):
     """Admin interface for BlockedIP model."""
-    list_display = ['ip_address', 'reason', 'created_at', 'created_by']
+    list_display = ['ip_address', 'prefix_length', 'reason', 'created_at', 'created_by']
     list_filter = ['created_at']
     search_fields = ['ip_address', 'reason']
     readonly_fields = ['created_at']
@@ -38,13 +55,59 @@ class SuspiciousIPAdmin(admin.ModelAdmin):
 
     def block_selected_ips(self, request, queryset):
         """Action to block selected suspicious IPs."""
-        from .models import BlockedIP
-        count = 0
-        for suspicious_ip in queryset:
-            BlockedIP.objects.get_or_create(
-                ip_address=suspicious_ip.ip_address,
-                defaults={'reason': f'Auto-blocked: {suspicious_ip.reason}'}
-            )
-            count += 1
+        from .blocklist import bulk_block
+        entries = [
+            (ip_address, None, f'Auto-blocked: {reason}')
+            for ip_address, reason in queryset.values_list('ip_address', 'reason')
+        ]
+        count = bulk_block(entries, created_by=request.user)
         self.message_user(request, f'{count} IP(s) blocked successfully.')
     block_selected_ips.short_description = "Block selected IPs"
+
+
+@admin.register(HourlyIPTraffic)
+class HourlyIPTrafficAdmin(admin.ModelAdmin):
+    """Admin interface for HourlyIPTraffic rollups."""
+    list_display = ['hour', 'ip_address', 'request_count', 'sensitive_count']
+    search_fields = ['ip_address']
+    date_hierarchy = 'hour'
+    list_per_page = 50
+
+
+@admin.register(HourlyPathTraffic)
+class HourlyPathTrafficAdmin(admin.ModelAdmin):
+    """Admin interface for HourlyPathTraffic rollups."""
+    list_display = ['hour', 'path', 'request_count']
+    search_fields = ['path']
+    date_hierarchy = 'hour'
+    list_per_page = 50
+
+
+@admin.register(HourlyCountryTraffic)
+class HourlyCountryTrafficAdmin(admin.ModelAdmin):
+    """Admin interface for HourlyCountryTraffic rollups."""
+    list_display = ['hour', 'country', 'request_count']
+    list_filter = ['country']
+    date_hierarchy = 'hour'
+    list_per_page = 50
+
+
+@admin.register(AnomalyBackfillRun)
+class AnomalyBackfillRunAdmin(admin.ModelAdmin):
+    """Admin interface for historical anomaly backfill runs."""
+    list_display = [
+        'id', 'start', 'end', 'window_minutes', 'volume_threshold', 'sensitive_threshold',
+        'model_version', 'status', 'windows_done', 'windows_total', 'flagged_count', 'started_at',
+    ]
+    list_filter = ['status']
+    readonly_fields = ['started_at', 'finished_at']
+
+
+@admin.register(AnomalyBackfillScore)
+class AnomalyBackfillScoreAdmin(admin.ModelAdmin):
+    """Admin interface for per-window backfill results."""
+    list_display = ['run', 'window_start', 'ip_address', 'request_count', 'sensitive_path_count', 'anomaly_score', 'flagged_by']
+    list_filter = ['run', 'flagged_by']
+    list_select_related = ['run']
+    search_fields = ['ip_address']
+    list_per_page = 50
@@ -0,0 +1,32 @@
+"""
+Database aggregates used by the anomaly detector.
+"""
+from django.db.models import Aggregate, CharField
+
+
+class DistinctConcat(Aggregate):
+    """
+    Comma-separated distinct values of an expression (NULLs are skipped).
+
+    Compiles to STRING_AGG on PostgreSQL and GROUP_CONCAT on SQLite/MySQL,
+    so distinct values can be collected in the same GROUP BY pass as the
+    other per-IP counts.
+    """
+    function = 'GROUP_CONCAT'
+    template = '%(function)s(DISTINCT %(expressions)s)'
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            function='STRING_AGG',
+            template="%(function)s(DISTINCT %(expressions)s, ',')",
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template="%(function)s(DISTINCT %(expressions)s SEPARATOR ',')",
+            **extra_context,
+        )
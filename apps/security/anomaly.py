@@ -0,0 +1,296 @@
+"""
+Vectorized anomaly features and a persisted Isolation Forest model.
+
+Feature extraction streams ``values_list`` rows from RequestLog with a
+server-side cursor straight into preallocated NumPy arrays, then computes
+per-IP features with bincount/unique instead of per-row Python:
+
+- request_count, unique_paths, sensitive_path_count (weighted by
+  sample_weight, so sampled-out requests are still accounted for)
+- get_ratio, post_ratio, other_method_ratio (method mix)
+- interarrival_mean, interarrival_std (seconds between requests)
+- path_entropy (Shannon entropy of the IP's path distribution)
+
+``train_model`` cuts a long history window into slices of the scoring
+window length, fits a StandardScaler + IsolationForest on the stacked
+per-slice features and saves them to IP_TRACKING_MODEL_DIR as a new
+version. ``score_recent`` scores one recent slice against the latest saved
+model, so scores are comparable across runs and detection can run every
+few minutes.
+"""
+import logging
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .counters import sensitive_paths
+from .models import RequestLog
+from .routes import sensitive_route_ids
+
+logger = logging.getLogger(__name__)
+
+try:
+    import joblib
+    import numpy as np
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
+    ML_AVAILABLE = True
+except ImportError:
+    ML_AVAILABLE = False
+
+FEATURE_NAMES = [
+    'request_count',
+    'unique_paths',
+    'sensitive_path_count',
+    'get_ratio',
+    'post_ratio',
+    'other_method_ratio',
+    'interarrival_mean',
+    'interarrival_std',
+    'path_entropy',
+]
+
+CHUNK_SIZE = 10_000
+_MODEL_FILE = re.compile(r'^anomaly-v(\d+)\.joblib$')
+
+
+def model_dir():
+    return getattr(settings, 'IP_TRACKING_MODEL_DIR', os.path.join(settings.BASE_DIR, 'ml_models'))
+
+
+def contamination():
+    return getattr(settings, 'IP_TRACKING_MODEL_CONTAMINATION', 0.05)
+
+
+def scoring_window_minutes():
+    return getattr(settings, 'IP_TRACKING_SCORING_WINDOW_MINUTES', 10)
+
+
+def extract_features(since, until=None):
+    """
+    Return ``(ips, X)`` where ``X[i]`` holds FEATURE_NAMES for ``ips[i]``,
+    computed from RequestLog rows in ``[since, until)``.
+    """
+    logs = RequestLog.objects.filter(timestamp__gte=since)
+    if until is not None:
+        logs = logs.filter(timestamp__lt=until)
+
+    # Upper bound for preallocation; rows inserted meanwhile are ignored.
+    n = logs.count()
+    if n == 0:
+        return [], np.empty((0, len(FEATURE_NAMES)))
+
+    ip_codes = np.empty(n, dtype=np.int64)
+    path_codes = np.empty(n, dtype=np.int64)
+    method_codes = np.empty(n, dtype=np.int8)
+    seconds = np.empty(n, dtype=np.float64)
+    weights = np.empty(n, dtype=np.float64)
+
+    ip_index = {}
+    path_index = {}
+    method_index = {'GET': 0, 'POST': 1}
+    i = 0
+    rows = (
+        logs
+        .order_by('ip_address', 'timestamp')
+        .values_list('ip_address', 'route_id', 'path', 'method', 'timestamp', 'sample_weight')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for ip, route_id, path, method, ts, weight in rows:
+        if i == n:
+            break
+        ip_codes[i] = ip_index.setdefault(ip, len(ip_index))
+        # Interned routes are keyed by id, unresolved requests by raw path
+        key = route_id if route_id is not None else path
+        path_codes[i] = path_index.setdefault(key, len(path_index))
+        method_codes[i] = method_index.get(method, 2)
+        seconds[i] = ts.timestamp()
+        weights[i] = weight
+        i += 1
+
+    ip_codes, path_codes, method_codes = ip_codes[:i], path_codes[:i], method_codes[:i]
+    seconds, weights = seconds[:i], weights[:i]
+    n_ips = len(ip_index)
+
+    # Counts are weighted: a sampled row stands for sample_weight requests
+    request_count = np.bincount(ip_codes, weights=weights, minlength=n_ips)
+
+    # Distinct (ip, path) pairs and their (weighted) counts
+    pair_keys, pair_inverse = np.unique(ip_codes * max(len(path_index), 1) + path_codes, return_inverse=True)
+    pair_counts = np.bincount(pair_inverse.ravel(), weights=weights)
+    pair_ips = pair_keys // max(len(path_index), 1)
+    unique_paths = np.bincount(pair_ips, minlength=n_ips).astype(np.float64)
+
+    sensitive_routes = set(sensitive_route_ids())
+    paths = sensitive_paths()
+    sensitive_codes = np.array(
+        [code for key, code in path_index.items() if key in paths or key in sensitive_routes],
+        dtype=np.int64,
+    )
+    sensitive = np.isin(path_codes, sensitive_codes)
+    sensitive_path_count = np.bincount(ip_codes, weights=sensitive * weights, minlength=n_ips)
+
+    method_counts = [np.bincount(ip_codes, weights=(method_codes == m) * weights, minlength=n_ips) for m in (0, 1, 2)]
+    get_ratio, post_ratio, other_ratio = (counts / request_count for counts in method_counts)
+
+    # Rows are ordered by (ip, timestamp): consecutive rows of the same IP
+    # give the inter-arrival gaps. A gap ending at a row of weight w spans w
+    # requests, so it counts as w gaps of gap / w.
+    same_ip = ip_codes[1:] == ip_codes[:-1]
+    gaps = np.diff(seconds)[same_ip]
+    gap_weights = weights[1:][same_ip]
+    gap_ips = ip_codes[1:][same_ip]
+    gap_n = np.bincount(gap_ips, weights=gap_weights, minlength=n_ips)
+    gap_sum = np.bincount(gap_ips, weights=gaps, minlength=n_ips)
+    gap_sq = np.bincount(gap_ips, weights=gaps * gaps / gap_weights, minlength=n_ips)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        interarrival_mean = np.where(gap_n > 0, gap_sum / gap_n, 0.0)
+        interarrival_var = np.where(gap_n > 0, gap_sq / gap_n - interarrival_mean ** 2, 0.0)
+    interarrival_std = np.sqrt(np.clip(interarrival_var, 0.0, None))
+
+    # Shannon entropy of each IP's path distribution
+    p = pair_counts / request_count[pair_ips]
+    path_entropy = np.bincount(pair_ips, weights=-p * np.log2(p), minlength=n_ips)
+
+    X = np.column_stack([
+        request_count,
+        unique_paths,
+        sensitive_path_count,
+        get_ratio,
+        post_ratio,
+        other_ratio,
+        interarrival_mean,
+        interarrival_std,
+        path_entropy,
+    ])
+    ips = [None] * n_ips
+    for ip, code in ip_index.items():
+        ips[code] = ip
+    return ips, X
+
+
+def _model_versions():
+    directory = model_dir()
+    if not os.path.isdir(directory):
+        return []
+    versions = []
+    for name in os.listdir(directory):
+        match = _MODEL_FILE.match(name)
+        if match:
+            versions.append(int(match.group(1)))
+    return sorted(versions)
+
+
+def load_latest_model():
+    """Return the newest saved model bundle, or None if none exists."""
+    if not ML_AVAILABLE:
+        return None
+    versions = _model_versions()
+    if not versions:
+        return None
+    return load_model(versions[-1])
+
+
+def load_model(version):
+    """Return the saved model bundle ``version``, or None if it is missing or stale."""
+    if not ML_AVAILABLE:
+        return None
+    path = os.path.join(model_dir(), f'anomaly-v{version}.joblib')
+    if not os.path.exists(path):
+        return None
+    bundle = joblib.load(path)
+    if bundle.get('features') != FEATURE_NAMES:
+        logger.warning(f"Ignoring anomaly model {path}: feature set does not match")
+        return None
+    return bundle
+
+
+def train_model(hours=24, slice_minutes=None):
+    """
+    Fit the scaler and Isolation Forest on the last ``hours`` of traffic,
+    cut into ``slice_minutes`` slices so training samples match what
+    score_recent() sees, and save them as a new model version.
+
+    Returns the bundle, or None if there is not enough data.
+    """
+    if not ML_AVAILABLE:
+        logger.warning("scikit-learn not available. Install with: pip install scikit-learn")
+        return None
+
+    slice_minutes = slice_minutes or scoring_window_minutes()
+    now = timezone.now()
+    start = now - timedelta(hours=hours)
+    step = timedelta(minutes=slice_minutes)
+    samples = []
+    while start < now:
+        _, X_slice = extract_features(start, min(start + step, now))
+        if len(X_slice):
+            samples.append(X_slice)
+        start += step
+
+    X = np.vstack(samples) if samples else np.empty((0, len(FEATURE_NAMES)))
+    if len(X) < 2:
+        logger.info("Not enough traffic to train an anomaly model")
+        return None
+
+    scaler = StandardScaler().fit(X)
+    forest = IsolationForest(contamination=contamination(), random_state=42).fit(scaler.transform(X))
+
+    version = (_model_versions() or [0])[-1] + 1
+    bundle = {
+        'version': version,
+        'features': FEATURE_NAMES,
+        'scaler': scaler,
+        'model': forest,
+        # decision_function() < 0 marks outliers at the trained contamination
+        'threshold': 0.0,
+        'trained_at': now.isoformat(),
+        'training_hours': hours,
+        'slice_minutes': slice_minutes,
+        'n_samples': len(X),
+    }
+    directory = model_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'anomaly-v{version}.joblib')
+    tmp_path = f'{path}.tmp'
+    joblib.dump(bundle, tmp_path)
+    os.replace(tmp_path, path)
+    logger.info(f"Trained anomaly model v{version} on {len(X)} IP slices ({hours}h of traffic)")
+    return bundle
+
+
+def score(ips, X, bundle):
+    """
+    Score feature rows against a saved model bundle.
+
+    Returns ``{ip: (reason, request_count)}`` for rows below the model
+    threshold.
+    """
+    if not ips:
+        return {}
+    scores = bundle['model'].decision_function(bundle['scaler'].transform(X))
+    flagged = {}
+    for i in np.flatnonzero(scores < bundle['threshold']):
+        row = X[i]
+        reason = (
+            f'ML-detected anomaly (model v{bundle["version"]}, score {scores[i]:.3f}): '
+            f'{int(row[0])} requests, {int(row[1])} unique paths, '
+            f'{int(row[2])} sensitive path accesses, path entropy {row[8]:.2f}'
+        )
+        flagged[ips[i]] = (reason, int(row[0]))
+    return flagged
+
+
+def score_recent(bundle=None):
+    """
+    Score the most recent slice of traffic against the latest model.
+    Returns None when no model has been trained yet.
+    """
+    bundle = bundle or load_latest_model()
+    if bundle is None:
+        return None
+    ips, X = extract_features(timezone.now() - timedelta(minutes=bundle['slice_minutes']))
+    return score(ips, X, bundle)
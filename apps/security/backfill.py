@@ -0,0 +1,190 @@
+"""
+Parallel historical re-scoring of RequestLog.
+
+``detect_suspicious_ips`` and ``score_recent_traffic`` only look at recent
+traffic. ``run_backfill`` re-applies the volume/sensitive-path rules (with
+any thresholds) and optionally a saved anomaly model to a past date range:
+
+- the range is split into windows (hourly by default);
+- windows are scored in parallel by a process pool, each worker streaming
+  its own window through ``anomaly.extract_features`` (one range scan per
+  model slice, with a server-side cursor on PostgreSQL);
+- the parent process writes the results to AnomalyBackfillScore under a new
+  AnomalyBackfillRun, so runs with different settings can be compared and
+  live SuspiciousIP flags are never touched.
+
+Rules count requests per window. The model scores each of its own slices
+(``slice_minutes``) within the window, and an IP keeps its lowest score.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.db import connections
+from django.utils import timezone
+
+from . import anomaly
+from .counters import sensitive_threshold as _sensitive_threshold, volume_threshold as _volume_threshold
+from .models import AnomalyBackfillRun, AnomalyBackfillScore
+
+logger = logging.getLogger(__name__)
+
+WINDOW_MINUTES = 60
+
+# Per-worker cache of the model bundle, loaded once per process
+_bundle = None
+
+
+def split_windows(start, end, window_minutes=WINDOW_MINUTES):
+    """Return ``[(window_start, window_end), ...]`` covering ``[start, end)``."""
+    if window_minutes <= 0:
+        raise ValueError('window_minutes must be positive')
+    step = timedelta(minutes=window_minutes)
+    windows = []
+    while start < end:
+        windows.append((start, min(start + step, end)))
+        start += step
+    return windows
+
+
+def score_window(window_start, window_end, params):
+    """
+    Score one window; runs in a worker process.
+
+    Returns ``[(window_start, ip, request_count, sensitive_path_count,
+    anomaly_score, flagged_by), ...]`` for flagged IPs (all IPs with
+    ``params['store_all']``).
+    """
+    global _bundle
+    model_version = params.get('model_version')
+    if model_version is not None and (_bundle is None or _bundle['version'] != model_version):
+        _bundle = anomaly.load_model(model_version)
+    bundle = _bundle if model_version is not None else None
+
+    step = timedelta(minutes=bundle['slice_minutes']) if bundle else window_end - window_start
+    # ip -> [request_count, sensitive_path_count, lowest score]
+    totals = {}
+    slice_start = window_start
+    while slice_start < window_end:
+        slice_end = min(slice_start + step, window_end)
+        ips, X = anomaly.extract_features(slice_start, slice_end)
+        scores = None
+        if bundle is not None and len(ips):
+            scores = bundle['model'].decision_function(bundle['scaler'].transform(X))
+        for i, ip in enumerate(ips):
+            entry = totals.setdefault(ip, [0.0, 0.0, None])
+            entry[0] += X[i, 0]
+            entry[1] += X[i, 2]
+            if scores is not None and (entry[2] is None or scores[i] < entry[2]):
+                entry[2] = float(scores[i])
+        slice_start = slice_end
+
+    results = []
+    for ip, (request_count, sensitive_count, score) in totals.items():
+        flagged_by = []
+        if request_count > params['volume_threshold']:
+            flagged_by.append('volume')
+        if sensitive_count >= params['sensitive_threshold']:
+            flagged_by.append('sensitive')
+        if score is not None and score < bundle['threshold']:
+            flagged_by.append('model')
+        if flagged_by or params.get('store_all'):
+            results.append((
+                window_start, ip, int(round(request_count)), int(round(sensitive_count)), score, ','.join(flagged_by),
+            ))
+    return results
+
+
+def _init_worker():
+    # Spawned (non-fork) workers start without Django configured
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _mp_context():
+    # Forked workers inherit the configured Django process cheaply
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def run_backfill(start, end, window_minutes=WINDOW_MINUTES, workers=None, volume_threshold=None,
+                 sensitive_threshold=None, model_version=None, store_all=False, progress=None):
+    """
+    Re-score ``[start, end)`` and return the AnomalyBackfillRun.
+
+    ``model_version`` selects a saved anomaly model ('latest' for the newest
+    one, None for rules only). ``progress`` is called with
+    ``(windows_done, windows_total, flagged)`` after every window.
+    """
+    if not anomaly.ML_AVAILABLE:
+        raise RuntimeError('Backfill scoring requires numpy and scikit-learn')
+
+    if model_version == 'latest':
+        bundle = anomaly.load_latest_model()
+        if bundle is None:
+            raise RuntimeError('No anomaly model has been trained yet')
+        model_version = bundle['version']
+    elif model_version is not None and anomaly.load_model(model_version) is None:
+        raise RuntimeError(f'Anomaly model v{model_version} not found')
+
+    windows = split_windows(start, end, window_minutes)
+    params = {
+        'volume_threshold': _volume_threshold() if volume_threshold is None else volume_threshold,
+        'sensitive_threshold': _sensitive_threshold() if sensitive_threshold is None else sensitive_threshold,
+        'model_version': model_version,
+        'store_all': store_all,
+    }
+    run = AnomalyBackfillRun.objects.create(
+        start=start,
+        end=end,
+        window_minutes=window_minutes,
+        volume_threshold=params['volume_threshold'],
+        sensitive_threshold=params['sensitive_threshold'],
+        model_version=model_version,
+        windows_total=len(windows),
+    )
+    workers = workers or os.cpu_count() or 1
+    logger.info(f"Backfill run {run.pk}: scoring {len(windows)} window(s) with {workers} worker(s)")
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context(), initializer=_init_worker) as pool:
+            futures = [pool.submit(score_window, window_start, window_end, params) for window_start, window_end in windows]
+            for future in as_completed(futures):
+                rows = future.result()
+                AnomalyBackfillScore.objects.bulk_create(
+                    [
+                        AnomalyBackfillScore(
+                            run=run,
+                            window_start=window_start,
+                            ip_address=ip,
+                            request_count=request_count,
+                            sensitive_path_count=sensitive_count,
+                            anomaly_score=score,
+                            flagged_by=flagged_by,
+                        )
+                        for window_start, ip, request_count, sensitive_count, score, flagged_by in rows
+                    ],
+                    batch_size=1000,
+                )
+                run.windows_done += 1
+                run.flagged_count += sum(1 for row in rows if row[5])
+                if progress:
+                    progress(run.windows_done, run.windows_total, run.flagged_count)
+    except BaseException:
+        run.status = 'failed'
+        run.finished_at = timezone.now()
+        run.save(update_fields=['status', 'finished_at', 'windows_done', 'flagged_count'])
+        raise
+
+    run.status = 'completed'
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'finished_at', 'windows_done', 'flagged_count'])
+    logger.info(f"Backfill run {run.pk} completed: {run.flagged_count} flagged IP window(s)")
+    return run
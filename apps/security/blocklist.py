@@ -0,0 +1,280 @@
+"""
+Compiled in-memory IP blocklist.
+
+BlockedIP rows (single addresses and CIDR ranges) are compiled into a
+per-worker longest-prefix table: for each IP version, one hash set of
+masked network integers per prefix length in use. A lookup masks the
+address once per distinct prefix length, so it costs a handful of integer
+operations and set probes with no cache or database round trip.
+
+Workers stay in sync through a version token in the shared cache, bumped
+whenever BlockedIP rows change (see signals.py). Each worker re-reads the
+token at most every BLOCKLIST_VERSION_CHECK_INTERVAL seconds and recompiles
+when it differs.
+
+``parse_entries`` and ``bulk_block`` import whole IP/CIDR lists (plain text
+or threat-feed CSV) with batched inserts and a single version bump.
+"""
+import csv
+import ipaddress
+import logging
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'security:blocklist:version'
+
+
+class CompiledBlocklist:
+    """Immutable prefix table built from (network address, prefix length) pairs."""
+
+    def __init__(self, networks=()):
+        # {version: [(prefix_len, mask, set_of_network_ints), ...]} ordered by
+        # prefix length, most specific first
+        tables = {4: {}, 6: {}}
+        size = 0
+        for network in networks:
+            bits = network.max_prefixlen
+            mask = ((1 << bits) - 1) ^ ((1 << (bits - network.prefixlen)) - 1)
+            tables[network.version].setdefault(network.prefixlen, (mask, set()))[1].add(
+                int(network.network_address)
+            )
+            size += 1
+        self._tables = {
+            version: [(plen, mask, nets) for plen, (mask, nets) in sorted(table.items(), reverse=True)]
+            for version, table in tables.items()
+        }
+        self.size = size
+
+    def __contains__(self, ip):
+        # inet_pton is much cheaper than ipaddress.ip_address() on the hot path
+        try:
+            value, version = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big'), 4
+        except OSError:
+            try:
+                address = ipaddress.IPv6Address(ip)
+            except ValueError:
+                return False
+            if address.ipv4_mapped is not None:
+                value, version = int(address.ipv4_mapped), 4
+            else:
+                value, version = int(address), 6
+        for _plen, mask, nets in self._tables[version]:
+            if value & mask in nets:
+                return True
+        return False
+
+
+def compile_from_db():
+    """Build a CompiledBlocklist from all BlockedIP rows."""
+    from .models import BlockedIP
+
+    networks = []
+    for ip_address, prefix_length in BlockedIP.objects.values_list('ip_address', 'prefix_length').iterator():
+        try:
+            if prefix_length is None:
+                networks.append(ipaddress.ip_network(ip_address))
+            else:
+                networks.append(ipaddress.ip_network(f'{ip_address}/{prefix_length}', strict=False))
+        except ValueError as e:
+            logger.warning(f"Skipping invalid blocklist entry {ip_address}/{prefix_length}: {e}")
+    return CompiledBlocklist(networks)
+
+
+def bump_version():
+    """Signal all workers that the blocklist changed."""
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def _split_comment(line):
+    """Split ``'1.2.3.0/24 ; SBL123'`` style lines into (entry, comment)."""
+    for marker in (';', '#'):
+        if marker in line:
+            entry, comment = line.split(marker, 1)
+            return entry.strip(), comment.strip()
+    return line.strip(), ''
+
+
+def parse_entry(value):
+    """
+    Parse one IP or CIDR string into ``(network_address, prefix_length)``.
+
+    Single addresses (and full-length prefixes) get a prefix length of None.
+    Raises ValueError for anything else.
+    """
+    if '/' not in value:
+        # inet_pton is much cheaper than ipaddress for the common plain-IP case
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                return socket.inet_ntop(family, socket.inet_pton(family, value)), None
+            except OSError:
+                continue
+    network = ipaddress.ip_network(value, strict=False)
+    prefix_length = None if network.prefixlen == network.max_prefixlen else network.prefixlen
+    return str(network.network_address), prefix_length
+
+
+def parse_entries(lines):
+    """
+    Parse blocklist lines into ``(network_address, prefix_length, reason)``
+    tuples.
+
+    Accepts plain text (one IP or CIDR per line, ``#``/``;`` comments, as in
+    most DROP-style feeds) and CSV threat feeds: the first cell that parses
+    as an IP or network is used, and the reason comes from a ``reason``,
+    ``description`` or ``comment`` column when the CSV has a header, or the
+    next cell otherwise. Returns ``(entries, skipped)``.
+    """
+    entries = []
+    skipped = 0
+    reason_column = None
+    header_seen = False
+    for line in lines:
+        line, comment = _split_comment(line)
+        if not line:
+            continue
+        if ',' in line or '\t' in line:
+            cells = [cell.strip() for cell in next(csv.reader([line], delimiter='\t' if '\t' in line else ','))]
+        else:
+            cells = line.split()[:1]
+
+        for index, cell in enumerate(cells):
+            try:
+                address, prefix_length = parse_entry(cell)
+                break
+            except ValueError:
+                continue
+        else:
+            if not header_seen and not entries:
+                # Header row: remember where the reason column is
+                header_seen = True
+                names = [cell.lower() for cell in cells]
+                reason_column = next(
+                    (names.index(name) for name in ('reason', 'description', 'comment') if name in names),
+                    None,
+                )
+            else:
+                skipped += 1
+            continue
+
+        if reason_column is not None:
+            reason = cells[reason_column] if reason_column < len(cells) else ''
+        elif header_seen or len(cells) <= index + 1:
+            reason = comment
+        else:
+            reason = cells[index + 1]
+        entries.append((address, prefix_length, reason or comment))
+    return entries, skipped
+
+
+def bulk_block(entries, reason='', created_by=None, batch_size=5000):
+    """
+    Block many ``(network_address, prefix_length, reason)`` entries at once
+    (see parse_entries).
+
+    Each batch skips the ``(address, prefix_length)`` pairs that are
+    already blocked and inserts the rest with
+    ``bulk_create(ignore_conflicts=True)``, so a concurrent import of the
+    same entries cannot fail the batch. Workers are told to recompile with
+    one version bump, since bulk_create sends no signals. Returns the
+    number of newly blocked entries (entries a concurrent writer inserted
+    between the check and the insert count as new here).
+    """
+    from .models import BlockedIP
+
+    rows = {}
+    for address, prefix_length, entry_reason in entries:
+        if (address, prefix_length) not in rows:
+            rows[address, prefix_length] = BlockedIP(
+                ip_address=address,
+                prefix_length=prefix_length,
+                reason=(entry_reason or reason)[:255],
+                created_by=created_by,
+            )
+    if not rows:
+        return 0
+
+    created = 0
+    pending = list(rows.items())
+    for start in range(0, len(pending), batch_size):
+        batch = dict(pending[start:start + batch_size])
+        existing = set(
+            BlockedIP.objects.filter(ip_address__in={address for address, _ in batch})
+            .values_list('ip_address', 'prefix_length')
+        )
+        new = [row for pair, row in batch.items() if pair not in existing]
+        BlockedIP.objects.bulk_create(new, ignore_conflicts=True)
+        created += len(new)
+
+    bump_version()
+    get_blocklist().invalidate()
+    logger.info(f"Bulk-blocked {created} new IP/CIDR entries ({len(rows)} submitted)")
+    return created
+
+
+class BlocklistMatcher:
+    """Per-process holder of the compiled blocklist."""
+
+    def __init__(self, check_interval=None):
+        self.check_interval = (
+            check_interval if check_interval is not None
+            else getattr(settings, 'BLOCKLIST_VERSION_CHECK_INTERVAL', 5)
+        )
+        self._compiled = None
+        self._version = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def is_blocked(self, ip):
+        now = time.monotonic()
+        if self._compiled is None or now >= self._next_check:
+            self._refresh(now)
+        return ip in self._compiled
+
+    async def ais_blocked(self, ip):
+        """Async variant of is_blocked(); a due refresh runs off the event loop."""
+        now = time.monotonic()
+        if self._compiled is None or now >= self._next_check:
+            from asgiref.sync import sync_to_async
+            await sync_to_async(self._refresh, thread_sensitive=False)(now)
+        return ip in self._compiled
+
+    def _refresh(self, now):
+        with self._lock:
+            if self._compiled is not None and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                version = cache.get(VERSION_CACHE_KEY)
+                if version is None:
+                    version = uuid.uuid4().hex
+                    cache.add(VERSION_CACHE_KEY, version, None)
+                    version = cache.get(VERSION_CACHE_KEY) or version
+                if self._compiled is not None and version == self._version:
+                    return
+                self._compiled = compile_from_db()
+                self._version = version
+                logger.debug(f"Compiled blocklist with {self._compiled.size} entries (version {version})")
+            except Exception as e:
+                logger.error(f"Failed to refresh blocklist: {e}")
+                if self._compiled is None:
+                    self._compiled = CompiledBlocklist()
+
+    def invalidate(self):
+        """Force a recompile on the next lookup in this process."""
+        self._next_check = 0.0
+        self._version = None
+
+
+_matcher = BlocklistMatcher()
+
+
+def get_blocklist():
+    """Return the process-wide BlocklistMatcher."""
+    return _matcher
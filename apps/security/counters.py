@@ -0,0 +1,273 @@
+"""
+Real-time sliding-window request counters in Redis.
+
+Each request performs one Lua call (EVALSHA) that:
+- increments the per-IP counter for the current minute bucket and sums the
+  buckets inside the sliding window (IP_TRACKING_DETECTION_WINDOW seconds),
+- for sensitive paths, does the same for the (IP, path) counter,
+- adds the path to a per-hour HyperLogLog (approximate unique paths),
+- records the IP in a sorted set of active IPs,
+- reports whether this request crossed the volume or sensitive-path
+  threshold.
+
+Threshold crossings flag SuspiciousIP immediately, and the hourly
+``detect_suspicious_ips`` task reads these counters instead of scanning
+RequestLog.
+"""
+import logging
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'security:sw'
+ACTIVE_KEY = f'{KEY_PREFIX}:active'
+BUCKET_SECONDS = 60
+
+DEFAULT_SENSITIVE_PATHS = ['/admin', '/login', '/api/admin', '/api/login']
+
+# Crossing flags returned by the script
+CROSSED_VOLUME = 1
+CROSSED_SENSITIVE = 2
+
+HIT_SCRIPT = """
+local bucket = tonumber(ARGV[1])
+local oldest = bucket - tonumber(ARGV[2]) + 1
+local ttl = tonumber(ARGV[3])
+local sensitive_path = ARGV[4]
+local volume_threshold = tonumber(ARGV[5])
+local sensitive_threshold = tonumber(ARGV[6])
+
+local function window_sum(key, field, ttl)
+    redis.call('HINCRBY', key, field, 1)
+    redis.call('EXPIRE', key, ttl)
+    local total = 0
+    local entries = redis.call('HGETALL', key)
+    for i = 1, #entries, 2 do
+        local b = tonumber(string.match(entries[i], '^(%d+)'))
+        if b < oldest then
+            redis.call('HDEL', key, entries[i])
+        else
+            total = total + tonumber(entries[i + 1])
+        end
+    end
+    return total
+end
+
+local total = window_sum(KEYS[1], bucket, ttl)
+
+redis.call('PFADD', KEYS[3], ARGV[7])
+redis.call('EXPIRE', KEYS[3], ttl * 2)
+redis.call('ZADD', KEYS[4], ARGV[8], ARGV[9])
+
+local sensitive = 0
+local crossed = 0
+if total == volume_threshold + 1 then
+    crossed = 1
+end
+if sensitive_path ~= '' then
+    sensitive = window_sum(KEYS[2], bucket .. '|' .. sensitive_path, ttl)
+    if sensitive == sensitive_threshold then
+        crossed = crossed + 2
+    end
+end
+return {total, sensitive, crossed}
+"""
+
+
+def window_seconds():
+    return getattr(settings, 'IP_TRACKING_DETECTION_WINDOW', 3600)
+
+
+def volume_threshold():
+    return getattr(settings, 'IP_TRACKING_VOLUME_THRESHOLD', 100)
+
+
+def sensitive_threshold():
+    return getattr(settings, 'IP_TRACKING_SENSITIVE_THRESHOLD', 10)
+
+
+def sensitive_paths():
+    """IP_TRACKING_SENSITIVE_PATHS as a frozenset."""
+    return frozenset(getattr(settings, 'IP_TRACKING_SENSITIVE_PATHS', DEFAULT_SENSITIVE_PATHS))
+
+
+def is_sensitive_path(path):
+    """Return the normalized sensitive path for ``path``, or '' if not sensitive."""
+    normalized = path.rstrip('/') or '/'
+    return normalized if normalized in sensitive_paths() else ''
+
+
+def _keys(ip, hour):
+    base = f'{KEY_PREFIX}:{ip}'
+    return [base, f'{base}:s', f'{base}:u:{hour}', ACTIVE_KEY]
+
+
+def _args(ip, path, now):
+    bucket = int(now // BUCKET_SECONDS)
+    window = window_seconds()
+    return [
+        bucket,
+        window // BUCKET_SECONDS,
+        window + BUCKET_SECONDS,
+        is_sensitive_path(path),
+        volume_threshold(),
+        sensitive_threshold(),
+        path[:500],
+        f'{now:.0f}',
+        ip,
+    ]
+
+
+_script = None
+# Per event loop: (redis.asyncio client, registered script). Entries are
+# dropped together with their loop, so a client never outlives the loop it
+# is bound to and a new loop never inherits a dead one's client.
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+# OPTIONS of the django_redis cache that map onto redis client arguments
+_CLIENT_OPTIONS = (
+    ('USERNAME', 'username'),
+    ('PASSWORD', 'password'),
+    ('SOCKET_TIMEOUT', 'socket_timeout'),
+    ('SOCKET_CONNECT_TIMEOUT', 'socket_connect_timeout'),
+)
+
+
+def record_hit(conn, ip, path):
+    """
+    Count a request and return ``(ip_count, sensitive_count, crossed)`` for
+    the current sliding window.
+    """
+    global _script
+    if _script is None:
+        with _lock:
+            if _script is None:
+                _script = conn.register_script(HIT_SCRIPT)
+    now = time.time()
+    return _script(keys=_keys(ip, int(now // 3600)), args=_args(ip, path, now), client=conn)
+
+
+def _build_async_client(cache_config):
+    """
+    A redis.asyncio client for the same server and settings as the
+    django_redis cache: the LOCATION URL (scheme/SSL, db, credentials) plus
+    the OPTIONS django_redis passes to its connection pool.
+    """
+    import redis.asyncio
+
+    location = cache_config['LOCATION']
+    if isinstance(location, str):
+        location = location.split(',')
+    options = cache_config.get('OPTIONS', {})
+    kwargs = dict(options.get('CONNECTION_POOL_KWARGS', {}))
+    for option, argument in _CLIENT_OPTIONS:
+        if options.get(option) is not None:
+            kwargs[argument] = options[option]
+    # The first location is the primary, as in django_redis
+    return redis.asyncio.Redis.from_url(location[0].strip(), **kwargs)
+
+
+def _get_async_client():
+    """Return ``(client, script)`` bound to the running event loop, or (None, None)."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        cache_config = settings.CACHES.get('default', {})
+        if 'redis' not in cache_config.get('BACKEND', '').lower():
+            return None, None
+        client = _build_async_client(cache_config)
+        entry = (client, client.register_script(HIT_SCRIPT))
+        with _lock:
+            _async_clients[loop] = entry
+    return entry
+
+
+async def arecord_hit(ip, path):
+    """Async variant of record_hit() using redis.asyncio; None if Redis is not configured."""
+    client, script = _get_async_client()
+    if client is None:
+        return None
+    now = time.time()
+    return await script(keys=_keys(ip, int(now // 3600)), args=_args(ip, path, now))
+
+
+def flag_crossing(ip, counts):
+    """Flag ``ip`` as suspicious if record_hit() reported a threshold crossing."""
+    from .models import SuspiciousIP
+
+    ip_count, sensitive_count, crossed = counts
+    if not crossed:
+        return False
+
+    window_minutes = window_seconds() // 60
+    if crossed & CROSSED_SENSITIVE:
+        reason = f'Repeated access to sensitive paths ({sensitive_count} times in {window_minutes} minutes)'
+        request_count = sensitive_count
+    else:
+        reason = (
+            f'High request volume: {ip_count} requests in the last {window_minutes} minutes '
+            f'(threshold: {volume_threshold()})'
+        )
+        request_count = ip_count
+
+    SuspiciousIP.objects.update_or_create(
+        ip_address=ip,
+        defaults={'reason': reason, 'request_count': request_count},
+    )
+    logger.info(f"Flagged IP {ip} in real time: {reason}")
+    return True
+
+
+def read_window(conn, now=None):
+    """
+    Return per-IP features for every IP active in the sliding window:
+    ``{'ip_address', 'request_count', 'unique_paths', 'sensitive_path_count',
+    'sensitive_paths'}``.
+
+    Also prunes IPs that have left the window from the active set.
+    """
+    now = now or time.time()
+    window = window_seconds()
+    oldest = int(now // BUCKET_SECONDS) - window // BUCKET_SECONDS + 1
+    hour = int(now // 3600)
+
+    conn.zremrangebyscore(ACTIVE_KEY, '-inf', now - window)
+    ips = [ip.decode() if isinstance(ip, bytes) else ip for ip in conn.zrange(ACTIVE_KEY, 0, -1)]
+
+    rows = []
+    chunk = 500
+    for start in range(0, len(ips), chunk):
+        batch = ips[start:start + chunk]
+        pipe = conn.pipeline(transaction=False)
+        for ip in batch:
+            base = f'{KEY_PREFIX}:{ip}'
+            pipe.hgetall(base)
+            pipe.hgetall(f'{base}:s')
+            pipe.pfcount(f'{base}:u:{hour}', f'{base}:u:{hour - 1}')
+        results = pipe.execute()
+
+        for i, ip in enumerate(batch):
+            buckets, sensitive, unique_paths = results[i * 3:i * 3 + 3]
+            request_count = sum(int(v) for k, v in buckets.items() if int(k) >= oldest)
+            if not request_count:
+                continue
+            path_hits = {}
+            for field, value in sensitive.items():
+                bucket, _, path = (field.decode() if isinstance(field, bytes) else field).partition('|')
+                if int(bucket) >= oldest:
+                    path_hits[path] = path_hits.get(path, 0) + int(value)
+            rows.append({
+                'ip_address': ip,
+                'request_count': request_count,
+                'unique_paths': unique_paths,
+                'sensitive_path_count': sum(path_hits.values()),
+                'sensitive_paths': sorted(path_hits),
+            })
+    return rows
@@ -0,0 +1,101 @@
+"""
+Deferred GeoIP enrichment of request logs.
+
+With IP_TRACKING_GEOIP_MODE = 'deferred' the middleware writes RequestLog
+rows without country and city, so no request ever waits on a GeoIP lookup.
+The ``enrich_request_log_geo`` Celery task then walks new rows by id behind
+a watermark (see watermarks.py): each batch dedupes its IPs, resolves every
+unique IP once through GeoIPService.locate_many and writes the results back
+with bulk_update. The first run starts at the rollup watermark, as older
+rows were already rolled up with inline geolocation.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .geoip import get_geoip_service
+from .models import RequestLog, RollupWatermark
+from .watermarks import next_batch
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'geoip_enrichment'
+LOCK_KEY = 'security:geoip_enrichment:lock'
+LOCK_TIMEOUT = 600
+BATCH_SIZE = 5000
+MAX_BATCHES = 20
+
+
+def is_deferred():
+    """Return True if geolocation is deferred to the enrichment task."""
+    return getattr(settings, 'IP_TRACKING_GEOIP_MODE', 'inline') == 'deferred'
+
+
+def enriched_up_to():
+    """Highest RequestLog id already enriched (0 if enrichment never ran)."""
+    watermark = RollupWatermark.objects.filter(name=WATERMARK_NAME).values_list('last_id', flat=True).first()
+    return watermark or 0
+
+
+def _rolled_up_to():
+    from .rollups import WATERMARK_NAME as ROLLUP_WATERMARK_NAME
+
+    watermark = RollupWatermark.objects.filter(name=ROLLUP_WATERMARK_NAME).values_list('last_id', flat=True).first()
+    return watermark or 0
+
+
+def enrich_logs(batch_size=None, max_batches=None):
+    """
+    Fill in country and city for RequestLog rows written without them.
+
+    Processes up to ``max_batches`` id ranges of ``batch_size`` ids per call
+    and returns a summary dict. Concurrent runs are prevented with a cache
+    lock.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    max_batches = max_batches or MAX_BATCHES
+    if not cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+        logger.info("GeoIP enrichment already running, skipping")
+        return {'skipped': True}
+
+    service = get_geoip_service()
+    try:
+        watermark, _ = RollupWatermark.objects.get_or_create(
+            name=WATERMARK_NAME, defaults={'last_id': _rolled_up_to()}
+        )
+        updated = 0
+        resolved = 0
+        for _ in range(max_batches):
+            batch = next_batch(watermark.last_id, batch_size)
+            if batch is None:
+                break
+            low, high = batch
+
+            rows = list(
+                RequestLog.objects
+                .filter(id__gte=low, id__lte=high, country__isnull=True)
+                .only('id', 'ip_address', 'country', 'city')
+            )
+            geo = service.locate_many(row.ip_address for row in rows)
+            resolved += len(geo)
+
+            changed = []
+            for row in rows:
+                country, city = geo[row.ip_address]
+                if country is not None or city is not None:
+                    row.country, row.city = country, city
+                    changed.append(row)
+
+            with transaction.atomic():
+                if changed:
+                    RequestLog.objects.bulk_update(changed, ['country', 'city'], batch_size=1000)
+                watermark.last_id = high
+                watermark.save(update_fields=['last_id', 'updated_at'])
+            updated += len(changed)
+
+        logger.info(f"Enriched {updated} request log(s) from {resolved} unique IP lookup(s) up to id {watermark.last_id}")
+        return {'processed_up_to': watermark.last_id, 'updated': updated, 'unique_ips': resolved}
+    finally:
+        cache.delete(LOCK_KEY)
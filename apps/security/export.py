@@ -0,0 +1,262 @@
+"""
+Streaming columnar export of RequestLog.
+
+Rows are read in primary-key order with ``iterator(chunk_size=...)`` (a
+server-side cursor on PostgreSQL), so memory stays bounded by one chunk per
+open day regardless of how much is exported. Output is partitioned by day:
+
+    <output>/date=2024-05-01/part-000000123457.parquet   (or .csv.gz)
+
+A ``_watermark.json`` file in the output directory records the highest
+exported id and the ``since``/``until`` range it was exported for; a run
+with a different range into the same directory is rejected. Each run stops
+at the highest settled id (see watermarks.py), so rows that commit out of
+id order are picked up by the next run rather than skipped. Every ``checkpoint_rows`` rows the open files are finalized and
+the watermark advanced, so an interrupted export resumes from the last
+checkpoint; part files are named after the watermark their segment started
+from, so a re-run overwrites any partial output instead of duplicating it.
+
+Pass a read replica as ``database`` to keep the scan off the primary.
+"""
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import timezone as dt_timezone
+
+from .models import RequestLog
+from .watermarks import settled_up_to
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+WATERMARK_FILE = '_watermark.json'
+CHUNK_SIZE = 10_000
+CHECKPOINT_ROWS = 1_000_000
+
+COLUMNS = [
+    'id',
+    'timestamp',
+    'ip_address',
+    'route',
+    'path',
+    'method',
+    'country',
+    'city',
+    'user_id',
+    'sample_weight',
+    'status_code',
+    'duration_us',
+    'db_queries',
+    'db_time_us',
+    'response_bytes',
+]
+# Model lookups for COLUMNS, in the same order
+FIELDS = [
+    'id',
+    'timestamp',
+    'ip_address',
+    'route__route',
+    'path',
+    'method',
+    'country',
+    'city',
+    'user_id',
+    'sample_weight',
+    'status_code',
+    'duration_us',
+    'db_queries',
+    'db_time_us',
+    'response_bytes',
+]
+
+
+def _parquet_schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('ip_address', pa.string()),
+        ('route', pa.string()),
+        ('path', pa.string()),
+        ('method', pa.string()),
+        ('country', pa.string()),
+        ('city', pa.string()),
+        ('user_id', pa.string()),
+        ('sample_weight', pa.int64()),
+        ('status_code', pa.int64()),
+        ('duration_us', pa.int64()),
+        ('db_queries', pa.int64()),
+        ('db_time_us', pa.int64()),
+        ('response_bytes', pa.int64()),
+    ])
+
+
+def _isoformat(moment):
+    return moment.isoformat() if moment is not None else None
+
+
+def read_state(output_dir):
+    """The output directory's watermark file contents, or None if there is none yet."""
+    try:
+        with open(os.path.join(output_dir, WATERMARK_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_watermark(output_dir):
+    return (read_state(output_dir) or {}).get('last_id', 0)
+
+
+def write_watermark(output_dir, last_id, fmt, since=None, until=None):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'last_id': last_id,
+            'format': fmt,
+            'since': _isoformat(since),
+            'until': _isoformat(until),
+        }, f)
+    os.replace(tmp_path, path)
+
+
+class _DayWriter:
+    """Appends chunks of rows for one day to a single part file."""
+
+    def __init__(self, output_dir, day, segment, fmt, chunk_size=CHUNK_SIZE):
+        directory = os.path.join(output_dir, f'date={day.isoformat()}')
+        os.makedirs(directory, exist_ok=True)
+        extension = 'parquet' if fmt == 'parquet' else 'csv.gz'
+        self.path = os.path.join(directory, f'part-{segment:012d}.{extension}')
+        self.tmp_path = f'{self.path}.tmp'
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.count = 0
+        if fmt == 'parquet':
+            self._writer = pq.ParquetWriter(self.tmp_path, _parquet_schema(), compression='zstd')
+        else:
+            self._file = gzip.open(self.tmp_path, 'wt', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(COLUMNS)
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.fmt == 'parquet':
+            columns = list(zip(*self.rows))
+            columns[8] = [str(value) if value is not None else None for value in columns[8]]
+            self._writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, _parquet_schema())],
+                schema=_parquet_schema(),
+            ))
+        else:
+            self._writer.writerows(
+                (row[0], row[1].isoformat(), *('' if value is None else value for value in row[2:]))
+                for row in self.rows
+            )
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.fmt == 'parquet':
+            self._writer.close()
+        else:
+            self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def export_logs(output_dir, fmt='parquet', since=None, until=None, database='default',
+                chunk_size=None, checkpoint_rows=None, progress=None):
+    """
+    Export RequestLog rows with ids above the output's watermark.
+
+    Returns ``(rows_exported, last_id)``. ``progress`` is called with
+    ``(rows_exported, last_id)`` at every checkpoint. Raises ValueError if
+    ``since``/``until`` differ from the range the output was started with.
+    """
+    if fmt == 'parquet' and not PARQUET_AVAILABLE:
+        raise RuntimeError('Parquet export requires pyarrow. Install with: pip install pyarrow')
+
+    chunk_size = chunk_size or CHUNK_SIZE
+    checkpoint_rows = checkpoint_rows or CHECKPOINT_ROWS
+    os.makedirs(output_dir, exist_ok=True)
+    state = read_state(output_dir)
+    if state is not None and (state.get('since'), state.get('until')) != (_isoformat(since), _isoformat(until)):
+        raise ValueError(
+            f"{output_dir} holds an export for since={state.get('since')} until={state.get('until')}; "
+            f"use a new output directory for a different range"
+        )
+    last_id = state.get('last_id', 0) if state else 0
+
+    # Rows above the settled id may still be joined by lower ids committing late
+    high = settled_up_to(last_id, using=database)
+    if high is None:
+        if state is None:
+            write_watermark(output_dir, last_id, fmt, since, until)
+        return 0, last_id
+
+    logs = RequestLog.objects.using(database).filter(id__gt=last_id, id__lte=high)
+    if since is not None:
+        logs = logs.filter(timestamp__gte=since)
+    if until is not None:
+        logs = logs.filter(timestamp__lt=until)
+    rows = logs.order_by('id').values_list(*FIELDS).iterator(chunk_size=chunk_size)
+
+    exported = 0
+    segment = last_id + 1
+    writers = {}
+    try:
+        for row in rows:
+            day = row[1].astimezone(dt_timezone.utc).date()
+            writer = writers.get(day)
+            if writer is None:
+                writer = writers[day] = _DayWriter(output_dir, day, segment, fmt, chunk_size)
+            writer.append(row)
+            last_id = row[0]
+            exported += 1
+
+            if exported % checkpoint_rows == 0:
+                for writer in writers.values():
+                    writer.close()
+                writers = {}
+                write_watermark(output_dir, last_id, fmt, since, until)
+                segment = last_id + 1
+                if progress:
+                    progress(exported, last_id)
+
+        for writer in writers.values():
+            writer.close()
+        writers = {}
+        # Rows up to ``high`` are final even when the range filters skipped them
+        last_id = high
+        write_watermark(output_dir, last_id, fmt, since, until)
+    finally:
+        # Interrupted: drop unfinished part files; the watermark still points
+        # at the last completed checkpoint.
+        for writer in writers.values():
+            try:
+                if fmt == 'parquet':
+                    writer._writer.close()
+                else:
+                    writer._file.close()
+                os.remove(writer.tmp_path)
+            except OSError:
+                pass
+
+    logger.info(f"Exported {exported} request log(s) to {output_dir} up to id {last_id}")
+    return exported, last_id
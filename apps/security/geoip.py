@@ -0,0 +1,284 @@
+"""
+GeoIP lookup service.
+
+Keeps a single memory-mapped GeoLite2-City reader per process and reloads
+it when the .mmdb file on disk changes. Lookups go through a size-bounded
+in-process LRU first, then the shared cache (24 hours), and only then hit
+the database file. Shared-cache keys carry the database's build epoch, so
+a reloaded database never serves answers cached from the previous one.
+"""
+import ipaddress
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+GEOIP_DB_FILENAME = 'GeoLite2-City.mmdb'
+CACHE_TIMEOUT = 86400  # 24 hours
+# How often (seconds) to stat the database file for changes
+RELOAD_CHECK_INTERVAL = 60
+
+
+def is_public_ip(ip):
+    """Return True if ``ip`` is a valid, globally routable address."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return not (
+        address.is_private
+        or address.is_loopback
+        or address.is_link_local
+        or address.is_multicast
+        or address.is_reserved
+        or address.is_unspecified
+    )
+
+
+class LRUCache:
+    """Minimal thread-safe LRU mapping with a fixed maximum size."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class GeoIPService:
+    """Process-wide GeoIP resolver backed by a memory-mapped reader."""
+
+    def __init__(self, geoip_path=None, lru_size=None):
+        self.geoip_path = geoip_path
+        self.lru = LRUCache(lru_size or getattr(settings, 'GEOIP_LRU_SIZE', 50000))
+        self._reader = None
+        self._mtime = None
+        # Build epoch of the open database, part of every shared-cache key
+        self._version = 0
+        # mtime of a file that failed to open; retried once it changes
+        self._failed_mtime = None
+        # monotonic time of the last stat, None before the first
+        self._last_check = None
+        self._lock = threading.Lock()
+        self._warned = False
+
+    @property
+    def db_file(self):
+        geoip_path = self.geoip_path or getattr(settings, 'GEOIP_PATH', None) or os.environ.get('GEOIP_PATH')
+        if not geoip_path:
+            return None
+        return os.path.join(str(geoip_path), GEOIP_DB_FILENAME)
+
+    def _check_due(self, now=None):
+        """True if the database file should be stat'ed (and maybe reopened) now."""
+        now = time.monotonic() if now is None else now
+        return self._last_check is None or now - self._last_check >= RELOAD_CHECK_INTERVAL
+
+    def _get_reader(self):
+        """Return the shared reader, (re)opening it if the file changed."""
+        now = time.monotonic()
+        if not self._check_due(now):
+            return self._reader
+
+        with self._lock:
+            if not self._check_due(now):
+                return self._reader
+            self._last_check = now
+
+            db_file = self.db_file
+            if not db_file:
+                self._warn_once("GEOIP_PATH not set in settings or environment. Geolocation will be skipped.")
+                return None
+            try:
+                mtime = os.stat(db_file).st_mtime
+            except OSError:
+                self._warn_once(f"{GEOIP_DB_FILENAME} not found at {db_file}. Download from MaxMind and place it there.")
+                return self._reader
+
+            if (self._reader is None or mtime != self._mtime) and mtime != self._failed_mtime:
+                try:
+                    from geoip2.database import Reader, MODE_MMAP
+                except ImportError:
+                    self._warn_once("geoip2 not installed. Install with: pip install geoip2")
+                    return None
+
+                try:
+                    reader = Reader(db_file, mode=MODE_MMAP)
+                except Exception as e:
+                    # e.g. a half-written file mid-update: keep serving the
+                    # current reader and retry on the next check
+                    logger.warning(f"Could not open GeoIP database {db_file}: {e}")
+                    self._failed_mtime = mtime
+                    return self._reader
+
+                old_reader = self._reader
+                self._reader = reader
+                self._mtime = mtime
+                self._version = reader.metadata().build_epoch
+                if old_reader is not None:
+                    logger.info(f"Reloaded GeoIP database from {db_file}")
+                    # Previously cached answers may be stale after an update
+                    self.lru.clear()
+                    old_reader.close()
+            return self._reader
+
+    def _warn_once(self, message):
+        if not self._warned:
+            logger.warning(message)
+            self._warned = True
+
+    def _cache_key(self, ip):
+        return f'geoip:{self._version}:{ip}'
+
+    def _refresh_reader(self):
+        """Pick up a changed database file so cache keys use its version."""
+        try:
+            self._get_reader()
+        except Exception as e:
+            logger.warning(f"GeoIP reader unavailable: {e}")
+
+    def _lookup(self, ip, refresh=True):
+        try:
+            reader = self._get_reader() if refresh else self._reader
+            if reader is None:
+                return None, None
+            response = reader.city(ip)
+            return response.country.name, response.city.name
+        except Exception as e:
+            logger.debug(f"GeoIP2 lookup failed for {ip}: {e}")
+            return None, None
+
+    def locate(self, ip):
+        """
+        Return ``(country, city)`` for ``ip``.
+
+        Private, loopback and reserved ranges resolve to ``(None, None)``
+        without any lookup.
+        """
+        geo = self.lru.get(ip)
+        if geo is not None:
+            return geo
+
+        if not is_public_ip(ip):
+            geo = (None, None)
+            self.lru.set(ip, geo)
+            return geo
+
+        self._refresh_reader()
+        cache_key = self._cache_key(ip)
+        geo_data = cache.get(cache_key)
+        if geo_data is None:
+            country, city = self._lookup(ip)
+            geo_data = {'country': country, 'city': city}
+            cache.set(cache_key, geo_data, CACHE_TIMEOUT)
+
+        geo = (geo_data.get('country'), geo_data.get('city'))
+        self.lru.set(ip, geo)
+        return geo
+
+    def locate_many(self, ips):
+        """
+        Resolve many IPs at once: ``{ip: (country, city)}``.
+
+        Shared-cache entries are fetched with one get_many and newly
+        resolved IPs stored with one set_many, so a batch costs two cache
+        round trips plus one reader lookup per unseen public IP.
+        """
+        results = {}
+        misses = []
+        for ip in set(ips):
+            geo = self.lru.get(ip)
+            if geo is not None:
+                results[ip] = geo
+            elif not is_public_ip(ip):
+                results[ip] = (None, None)
+                self.lru.set(ip, results[ip])
+            else:
+                misses.append(ip)
+        if not misses:
+            return results
+
+        self._refresh_reader()
+        keys = {ip: self._cache_key(ip) for ip in misses}
+        cached = cache.get_many(list(keys.values()))
+        resolved = {}
+        for ip in misses:
+            geo_data = cached.get(keys[ip])
+            if geo_data is None:
+                country, city = self._lookup(ip)
+                geo_data = resolved[keys[ip]] = {'country': country, 'city': city}
+            results[ip] = (geo_data.get('country'), geo_data.get('city'))
+            self.lru.set(ip, results[ip])
+        if resolved:
+            cache.set_many(resolved, CACHE_TIMEOUT)
+        return results
+
+    async def alocate(self, ip):
+        """Async variant of locate() using the async cache API."""
+        geo = self.lru.get(ip)
+        if geo is not None:
+            return geo
+
+        if not is_public_ip(ip):
+            geo = (None, None)
+            self.lru.set(ip, geo)
+            return geo
+
+        if self._check_due():
+            # stat() and reopening the file are blocking I/O: keep them off
+            # the event loop
+            await sync_to_async(self._refresh_reader, thread_sensitive=False)()
+        cache_key = self._cache_key(ip)
+        geo_data = await cache.aget(cache_key)
+        if geo_data is None:
+            # The reader is memory-mapped, so a lookup is a page-cache read
+            # rather than blocking file I/O.
+            country, city = self._lookup(ip, refresh=False)
+            geo_data = {'country': country, 'city': city}
+            await cache.aset(cache_key, geo_data, CACHE_TIMEOUT)
+
+        geo = (geo_data.get('country'), geo_data.get('city'))
+        self.lru.set(ip, geo)
+        return geo
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_geoip_service():
+    """Return the process-wide GeoIPService."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GeoIPService()
+    return _service
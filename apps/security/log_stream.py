@@ -0,0 +1,348 @@
+"""
+Out-of-band RequestLog ingestion through a Redis stream.
+
+With IP_TRACKING_LOG_INGESTION = 'stream' the middleware appends one compact
+record per request to a Redis stream (a single pipelined XADD) and the
+``drain_request_log_stream`` Celery task persists the stream into RequestLog
+in large ``bulk_create`` batches, so no database write happens on the
+request path.
+
+Delivery guarantees:
+- Entries are read through a consumer group and only acknowledged after the
+  batch has been committed.
+- Entries left pending by a failed batch (or a crashed worker) are reclaimed
+  after IP_TRACKING_LOG_STREAM_CLAIM_IDLE_MS and retried.
+- Entries delivered more than IP_TRACKING_LOG_STREAM_MAX_RETRIES times are
+  moved to a dead-letter stream instead of being retried forever.
+- Entries are never trimmed. Once the stream holds
+  IP_TRACKING_LOG_STREAM_MAXLEN entries (consumers have fallen behind),
+  publish() raises StreamFull and the stream sink writes through the
+  buffered database writer instead, so backpressure never drops a log.
+  The length is checked with an XLEN sent in the same pipeline as an XADD
+  about once a second, so it is up to one entry per process behind.
+
+drain() does nothing unless a stream sink is configured (see
+sinks.stream_enabled), so the frequent Beat schedule costs no Redis round
+trips in deployments that write logs elsewhere.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+LAG_CACHE_KEY = 'security:requestlog:lag'
+# Seconds between XLEN checks of the stream length per process
+LENGTH_CHECK_INTERVAL = 1.0
+
+
+def stream_key():
+    return getattr(settings, 'IP_TRACKING_LOG_STREAM_KEY', 'security:requestlog')
+
+
+def dead_letter_key():
+    return f'{stream_key()}:dead'
+
+
+def consumer_group():
+    return getattr(settings, 'IP_TRACKING_LOG_STREAM_GROUP', 'requestlog-writers')
+
+
+def stream_maxlen():
+    return getattr(settings, 'IP_TRACKING_LOG_STREAM_MAXLEN', 1_000_000)
+
+
+def batch_size():
+    return getattr(settings, 'IP_TRACKING_LOG_STREAM_BATCH_SIZE', 1000)
+
+
+def max_batches():
+    return getattr(settings, 'IP_TRACKING_LOG_STREAM_MAX_BATCHES', 50)
+
+
+def max_retries():
+    return getattr(settings, 'IP_TRACKING_LOG_STREAM_MAX_RETRIES', 5)
+
+
+def claim_idle_ms():
+    return getattr(settings, 'IP_TRACKING_LOG_STREAM_CLAIM_IDLE_MS', 60_000)
+
+
+class StreamFull(Exception):
+    """The stream holds IP_TRACKING_LOG_STREAM_MAXLEN entries; the caller must write elsewhere."""
+
+
+# Per-process estimate of the stream length: refreshed with XLEN every
+# LENGTH_CHECK_INTERVAL seconds and advanced locally in between
+_length = 0
+_length_checked_at = None
+_length_lock = threading.Lock()
+
+
+def get_stream_connection():
+    """
+    Return a raw Redis client for the default cache, or None when the cache
+    is not Redis-backed (e.g. the LocMemCache development fallback).
+    """
+    if 'redis' not in settings.CACHES.get('default', {}).get('BACKEND', '').lower():
+        return None
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except Exception:
+        return None
+
+
+def encode_record(ip_address, path, method, country=None, city=None, user=None, timestamp=None,
+                  route_id=None, sample_weight=1, status_code=None, duration_us=None,
+                  db_queries=None, db_time_us=None, response_bytes=None):
+    """Encode a request log as a compact flat mapping for XADD."""
+    timestamp = timestamp or datetime.now(dt_timezone.utc)
+    return {
+        't': f'{timestamp.timestamp():.6f}',
+        'i': ip_address,
+        'p': path[:500],
+        'm': method,
+        'c': country or '',
+        'y': city or '',
+        'u': str(user.pk) if user is not None else '',
+        'r': str(route_id) if route_id is not None else '',
+        'w': str(sample_weight),
+        's': _optional(status_code),
+        'd': _optional(duration_us),
+        'q': _optional(db_queries),
+        'qt': _optional(db_time_us),
+        'b': _optional(response_bytes),
+    }
+
+
+def _optional(value):
+    return '' if value is None else str(value)
+
+
+def _optional_int(value):
+    return int(value) if value else None
+
+
+def decode_record(fields):
+    """Turn a stream entry back into an unsaved RequestLog instance."""
+    from .models import RequestLog
+
+    fields = {
+        (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+        for k, v in fields.items()
+    }
+    return RequestLog(
+        timestamp=datetime.fromtimestamp(float(fields['t']), tz=dt_timezone.utc),
+        ip_address=fields['i'],
+        path=fields['p'],
+        method=fields.get('m') or 'GET',
+        country=fields.get('c') or None,
+        city=fields.get('y') or None,
+        user_id=fields.get('u') or None,
+        route_id=fields.get('r') or None,
+        sample_weight=int(fields.get('w') or 1),
+        status_code=_optional_int(fields.get('s')),
+        duration_us=_optional_int(fields.get('d')),
+        db_queries=_optional_int(fields.get('q')),
+        db_time_us=_optional_int(fields.get('qt')),
+        response_bytes=_optional_int(fields.get('b')),
+    )
+
+
+def publish(conn, **fields):
+    """
+    Append one request log to the stream in a single pipelined round trip.
+
+    Raises StreamFull instead of appending when the stream already holds
+    IP_TRACKING_LOG_STREAM_MAXLEN entries, so undelivered entries are never trimmed.
+    """
+    global _length, _length_checked_at
+    key = stream_key()
+    maxlen = stream_maxlen()
+    now = time.monotonic()
+    refresh = _length_checked_at is None or now - _length_checked_at >= LENGTH_CHECK_INTERVAL
+    if _length >= maxlen:
+        if not refresh:
+            raise StreamFull(f'request log stream holds {_length} entries (limit {maxlen})')
+        # Under backpressure only a fresh length can let writes through again
+        length = conn.xlen(key)
+        with _length_lock:
+            _length, _length_checked_at = length, now
+        if length >= maxlen:
+            raise StreamFull(f'request log stream holds {length} entries (limit {maxlen})')
+        refresh = False
+
+    pipe = conn.pipeline(transaction=False)
+    if refresh:
+        pipe.xlen(key)
+    pipe.xadd(key, encode_record(**fields))
+    results = pipe.execute()
+    with _length_lock:
+        if refresh:
+            # XLEN ran just before the XADD
+            _length, _length_checked_at = results[0], now
+        _length += 1
+
+
+def ensure_group(conn):
+    """Create the consumer group (and the stream) if they do not exist yet."""
+    try:
+        conn.xgroup_create(stream_key(), consumer_group(), id='0', mkstream=True)
+    except Exception as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def _persist(conn, entries):
+    """
+    bulk_create a batch of stream entries and acknowledge them.
+
+    Undecodable entries are dead-lettered immediately. Returns the number of
+    rows written; raises if the database write fails so the entries stay
+    pending and are retried.
+    """
+    from .models import RequestLog
+
+    records = []
+    ids = []
+    for entry_id, fields in entries:
+        try:
+            records.append(decode_record(fields))
+            ids.append(entry_id)
+        except Exception as e:
+            logger.warning(f"Dead-lettering malformed request log entry {entry_id}: {e}")
+            _dead_letter(conn, entry_id, fields)
+
+    if records:
+        RequestLog.objects.bulk_create(records, batch_size=batch_size())
+        pipe = conn.pipeline(transaction=False)
+        pipe.xack(stream_key(), consumer_group(), *ids)
+        pipe.xdel(stream_key(), *ids)
+        pipe.execute()
+    return len(records)
+
+
+def _dead_letter(conn, entry_id, fields):
+    pipe = conn.pipeline(transaction=False)
+    pipe.xadd(dead_letter_key(), fields, maxlen=stream_maxlen(), approximate=True)
+    pipe.xack(stream_key(), consumer_group(), entry_id)
+    pipe.xdel(stream_key(), entry_id)
+    pipe.execute()
+
+
+def _reclaim_pending(conn, consumer):
+    """
+    Claim entries left pending by failed batches or dead consumers.
+
+    Entries delivered more than IP_TRACKING_LOG_STREAM_MAX_RETRIES times
+    are dead-lettered; the rest are returned for another attempt.
+    """
+    pending = conn.xpending_range(
+        stream_key(), consumer_group(), min='-', max='+', count=batch_size(), idle=claim_idle_ms(),
+    )
+    if not pending:
+        return []
+
+    exhausted = {p['message_id'] for p in pending if p['times_delivered'] > max_retries()}
+    claimed = conn.xclaim(
+        stream_key(), consumer_group(), consumer, claim_idle_ms(),
+        [p['message_id'] for p in pending],
+    )
+
+    retry = []
+    for entry_id, fields in claimed:
+        if fields is None:
+            continue
+        if entry_id in exhausted:
+            logger.error(f"Dead-lettering request log entry {entry_id} after {max_retries()} retries")
+            _dead_letter(conn, entry_id, fields)
+        else:
+            retry.append((entry_id, fields))
+    return retry
+
+
+def stream_lag(conn):
+    """
+    Return consumer lag metrics: entries not yet delivered to the group,
+    entries delivered but not acknowledged, and dead-lettered entries.
+    """
+    metrics = {'lag': 0, 'pending': 0, 'dead_letter': 0, 'length': 0}
+    try:
+        metrics['length'] = conn.xlen(stream_key())
+        metrics['dead_letter'] = conn.xlen(dead_letter_key())
+        for group in conn.xinfo_groups(stream_key()):
+            name = group['name'].decode() if isinstance(group['name'], bytes) else group['name']
+            if name == consumer_group():
+                metrics['pending'] = group.get('pending', 0)
+                lag = group.get('lag')
+                # Redis < 7 does not report lag; approximate from stream length.
+                metrics['lag'] = lag if lag is not None else max(metrics['length'] - metrics['pending'], 0)
+    except Exception as e:
+        logger.debug(f"Could not read request log stream metrics: {e}")
+    return metrics
+
+
+def drain(consumer='drainer'):
+    """
+    Drain the request log stream into RequestLog.
+
+    Reads at most IP_TRACKING_LOG_STREAM_MAX_BATCHES batches of
+    IP_TRACKING_LOG_STREAM_BATCH_SIZE entries per call so a single run
+    cannot monopolise a worker; the remaining backlog is left for the next
+    run and reported through the lag metric. Returns without touching
+    Redis unless a stream sink is configured.
+    """
+    from .sinks import stream_enabled
+
+    if not stream_enabled():
+        return {'written': 0, 'lag': None}
+
+    conn = get_stream_connection()
+    if conn is None:
+        logger.debug("Request log stream unavailable (cache is not Redis-backed)")
+        return {'written': 0, 'lag': None}
+
+    ensure_group(conn)
+
+    written = 0
+    failed = 0
+
+    retry = _reclaim_pending(conn, consumer)
+    if retry:
+        try:
+            written += _persist(conn, retry)
+        except Exception as e:
+            failed += len(retry)
+            logger.error(f"Retrying {len(retry)} request log entries failed: {e}")
+
+    size = batch_size()
+    batches = max_batches()
+    for _ in range(batches):
+        response = conn.xreadgroup(consumer_group(), consumer, {stream_key(): '>'}, count=size)
+        if not response:
+            break
+        entries = response[0][1]
+        if not entries:
+            break
+        try:
+            written += _persist(conn, entries)
+        except Exception as e:
+            # Leave the batch pending; it will be reclaimed and retried.
+            failed += len(entries)
+            logger.error(f"Failed to persist {len(entries)} request log entries: {e}")
+            break
+        if len(entries) < size:
+            break
+
+    metrics = stream_lag(conn)
+    metrics.update({'written': written, 'failed': failed})
+    cache.set(LAG_CACHE_KEY, metrics, 300)
+
+    if metrics['lag'] > size * batches:
+        logger.warning(f"Request log stream is falling behind: lag={metrics['lag']}")
+    return metrics
@@ -0,0 +1,184 @@
+"""
+Buffered RequestLog writer.
+
+Request logs are queued in a bounded per-process buffer and persisted in
+batches with ``bulk_create`` instead of one INSERT per request. The buffer
+is flushed when it reaches IP_TRACKING_LOG_BATCH_SIZE records, when the
+oldest queued record is older than IP_TRACKING_LOG_FLUSH_INTERVAL seconds,
+and when the worker process exits.
+
+Set IP_TRACKING_LOG_SYNC_WRITES = True to bypass the buffer and write each
+record immediately (useful for tests and low-traffic deployments).
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class RequestLogWriter:
+    """
+    Bounded in-memory buffer of pending RequestLog rows.
+
+    When the buffer is full, new records are dropped (and counted) rather
+    than blocking the request.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_buffer=None, sync_writes=None):
+        self.batch_size = batch_size or getattr(settings, 'IP_TRACKING_LOG_BATCH_SIZE', 200)
+        self.flush_interval = flush_interval or getattr(settings, 'IP_TRACKING_LOG_FLUSH_INTERVAL', 5.0)
+        self.max_buffer = max_buffer or getattr(settings, 'IP_TRACKING_LOG_MAX_BUFFER', 10000)
+        if sync_writes is None:
+            sync_writes = getattr(settings, 'IP_TRACKING_LOG_SYNC_WRITES', False)
+        self.sync_writes = sync_writes
+
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._oldest = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._flusher = None
+
+        # Counters
+        self.enqueued_count = 0
+        self.flushed_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+
+    def write(self, flush_inline=True, **fields):
+        """
+        Queue a RequestLog record built from ``fields``.
+
+        With ``flush_inline=False`` a due flush is handed to the background
+        flusher instead of running in the calling thread (required from
+        async code, which must not touch the ORM directly).
+
+        Returns False if the record was dropped because the buffer is full.
+        """
+        from .models import RequestLog
+
+        record = RequestLog(**fields)
+
+        if self.sync_writes:
+            try:
+                record.save()
+                self.flushed_count += 1
+            except Exception as e:
+                self.failed_count += 1
+                logger.error(f"Failed to log request: {e}")
+            return True
+
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped_count += 1
+                return False
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(record)
+            self.enqueued_count += 1
+            should_flush = (
+                len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._oldest >= self.flush_interval
+            )
+
+        self._ensure_flusher()
+        if should_flush:
+            if flush_inline:
+                self.flush()
+            else:
+                self._wake.set()
+        return True
+
+    async def awrite(self, **fields):
+        """Async variant of write() that never blocks the event loop on the database."""
+        if self.sync_writes:
+            from asgiref.sync import sync_to_async
+            return await sync_to_async(self.write)(**fields)
+        return self.write(flush_inline=False, **fields)
+
+    def flush(self):
+        """Persist all buffered records with a single bulk_create."""
+        from .models import RequestLog
+
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                batch = list(self._buffer)
+                self._buffer.clear()
+                self._oldest = None
+
+            try:
+                RequestLog.objects.bulk_create(batch, batch_size=self.batch_size)
+            except Exception as e:
+                self.failed_count += len(batch)
+                logger.error(f"Failed to flush {len(batch)} request log(s): {e}")
+                return 0
+
+            self.flushed_count += len(batch)
+            return len(batch)
+
+    def stats(self):
+        """Return a snapshot of the writer counters."""
+        return {
+            'buffered': len(self._buffer),
+            'enqueued': self.enqueued_count,
+            'flushed': self.flushed_count,
+            'dropped': self.dropped_count,
+            'failed': self.failed_count,
+        }
+
+    def shutdown(self):
+        """Stop the background flusher and flush remaining records."""
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+    def _ensure_flusher(self):
+        """Start the age-based background flusher on first use."""
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(
+                target=self._run_flusher,
+                name='request-log-flusher',
+                daemon=True,
+            )
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stop.is_set():
+            woken = self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            oldest = self._oldest
+            if woken or (oldest is not None and time.monotonic() - oldest >= self.flush_interval):
+                try:
+                    self.flush()
+                finally:
+                    close_old_connections()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    """Return the process-wide RequestLogWriter, creating it on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = RequestLogWriter()
+                atexit.register(_writer.shutdown)
+    return _writer
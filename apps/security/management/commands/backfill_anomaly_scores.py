@@ -0,0 +1,99 @@
+"""
+Management command to re-score historical RequestLog traffic.
+
+Splits the range into windows scored in parallel by a process pool and
+stores the results under a new AnomalyBackfillRun (see
+apps/security/backfill.py):
+
+    python manage.py backfill_anomaly_scores --days 30
+    python manage.py backfill_anomaly_scores --since 2024-05-01 --until 2024-05-08 \\
+        --volume-threshold 60 --model latest --workers 16
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.security import backfill
+from apps.security.utils import parse_moment
+
+
+class Command(BaseCommand):
+    help = 'Re-score past RequestLog windows in parallel and store the results as a backfill run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, help='Start of the range (date or datetime, UTC)')
+        parser.add_argument('--until', type=str, help='End of the range, exclusive (default: start of the current hour)')
+        parser.add_argument('--days', type=int, default=7, help='Days before --until to score when --since is not given')
+        parser.add_argument(
+            '--window-minutes',
+            type=int,
+            default=backfill.WINDOW_MINUTES,
+            help='Window length; rule thresholds apply per window (default: 60)'
+        )
+        parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+        parser.add_argument('--volume-threshold', type=int, help='Requests per window flagged as high volume')
+        parser.add_argument('--sensitive-threshold', type=int, help='Sensitive path hits per window flagged')
+        parser.add_argument(
+            '--model',
+            type=str,
+            default=None,
+            help="Also score with a saved anomaly model: a version number or 'latest'"
+        )
+        parser.add_argument(
+            '--store-all',
+            action='store_true',
+            help='Store every IP window, not only flagged ones'
+        )
+
+    def handle(self, *args, **options):
+        if options['window_minutes'] < 1:
+            raise CommandError('--window-minutes must be at least 1')
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        try:
+            if options['until']:
+                until = parse_moment(options['until'])
+            else:
+                # Whole hours up to the current one, so windows line up with the clock
+                until = timezone.now().replace(minute=0, second=0, microsecond=0)
+            since = parse_moment(options['since']) if options['since'] else until - timedelta(days=options['days'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if since >= until:
+            raise CommandError('--since must be before --until')
+
+        model = options['model']
+        if model is not None and model != 'latest':
+            try:
+                model = int(model)
+            except ValueError:
+                raise CommandError("--model must be a version number or 'latest'")
+
+        def progress(done, total, flagged):
+            if done % 24 == 0 or done == total:
+                self.stdout.write(f'  {done}/{total} windows scored, {flagged} flagged')
+
+        try:
+            run = backfill.run_backfill(
+                since,
+                until,
+                window_minutes=options['window_minutes'],
+                workers=options['workers'],
+                volume_threshold=options['volume_threshold'],
+                sensitive_threshold=options['sensitive_threshold'],
+                model_version=model,
+                store_all=options['store_all'],
+                progress=progress,
+            )
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        elapsed = (run.finished_at - run.started_at).total_seconds()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Backfill run {run.pk} scored {run.windows_total} window(s) in {elapsed:.1f}s: '
+                f'{run.flagged_count} flagged IP window(s)'
+            )
+        )
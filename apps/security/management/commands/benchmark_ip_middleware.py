@@ -0,0 +1,79 @@
+"""
+Management command to benchmark IPLoggingMiddleware under ASGI.
+
+Compares requests/second of the native async middleware against the same
+middleware adapted the way Django adapts a sync-only middleware in an ASGI
+stack (thread-sensitive sync_to_async around every call).
+
+This drives the middleware in-process with an asyncio load generator so it
+can run anywhere. For an end-to-end figure, run the project under uvicorn
+(``uvicorn airbnb_clone.asgi:application --workers 1``) and point a load
+tool such as ``wrk`` or ``hey`` at it, toggling between the two modes by
+temporarily setting ``IPLoggingMiddleware.async_capable = False``.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from apps.security.middleware import IPLoggingMiddleware
+
+
+class Command(BaseCommand):
+    help = 'Benchmark native async vs sync-adapted IPLoggingMiddleware (requests/second)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help='Requests per run')
+        parser.add_argument('--concurrency', type=int, default=100, help='Concurrent in-flight requests')
+        parser.add_argument('--ips', type=int, default=500, help='Distinct client IPs to rotate through')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        concurrency = options['concurrency']
+        factory = RequestFactory()
+
+        def make_request(i):
+            request = factory.get(
+                f'/properties/{i % 1000}/',
+                REMOTE_ADDR=f'203.0.{(i % options["ips"]) // 256}.{i % 256}',
+            )
+            request.user = AnonymousUser()
+            return request
+
+        def sync_view(request):
+            return HttpResponse('ok')
+
+        async def async_view(request):
+            return HttpResponse('ok')
+
+        # Native async middleware
+        native = IPLoggingMiddleware(async_view)
+
+        # Sync-only adaptation, as Django's BaseHandler.adapt_method_mode does
+        adapted = sync_to_async(IPLoggingMiddleware(sync_view), thread_sensitive=True)
+
+        results = {}
+        for label, handler in (('sync_to_async (current)', adapted), ('native async', native)):
+            # Warm up caches (GeoIP LRU, blocklist) so both runs see the same state
+            asyncio.run(self._run(handler, make_request, min(total, 500), concurrency))
+            elapsed = asyncio.run(self._run(handler, make_request, total, concurrency))
+            results[label] = total / elapsed
+            self.stdout.write(f'{label:>26}: {results[label]:10.0f} req/s ({elapsed:.2f}s for {total} requests)')
+
+        baseline, native_rps = results.values()
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {native_rps / baseline:.2f}x'))
+
+    async def _run(self, handler, make_request, total, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                await handler(make_request(i))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return time.perf_counter() - start
@@ -2,19 +2,32 @@
 Management command to block IP addresses.
 
 Task 1: Create a management command to add IPs to BlockedIP.
+
+Besides single addresses, whole lists can be imported from files or stdin
+(plain text or threat-feed CSV) and the current blocklist can be exported:
+
+    python manage.py block_ip 203.0.113.7 --reason "Brute force"
+    python manage.py block_ip --file feed.csv --reason "Threat feed"
+    curl -s https://example.org/drop.txt | python manage.py block_ip --file -
+    python manage.py block_ip --export blocklist.csv
 """
-from django.core.management.base import BaseCommand
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.security.blocklist import bulk_block, parse_entries, parse_entry
 from apps.security.models import BlockedIP
 
 
 class Command(BaseCommand):
-    help = 'Block an IP address by adding it to the blacklist'
+    help = 'Block IP addresses or CIDR ranges, import blocklists, or export the blacklist'
 
     def add_arguments(self, parser):
         parser.add_argument(
             'ip_address',
             type=str,
-            help='IP address to block (IPv4 or IPv6)'
+            nargs='*',
+            help='IP address(es) or CIDR range(s) to block (IPv4 or IPv6)'
         )
         parser.add_argument(
             '--reason',
@@ -22,14 +35,67 @@ class Command(BaseCommand):
             default='',
             help='Reason for blocking this IP'
         )
+        parser.add_argument(
+            '--file',
+            type=str,
+            action='append',
+            default=[],
+            help="Import IPs/CIDRs from a plain-text or CSV file ('-' for stdin); may be repeated"
+        )
+        parser.add_argument(
+            '--export',
+            type=str,
+            help="Write the current blocklist as CSV to this file ('-' for stdout)"
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per INSERT when importing (default: 5000)'
+        )
 
     def handle(self, *args, **options):
-        ip_address = options['ip_address']
-        reason = options['reason'] or 'Manually blocked via management command'
+        if options['export']:
+            self._export(options['export'])
+            return
+
+        if not options['ip_address'] and not options['file']:
+            raise CommandError('Give at least one IP address or --file')
+
+        if len(options['ip_address']) == 1 and not options['file']:
+            self._block_one(options['ip_address'][0], options['reason'])
+            return
+
+        reason = options['reason'] or 'Imported via management command'
+        entries, skipped = parse_entries(options['ip_address'])
+        for path in options['file']:
+            if path == '-':
+                file_entries, file_skipped = parse_entries(sys.stdin)
+            else:
+                try:
+                    with open(path, newline='', encoding='utf-8-sig') as f:
+                        file_entries, file_skipped = parse_entries(f)
+                except OSError as e:
+                    raise CommandError(f'Cannot read {path}: {e}')
+            entries += file_entries
+            skipped += file_skipped
+
+        created = bulk_block(entries, reason=reason, batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Blocked {created} new IP(s)/range(s) from {len(entries)} entries '
+                f'({len(entries) - created} already blocked or duplicated, {skipped} unparseable lines skipped)'
+            )
+        )
+
+    def _block_one(self, ip_address, reason):
+        reason = reason or 'Manually blocked via management command'
 
         try:
+            address, prefix_length = parse_entry(ip_address)
             blocked_ip, created = BlockedIP.objects.get_or_create(
-                ip_address=ip_address,
+                ip_address=address,
+                prefix_length=prefix_length,
                 defaults={'reason': reason}
             )
 
@@ -51,3 +117,20 @@ class Command(BaseCommand):
                     f'Error blocking IP {ip_address}: {str(e)}'
                 )
             )
+
+    def _export(self, path):
+        out = self.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            writer = csv.writer(out)
+            writer.writerow(['cidr', 'reason', 'created_at'])
+            count = 0
+            rows = BlockedIP.objects.order_by('id').values_list('ip_address', 'prefix_length', 'reason', 'created_at')
+            for ip_address, prefix_length, reason, created_at in rows.iterator(chunk_size=5000):
+                cidr = ip_address if prefix_length is None else f'{ip_address}/{prefix_length}'
+                writer.writerow([cidr, reason or '', created_at.isoformat()])
+                count += 1
+        finally:
+            if out is not self.stdout:
+                out.close()
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(f'Exported {count} blocked IP(s) to {path}'))
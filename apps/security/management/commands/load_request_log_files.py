@@ -0,0 +1,44 @@
+"""
+Management command to ship request logs written by the file sink into RequestLog.
+
+Loads every rotated ``*.jsonl.gz`` file in the sink directory with
+``bulk_create`` and moves it to ``loaded/`` (see apps/security/sinks.py).
+Run it where DB write capacity is available, e.g. from cron after copying
+the files off the web nodes:
+
+    python manage.py load_request_log_files
+    python manage.py load_request_log_files --directory /mnt/shipped/requestlogs --delete
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.security.sinks import load_files
+
+
+class Command(BaseCommand):
+    help = 'Bulk-load rotated request log files from the file sink into RequestLog'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            type=str,
+            default=getattr(settings, 'IP_TRACKING_LOG_FILE_DIR', 'request_logs'),
+            help='Directory holding the rotated .jsonl.gz files'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per INSERT (default: 5000)'
+        )
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            help='Delete files after loading instead of moving them to loaded/'
+        )
+
+    def handle(self, *args, **options):
+        files, rows, skipped = load_files(options['directory'], batch_size=options['batch_size'], delete=options['delete'])
+        self.stdout.write(self.style.SUCCESS(f'Loaded {rows} request log(s) from {files} file(s)'))
+        if skipped:
+            self.stdout.write(self.style.WARNING(f'Skipped {skipped} malformed line(s)'))
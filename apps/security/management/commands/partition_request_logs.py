@@ -0,0 +1,58 @@
+"""
+Management command to manage time-partitioned RequestLog storage.
+
+Converts the RequestLog table to RANGE partitions on PostgreSQL and
+pre-creates upcoming partitions.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.security import partitioning
+
+
+class Command(BaseCommand):
+    help = 'Convert RequestLog to partitioned storage (PostgreSQL) and create upcoming partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert',
+            action='store_true',
+            help='Convert the existing table to partitioned storage (copies all rows; run in a maintenance window)'
+        )
+        parser.add_argument(
+            '--interval',
+            choices=['day', 'month'],
+            help='Partition granularity used by --convert (recorded with the table and used for later partitions; '
+                 'default: IP_TRACKING_PARTITION_INTERVAL)'
+        )
+        parser.add_argument(
+            '--ahead',
+            type=int,
+            help='Number of future partitions to keep created (default: IP_TRACKING_PARTITIONS_AHEAD)'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(
+                f'Partitioned storage requires PostgreSQL (current backend: {connection.vendor}). '
+                f'cleanup_old_logs uses chunked deletes on this backend.'
+            )
+
+        if options['convert']:
+            if partitioning.convert_to_partitioned(options['interval'], options['ahead']):
+                self.stdout.write(self.style.SUCCESS('Converted RequestLog to partitioned storage'))
+            else:
+                self.stdout.write(self.style.WARNING('RequestLog is already partitioned'))
+
+        if not partitioning.is_partitioned():
+            self.stdout.write(self.style.WARNING('RequestLog is not partitioned; run with --convert first'))
+            return
+
+        created = partitioning.ensure_partitions(options['ahead'])
+        partitions = partitioning.list_partitions()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{created} partition(s) created, {len(partitions)} in total '
+                f'({partitions[0][0]} .. {partitions[-1][0]})'
+            )
+        )
@@ -5,37 +5,266 @@ This middleware implements:
 - Task 0: Basic IP logging
 - Task 1: IP blacklisting (returns 403 for blocked IPs)
 - Task 2: IP geolocation with 24-hour caching
+
+Requests are logged after the response, subject to the sampling policy in
+IP_TRACKING_SAMPLING (see sampling.py), together with the status code,
+duration, DB query count/time, response size and resolved view.
+
+RateLimitMiddleware applies the token-bucket policies in RATE_LIMIT_POLICIES
+(see rate_limits.py).
+
+The middleware is both sync- and async-capable: under ASGI it runs natively
+on the event loop (async cache, in-memory blocklist, non-blocking hand-off
+to the log writer) instead of being wrapped in a thread-sensitive
+sync_to_async call on every request.
 """
 import logging
-from django.utils.deprecation import MiddlewareMixin
-from django.http import HttpResponseForbidden
-from django.core.cache import cache
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpResponseForbidden, JsonResponse
 from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.functional import empty
 from ipware import get_client_ip
 
-from .models import RequestLog, BlockedIP
+from . import counters, enrichment, log_stream, routes
+from .blocklist import get_blocklist
+from .geoip import get_geoip_service
+from .sinks import get_sinks
+from .rate_limits import aidentify, get_rate_limiter, identify
+from .sampling import get_sampling_policy
 
 logger = logging.getLogger(__name__)
 
 
-class IPLoggingMiddleware(MiddlewareMixin):
+async def aget_user(request):
+    """Resolve the authenticated user (or None) without blocking the event loop."""
+    if not hasattr(request, 'user'):
+        return None
+    user = getattr(request.user, '_wrapped', request.user)
+    if user is not empty:
+        # Already resolved (or not lazy); no I/O needed
+        return user if user.is_authenticated else None
+    if hasattr(request, 'auser'):  # Django 5.0+
+        user = await request.auser()
+    else:
+        user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    return user if user is not None and user.is_authenticated else None
+
+
+class QueryTimer:
+    """
+    Count and time the queries run on every database connection of the
+    current thread while the context is active (a connection execute
+    wrapper, so it works without DEBUG).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+        self._stack = ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.count += 1
+
+    def __enter__(self):
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+class IPLoggingMiddleware:
     """
     Middleware to log IP addresses, block blacklisted IPs,
     and perform geolocation lookups with caching.
     """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.process_request(request)
+        if response is None:
+            tracking = getattr(request, '_ip_tracking', None)
+            if tracking is None:
+                response = self.get_response(request)
+            else:
+                with QueryTimer() as timer:
+                    response = self.get_response(request)
+                tracking['queries'] = timer
+        self.process_response(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.aprocess_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        await self.aprocess_response(request, response)
+        return response
 
     def process_request(self, request):
         """
         Process each request to:
         1. Extract client IP address
         2. Check if IP is blocked (Task 1)
-        3. Perform geolocation lookup with caching (Task 2)
-        4. Log the request (Task 0)
+        3. Update the real-time counters
+
+        Geolocation and logging happen in process_response(), once the
+        sampling policy can see the response status.
         """
         # Skip logging for static files and health checks
         if self._should_skip_logging(request):
             return None
 
+        ip = self._get_ip(request)
+        request._ip_tracking = {
+            'ip': ip, 'timestamp': timezone.now(), 'start': time.perf_counter(), 'blocked': False,
+        }
+
+        # Task 1: Check if IP is blocked
+        if self._is_ip_blocked(ip):
+            request._ip_tracking['blocked'] = True
+            return self._forbidden(ip, request)
+
+        # Real-time sliding-window counters (flags threshold crossings).
+        # Every request is counted, whether or not it is sampled for logging.
+        self._count_request(ip, request.path)
+        return None
+
+    async def aprocess_request(self, request):
+        """Async counterpart of process_request() used under ASGI."""
+        if self._should_skip_logging(request):
+            return None
+
+        ip = self._get_ip(request)
+        request._ip_tracking = {
+            'ip': ip, 'timestamp': timezone.now(), 'start': time.perf_counter(), 'blocked': False,
+        }
+
+        if await get_blocklist().ais_blocked(ip):
+            request._ip_tracking['blocked'] = True
+            return self._forbidden(ip, request)
+
+        await self._acount_request(ip, request.path)
+        return None
+
+    def process_response(self, request, response):
+        """Apply the sampling policy and log the request (Tasks 0 and 2)."""
+        tracking = getattr(request, '_ip_tracking', None)
+        if tracking is None:
+            return
+        ip = tracking['ip']
+        user = request.user if hasattr(request, 'user') and request.user.is_authenticated else None
+
+        route, view_name = routes.route_for(request)
+        weight = get_sampling_policy().weight(
+            ip, route, request.path, request.method, response.status_code,
+            authenticated=user is not None, blocked=tracking['blocked'],
+        )
+        if not weight:
+            return
+
+        # Task 2: Get geolocation data (with 24-hour cache)
+        country, city = self._get_geolocation(ip)
+
+        # Task 0: Log the request
+        route_id = None
+        if route:
+            try:
+                route_id = routes.intern_route(route, view_name)
+            except Exception as e:
+                logger.debug(f"Could not intern route {route}: {e}")
+        self._log_request(
+            ip_address=ip,
+            timestamp=tracking['timestamp'],
+            route_id=route_id,
+            path=self._raw_path(request, route_id),
+            method=request.method,
+            country=country,
+            city=city,
+            user=user,
+            sample_weight=weight,
+            **self._response_metrics(tracking, response),
+        )
+
+    async def aprocess_response(self, request, response):
+        """Async counterpart of process_response()."""
+        tracking = getattr(request, '_ip_tracking', None)
+        if tracking is None:
+            return
+        ip = tracking['ip']
+        user = await self._aget_user(request)
+
+        route, view_name = routes.route_for(request)
+        weight = get_sampling_policy().weight(
+            ip, route, request.path, request.method, response.status_code,
+            authenticated=user is not None, blocked=tracking['blocked'],
+        )
+        if not weight:
+            return
+
+        if enrichment.is_deferred():
+            country, city = None, None
+        else:
+            country, city = await get_geoip_service().alocate(ip)
+
+        route_id = routes.cached_route_id(route) if route else None
+        if route and route_id is None:
+            try:
+                route_id = await sync_to_async(routes.intern_route)(route, view_name)
+            except Exception as e:
+                logger.debug(f"Could not intern route {route}: {e}")
+
+        await self._alog_request(
+            ip_address=ip,
+            timestamp=tracking['timestamp'],
+            route_id=route_id,
+            path=self._raw_path(request, route_id),
+            method=request.method,
+            country=country,
+            city=city,
+            user=user,
+            sample_weight=weight,
+            **self._response_metrics(tracking, response),
+        )
+
+    def _response_metrics(self, tracking, response):
+        """Status, latency, DB usage and size of the response being logged."""
+        queries = tracking.get('queries')
+        if response.streaming:
+            size = response.get('Content-Length')
+            size = int(size) if size and size.isdigit() else None
+        else:
+            size = len(response.content)
+        return {
+            'status_code': response.status_code,
+            'duration_us': int((time.perf_counter() - tracking['start']) * 1_000_000),
+            # Only measurable on the sync path; async views run their queries
+            # on other threads' connections.
+            'db_queries': min(queries.count, 32767) if queries else None,
+            'db_time_us': int(queries.elapsed * 1_000_000) if queries else None,
+            'response_bytes': size,
+        }
+
+    def _get_ip(self, request):
+        """Extract the (optionally anonymized) client IP address."""
         # Get client IP address using django-ipware
         ip, is_routable = get_client_ip(request)
         if ip is None:
@@ -44,31 +273,66 @@ class IPLoggingMiddleware(MiddlewareMixin):
         # Anonymize IP if configured (for privacy compliance)
         if getattr(settings, 'IP_TRACKING_ANONYMIZE', False):
             ip = self._anonymize_ip(ip)
+        return ip
 
-        # Task 1: Check if IP is blocked
-        if self._is_ip_blocked(ip):
-            logger.warning(f"Blocked IP attempt: {ip} accessing {request.path}")
-            return HttpResponseForbidden(
-                "Forbidden: Your IP address has been blacklisted."
-            )
+    def _raw_path(self, request, route_id):
+        """Raw path to store: always for unresolved requests, else only if configured."""
+        if route_id is None or getattr(settings, 'IP_TRACKING_STORE_RAW_PATH', False):
+            return request.path[:500]
+        return ''
 
-        # Task 2: Get geolocation data (with 24-hour cache)
-        country, city = self._get_geolocation(ip)
+    def _forbidden(self, ip, request):
+        logger.warning(f"Blocked IP attempt: {ip} accessing {request.path}")
+        return HttpResponseForbidden(
+            "Forbidden: Your IP address has been blacklisted."
+        )
 
-        # Task 0: Log the request
+    async def _aget_user(self, request):
+        """Resolve the authenticated user without blocking the event loop."""
+        return await aget_user(request)
+
+    def _count_request(self, ip, path):
+        """Update the Redis sliding-window counters for this request."""
+        if not getattr(settings, 'IP_TRACKING_REALTIME_COUNTERS', True):
+            return
+        conn = log_stream.get_stream_connection()
+        if conn is None:
+            return
         try:
-            RequestLog.objects.create(
-                ip_address=ip,
-                path=request.path,
-                method=request.method,
-                country=country,
-                city=city,
-                user=request.user if hasattr(request, 'user') and request.user.is_authenticated else None
-            )
+            counters.flag_crossing(ip, counters.record_hit(conn, ip, path))
         except Exception as e:
-            logger.error(f"Failed to log request: {e}")
+            logger.debug(f"Sliding-window counter update failed for {ip}: {e}")
 
-        return None
+    async def _acount_request(self, ip, path):
+        """Async counterpart of _count_request() using redis.asyncio."""
+        if not getattr(settings, 'IP_TRACKING_REALTIME_COUNTERS', True):
+            return
+        try:
+            counts = await counters.arecord_hit(ip, path)
+            if counts and counts[2]:
+                await sync_to_async(counters.flag_crossing)(ip, counts)
+        except Exception as e:
+            logger.debug(f"Sliding-window counter update failed for {ip}: {e}")
+
+    def _log_request(self, **fields):
+        """
+        Hand the request log to every sink in IP_TRACKING_LOG_SINKS (the
+        buffered database writer, the Redis stream, rotating files; see
+        sinks.py).
+        """
+        for sink in get_sinks():
+            try:
+                sink.write(**fields)
+            except Exception as e:
+                logger.error(f"Failed to log request to {sink.name} sink: {e}")
+
+    async def _alog_request(self, **fields):
+        """Async counterpart of _log_request(); sinks never write to the DB inline."""
+        for sink in get_sinks():
+            try:
+                await sink.awrite(**fields)
+            except Exception as e:
+                logger.error(f"Failed to log request to {sink.name} sink: {e}")
 
     def _should_skip_logging(self, request):
         """Skip logging for static files and common health check paths."""
@@ -77,59 +341,24 @@ class IPLoggingMiddleware(MiddlewareMixin):
 
     def _is_ip_blocked(self, ip):
         """
-        Check if IP is in the blacklist.
-        Uses cache to avoid frequent database queries.
+        Check if IP is in the blacklist (single IPs or CIDR ranges).
+        Matched against a per-worker compiled blocklist, so no cache or
+        database round trip is needed per request.
         """
-        cache_key = f'blocked_ip:{ip}'
-        is_blocked = cache.get(cache_key)
-
-        if is_blocked is None:
-            is_blocked = BlockedIP.objects.filter(ip_address=ip).exists()
-            # Cache for 1 hour
-            cache.set(cache_key, is_blocked, 3600)
-
-        return is_blocked
+        return get_blocklist().is_blocked(ip)
 
     def _get_geolocation(self, ip):
         """
         Get geolocation data for an IP address using geoip2 (MaxMind).
-        Uses 24-hour caching to avoid repeated DB lookups.
+        Served from the process-wide GeoIP service (in-process LRU, then
+        24-hour cache, then a shared memory-mapped reader).
+
+        In deferred mode no lookup is made; rows are enriched later by the
+        enrich_request_log_geo task.
         """
-        # Skip geolocation for local/private IPs
-        if ip in ['127.0.0.1', '::1', '0.0.0.0'] or ip.startswith('192.168.') or ip.startswith('10.'):
+        if enrichment.is_deferred():
             return None, None
-
-        cache_key = f'geoip:{ip}'
-        geo_data = cache.get(cache_key)
-
-        if geo_data is None:
-            country = None
-            city = None
-            try:
-                from geoip2.database import Reader
-                import os
-                geoip_path = getattr(settings, 'GEOIP_PATH', None) or os.environ.get('GEOIP_PATH')
-                if not geoip_path:
-                    logger.warning("GEOIP_PATH not set in settings or environment. Geolocation will be skipped.")
-                else:
-                    db_file = os.path.join(geoip_path, 'GeoLite2-City.mmdb')
-                    if not os.path.exists(db_file):
-                        logger.warning(f"GeoLite2-City.mmdb not found at {db_file}. Download from MaxMind and place it there.")
-                    else:
-                        with Reader(db_file) as reader:
-                            response = reader.city(ip)
-                            country = response.country.name
-                            city = response.city.name
-            except ImportError:
-                logger.warning("geoip2 not installed. Install with: pip install geoip2")
-            except Exception as e:
-                logger.debug(f"GeoIP2 lookup failed for {ip}: {e}")
-
-            geo_data = {'country': country, 'city': city}
-            # Cache for 24 hours (86400 seconds)
-            cache.set(cache_key, geo_data, 86400)
-
-        return geo_data.get('country'), geo_data.get('city')
+        return get_geoip_service().locate(ip)
 
     def _anonymize_ip(self, ip):
         """
@@ -146,3 +375,69 @@ class IPLoggingMiddleware(MiddlewareMixin):
             if len(parts) >= 4:
                 return ':'.join(parts[:4]) + '::0'
         return ip
+
+
+class RateLimitMiddleware:
+    """
+    Token-bucket rate limiting for every route covered by RATE_LIMIT_POLICIES
+    (see rate_limits.py). Over-limit requests get a 429; every limited
+    response carries RateLimit-* headers.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        policy = self._policy(request)
+        if policy is None:
+            return self.get_response(request)
+
+        user = request.user if hasattr(request, 'user') and request.user.is_authenticated else None
+        role, identity = identify(request, policy, self._get_ip(request), user)
+        decision = get_rate_limiter().check(policy, role, identity)
+        if decision is not None and not decision.allowed:
+            return self._too_many_requests(decision, role)
+        return self._add_headers(self.get_response(request), decision, role)
+
+    async def __acall__(self, request):
+        policy = self._policy(request)
+        if policy is None:
+            return await self.get_response(request)
+
+        role, identity = await aidentify(request, policy, self._get_ip(request), await aget_user(request))
+        decision = await get_rate_limiter().acheck(policy, role, identity)
+        if decision is not None and not decision.allowed:
+            return self._too_many_requests(decision, role)
+        return self._add_headers(await self.get_response(request), decision, role)
+
+    def _policy(self, request):
+        if not getattr(settings, 'RATE_LIMIT_ENABLED', True) or request.method == 'OPTIONS':
+            return None
+        return get_rate_limiter().policy_for(routes.resolve_route(request.path_info), request.method)
+
+    def _get_ip(self, request):
+        ip, is_routable = get_client_ip(request)
+        return ip or '0.0.0.0'
+
+    def _too_many_requests(self, decision, role):
+        logger.info(f"Rate limit '{decision.policy.name}' exceeded ({role})")
+        response = JsonResponse(
+            {'error': 'Rate limit exceeded', 'retry_after': decision.retry_after},
+            status=429
+        )
+        response['Retry-After'] = str(decision.retry_after)
+        return self._add_headers(response, decision, role)
+
+    def _add_headers(self, response, decision, role):
+        if decision is not None:
+            response['RateLimit-Limit'] = str(decision.limit)
+            response['RateLimit-Remaining'] = str(decision.remaining)
+            response['RateLimit-Reset'] = str(decision.reset)
+            response['RateLimit-Policy'] = decision.policy.header(role)
+        return response
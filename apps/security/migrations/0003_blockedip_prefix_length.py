@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0002_requestlog_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blockedip',
+            name='prefix_length',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='CIDR prefix length to block a whole range (empty for a single IP)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='blockedip',
+            name='ip_address',
+            field=models.GenericIPAddressField(help_text='IP address (or network address of a range) to block', unique=True),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0003_blockedip_prefix_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyCountryTraffic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour (UTC)')),
+                ('country', models.CharField(blank=True, help_text='Country from geolocation', max_length=100)),
+                ('request_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Hourly Country Traffic',
+                'verbose_name_plural': 'Hourly Country Traffic',
+                'ordering': ['-hour', '-request_count'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyIPTraffic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour (UTC)')),
+                ('ip_address', models.GenericIPAddressField(help_text='Client IP address')),
+                ('request_count', models.PositiveIntegerField(default=0)),
+                ('sensitive_count', models.PositiveIntegerField(default=0, help_text='Requests to sensitive paths')),
+            ],
+            options={
+                'verbose_name': 'Hourly IP Traffic',
+                'verbose_name_plural': 'Hourly IP Traffic',
+                'ordering': ['-hour', '-request_count'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyPathTraffic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour (UTC)')),
+                ('path', models.CharField(help_text='Request path', max_length=500)),
+                ('request_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Hourly Path Traffic',
+                'verbose_name_plural': 'Hourly Path Traffic',
+                'ordering': ['-hour', '-request_count'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Rollup Watermark',
+                'verbose_name_plural': 'Rollup Watermarks',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hourlypathtraffic',
+            constraint=models.UniqueConstraint(fields=('hour', 'path'), name='uniq_hourly_path_traffic'),
+        ),
+        migrations.AddIndex(
+            model_name='hourlyiptraffic',
+            index=models.Index(fields=['ip_address', 'hour'], name='security_ho_ip_addr_2d9d4d_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyiptraffic',
+            constraint=models.UniqueConstraint(fields=('hour', 'ip_address'), name='uniq_hourly_ip_traffic'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlycountrytraffic',
+            constraint=models.UniqueConstraint(fields=('hour', 'country'), name='uniq_hourly_country_traffic'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0004_hourly_traffic_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestRoute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route', models.CharField(help_text='URL route pattern', max_length=255, unique=True)),
+                ('is_sensitive', models.BooleanField(default=False, help_text='Route matches one of IP_TRACKING_SENSITIVE_PATHS')),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Request Route',
+                'verbose_name_plural': 'Request Routes',
+                'ordering': ['route'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='requestlog',
+            name='security_re_path_5844a3_idx',
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='path',
+            field=models.CharField(blank=True, default='', help_text='Raw request path (optional)', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='route',
+            field=models.ForeignKey(blank=True, help_text='Resolved URL route pattern', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='security.requestroute'),
+        ),
+    ]
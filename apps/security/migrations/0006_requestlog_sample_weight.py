@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0005_requestlog_route'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='sample_weight',
+            field=models.PositiveIntegerField(default=1, help_text='Number of requests this row represents under the sampling policy'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0006_requestlog_sample_weight'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blockedip',
+            index=models.Index(fields=['created_at'], name='security_bl_created_11b2e5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['route', 'timestamp'], name='security_re_route_i_c59a81_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0007_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='db_queries',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Database queries run', null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='db_time_us',
+            field=models.PositiveIntegerField(blank=True, help_text='Database time in microseconds', null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='duration_us',
+            field=models.PositiveIntegerField(blank=True, help_text='Response time in microseconds', null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='response_bytes',
+            field=models.PositiveIntegerField(blank=True, help_text='Response body size in bytes', null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='HTTP response status', null=True),
+        ),
+        migrations.AddField(
+            model_name='requestroute',
+            name='view_name',
+            field=models.CharField(blank=True, default='', help_text='Resolved view name', max_length=255),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0008_request_log_response_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomalyBackfillRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(help_text='Start of the re-scored range')),
+                ('end', models.DateTimeField(help_text='End of the re-scored range (exclusive)')),
+                ('window_minutes', models.PositiveIntegerField(default=60)),
+                ('volume_threshold', models.PositiveIntegerField(help_text='Requests per window flagged as high volume')),
+                ('sensitive_threshold', models.PositiveIntegerField(help_text='Sensitive path hits per window flagged')),
+                ('model_version', models.PositiveIntegerField(blank=True, help_text='Anomaly model used, if any', null=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=10)),
+                ('windows_total', models.PositiveIntegerField(default=0)),
+                ('windows_done', models.PositiveIntegerField(default=0)),
+                ('flagged_count', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Anomaly Backfill Run',
+                'verbose_name_plural': 'Anomaly Backfill Runs',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnomalyBackfillScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField()),
+                ('ip_address', models.GenericIPAddressField()),
+                ('request_count', models.PositiveIntegerField(default=0)),
+                ('sensitive_path_count', models.PositiveIntegerField(default=0)),
+                ('anomaly_score', models.FloatField(blank=True, help_text='Lowest model decision score in the window (negative = outlier)', null=True)),
+                ('flagged_by', models.CharField(blank=True, help_text='Comma-separated rules that flagged the IP: volume, sensitive, model', max_length=50)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scores', to='security.anomalybackfillrun')),
+            ],
+            options={
+                'verbose_name': 'Anomaly Backfill Score',
+                'verbose_name_plural': 'Anomaly Backfill Scores',
+                'ordering': ['window_start', 'ip_address'],
+                'indexes': [models.Index(fields=['run', 'window_start'], name='security_an_run_id_385dc4_idx'), models.Index(fields=['run', 'ip_address'], name='security_an_run_id_03e076_idx')],
+            },
+        ),
+    ]
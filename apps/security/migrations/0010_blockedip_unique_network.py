@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0009_anomaly_backfill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blockedip',
+            name='ip_address',
+            field=models.GenericIPAddressField(help_text='IP address (or network address of a range) to block'),
+        ),
+        migrations.AddConstraint(
+            model_name='blockedip',
+            constraint=models.UniqueConstraint(condition=models.Q(('prefix_length__isnull', True)), fields=('ip_address',), name='blockedip_unique_host'),
+        ),
+        migrations.AddConstraint(
+            model_name='blockedip',
+            constraint=models.UniqueConstraint(fields=('ip_address', 'prefix_length'), name='blockedip_unique_network'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0010_blockedip_unique_network'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='logged_at',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+    ]
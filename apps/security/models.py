@@ -4,19 +4,77 @@ IP Tracking Models
 This module contains models for logging IP addresses, blocking IPs,
 and tracking suspicious IPs.
 """
+import ipaddress
+
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+
+class RequestRoute(models.Model):
+    """
+    Interned URL route pattern (e.g. ``properties/<int:pk>/``).
+    RequestLog rows reference routes by id instead of repeating raw paths.
+    """
+    route = models.CharField(max_length=255, unique=True, help_text="URL route pattern")
+    is_sensitive = models.BooleanField(
+        default=False,
+        help_text="Route matches one of IP_TRACKING_SENSITIVE_PATHS"
+    )
+    view_name = models.CharField(max_length=255, blank=True, default='', help_text="Resolved view name")
+    first_seen = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['route']
+        verbose_name = 'Request Route'
+        verbose_name_plural = 'Request Routes'
+
+    def __str__(self):
+        return self.route
 
 
 class RequestLog(models.Model):
     """
     Model to log IP addresses, timestamps, and request paths.
     Extended with geolocation data (country, city) in Task 2.
+
+    ``route`` is the interned URL pattern the request resolved to. The raw
+    ``path`` is only stored for unresolved requests or when
+    IP_TRACKING_STORE_RAW_PATH is enabled. With IP_TRACKING_SAMPLING only a
+    sample of requests is stored; ``sample_weight`` is how many requests a
+    row stands for.
+
+    The response columns (status, duration, DB query count and time,
+    response size) are null for rows written before they were captured;
+    DB metrics are also null for requests served on the async path.
     """
     ip_address = models.GenericIPAddressField(help_text="Client IP address")
-    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
-    path = models.CharField(max_length=500, help_text="Request path")
+    # Set at request time (not INSERT time) so buffered bulk writes keep
+    # the original request timestamp.
+    timestamp = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+    # INSERT time, used by the id watermarks (see watermarks.py); null for
+    # rows written before it was recorded
+    logged_at = models.DateTimeField(auto_now_add=True, null=True)
+    route = models.ForeignKey(
+        RequestRoute,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='+',
+        help_text="Resolved URL route pattern"
+    )
+    path = models.CharField(max_length=500, blank=True, default='', help_text="Raw request path (optional)")
     method = models.CharField(max_length=10, default='GET', help_text="HTTP method")
+    sample_weight = models.PositiveIntegerField(
+        default=1,
+        help_text="Number of requests this row represents under the sampling policy"
+    )
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, help_text="HTTP response status")
+    duration_us = models.PositiveIntegerField(null=True, blank=True, help_text="Response time in microseconds")
+    db_queries = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Database queries run")
+    db_time_us = models.PositiveIntegerField(null=True, blank=True, help_text="Database time in microseconds")
+    response_bytes = models.PositiveIntegerField(null=True, blank=True, help_text="Response body size in bytes")
     country = models.CharField(
         max_length=100,
         blank=True,
@@ -41,24 +99,28 @@ class RequestLog(models.Model):
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['ip_address', 'timestamp']),
+            models.Index(fields=['route', 'timestamp']),
             models.Index(fields=['timestamp']),
-            models.Index(fields=['path']),
         ]
         verbose_name = 'Request Log'
         verbose_name_plural = 'Request Logs'
 
     def __str__(self):
-        return f"{self.ip_address} - {self.path} - {self.timestamp}"
+        return f"{self.ip_address} - {self.path or self.route} - {self.timestamp}"
 
 
 class BlockedIP(models.Model):
     """
-    Model to store blocked IP addresses.
+    Model to store blocked IP addresses and CIDR ranges.
     Used in Task 1 for IP blacklisting.
     """
     ip_address = models.GenericIPAddressField(
-        unique=True,
-        help_text="IP address to block"
+        help_text="IP address (or network address of a range) to block"
+    )
+    prefix_length = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="CIDR prefix length to block a whole range (empty for a single IP)"
     )
     reason = models.CharField(
         max_length=255,
@@ -80,11 +142,48 @@ class BlockedIP(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+        constraints = [
+            # A host and the ranges starting at its address are distinct
+            # entries; prefix_length is NULL for hosts, and NULLs never
+            # conflict in a plain unique constraint, so hosts get their own
+            models.UniqueConstraint(
+                fields=['ip_address'],
+                condition=models.Q(prefix_length__isnull=True),
+                name='blockedip_unique_host',
+            ),
+            models.UniqueConstraint(fields=['ip_address', 'prefix_length'], name='blockedip_unique_network'),
+        ]
         verbose_name = 'Blocked IP'
         verbose_name_plural = 'Blocked IPs'
 
     def __str__(self):
-        return f"{self.ip_address} (blocked: {self.created_at})"
+        return f"{self.cidr} (blocked: {self.created_at})"
+
+    @property
+    def cidr(self):
+        """Blocked address in CIDR notation (plain IP for single addresses)."""
+        if self.prefix_length is None:
+            return self.ip_address
+        return f"{self.ip_address}/{self.prefix_length}"
+
+    @property
+    def network(self):
+        """Blocked range as an ipaddress network object."""
+        return ipaddress.ip_network(self.cidr, strict=False)
+
+    def clean(self):
+        from .blocklist import parse_entry
+
+        super().clean()
+        try:
+            # Ranges are stored by their network address so lookups can mask
+            # directly, and full-length prefixes as single addresses
+            self.ip_address, self.prefix_length = parse_entry(self.cidr)
+        except ValueError as e:
+            raise ValidationError({'prefix_length': str(e)})
 
 
 class SuspiciousIP(models.Model):
@@ -121,3 +220,154 @@ class SuspiciousIP(models.Model):
 
     def __str__(self):
         return f"{self.ip_address} - {self.reason[:50]}"
+
+
+class HourlyIPTraffic(models.Model):
+    """
+    Hourly request counts per IP address.
+    Maintained incrementally from RequestLog by the rollup task.
+    """
+    hour = models.DateTimeField(help_text="Start of the hour (UTC)")
+    ip_address = models.GenericIPAddressField(help_text="Client IP address")
+    request_count = models.PositiveIntegerField(default=0)
+    sensitive_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Requests to sensitive paths"
+    )
+
+    class Meta:
+        ordering = ['-hour', '-request_count']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'ip_address'], name='uniq_hourly_ip_traffic'),
+        ]
+        indexes = [
+            models.Index(fields=['ip_address', 'hour']),
+        ]
+        verbose_name = 'Hourly IP Traffic'
+        verbose_name_plural = 'Hourly IP Traffic'
+
+    def __str__(self):
+        return f"{self.ip_address} @ {self.hour:%Y-%m-%d %H:00}: {self.request_count}"
+
+
+class HourlyPathTraffic(models.Model):
+    """
+    Hourly request counts per request path.
+    Maintained incrementally from RequestLog by the rollup task.
+    """
+    hour = models.DateTimeField(help_text="Start of the hour (UTC)")
+    path = models.CharField(max_length=500, help_text="Request path")
+    request_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-hour', '-request_count']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'path'], name='uniq_hourly_path_traffic'),
+        ]
+        verbose_name = 'Hourly Path Traffic'
+        verbose_name_plural = 'Hourly Path Traffic'
+
+    def __str__(self):
+        return f"{self.path} @ {self.hour:%Y-%m-%d %H:00}: {self.request_count}"
+
+
+class HourlyCountryTraffic(models.Model):
+    """
+    Hourly request counts per country (empty string for unknown).
+    Maintained incrementally from RequestLog by the rollup task.
+    """
+    hour = models.DateTimeField(help_text="Start of the hour (UTC)")
+    country = models.CharField(max_length=100, blank=True, help_text="Country from geolocation")
+    request_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-hour', '-request_count']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'country'], name='uniq_hourly_country_traffic'),
+        ]
+        verbose_name = 'Hourly Country Traffic'
+        verbose_name_plural = 'Hourly Country Traffic'
+
+    def __str__(self):
+        return f"{self.country or 'Unknown'} @ {self.hour:%Y-%m-%d %H:00}: {self.request_count}"
+
+
+class RollupWatermark(models.Model):
+    """
+    Highest RequestLog id already processed by an incremental job (the
+    hourly rollups, deferred GeoIP enrichment).
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Rollup Watermark'
+        verbose_name_plural = 'Rollup Watermarks'
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
+class AnomalyBackfillRun(models.Model):
+    """
+    One historical re-scoring of RequestLog (see backfill.py), with the
+    thresholds and model version it used.
+    """
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    start = models.DateTimeField(help_text="Start of the re-scored range")
+    end = models.DateTimeField(help_text="End of the re-scored range (exclusive)")
+    window_minutes = models.PositiveIntegerField(default=60)
+    volume_threshold = models.PositiveIntegerField(help_text="Requests per window flagged as high volume")
+    sensitive_threshold = models.PositiveIntegerField(help_text="Sensitive path hits per window flagged")
+    model_version = models.PositiveIntegerField(null=True, blank=True, help_text="Anomaly model used, if any")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='running')
+    windows_total = models.PositiveIntegerField(default=0)
+    windows_done = models.PositiveIntegerField(default=0)
+    flagged_count = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+        verbose_name = 'Anomaly Backfill Run'
+        verbose_name_plural = 'Anomaly Backfill Runs'
+
+    def __str__(self):
+        return f"Run {self.pk}: {self.start:%Y-%m-%d %H:%M} - {self.end:%Y-%m-%d %H:%M} ({self.status})"
+
+
+class AnomalyBackfillScore(models.Model):
+    """Per-IP, per-window result of an AnomalyBackfillRun."""
+    run = models.ForeignKey(AnomalyBackfillRun, on_delete=models.CASCADE, related_name='scores')
+    window_start = models.DateTimeField()
+    ip_address = models.GenericIPAddressField()
+    request_count = models.PositiveIntegerField(default=0)
+    sensitive_path_count = models.PositiveIntegerField(default=0)
+    anomaly_score = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Lowest model decision score in the window (negative = outlier)"
+    )
+    flagged_by = models.CharField(
+        max_length=50,
+        blank=True,
+        help_text="Comma-separated rules that flagged the IP: volume, sensitive, model"
+    )
+
+    class Meta:
+        ordering = ['window_start', 'ip_address']
+        indexes = [
+            models.Index(fields=['run', 'window_start']),
+            models.Index(fields=['run', 'ip_address']),
+        ]
+        verbose_name = 'Anomaly Backfill Score'
+        verbose_name_plural = 'Anomaly Backfill Scores'
+
+    def __str__(self):
+        return f"{self.ip_address} @ {self.window_start:%Y-%m-%d %H:%M} (run {self.run_id}): {self.flagged_by or 'clean'}"
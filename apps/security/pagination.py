@@ -0,0 +1,145 @@
+"""
+Pagination classes for the security app.
+
+KeysetPagination pages through a queryset ordered by ``(<time field>, id)``
+descending using an opaque cursor holding the last row's position, so every
+page is an index range scan no matter how deep it is. Totals come from
+``estimated_count`` (planner statistics on PostgreSQL) instead of a
+``COUNT(*)`` over the whole table.
+"""
+import base64
+import binascii
+import json
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Below this estimate an exact COUNT(*) is cheap enough to run
+EXACT_COUNT_THRESHOLD = 1000
+
+
+def estimated_count(queryset):
+    """
+    Return ``(count, is_estimate)`` for ``queryset``.
+
+    On PostgreSQL the row estimate of the query plan is used, which reflects
+    the filters and costs no scan; small results are then counted exactly.
+    Other backends have no usable statistics and always count exactly.
+    """
+    queryset = queryset.order_by()
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= EXACT_COUNT_THRESHOLD:
+            return estimate, True
+    return queryset.count(), False
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on ``(ordering_field, id)``, newest first.
+
+    The cursor encodes the direction and the boundary row's position; rows
+    that share a timestamp are disambiguated by id, so no row is skipped or
+    repeated when new rows arrive between requests.
+    """
+    ordering_field = 'timestamp'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+
+    def __init__(self, ordering_field=None):
+        if ordering_field:
+            self.ordering_field = ordering_field
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count, self.count_is_estimate = estimated_count(queryset)
+
+        direction, position = self.decode_cursor(request)
+        field = self.ordering_field
+        if direction == 'previous':
+            rows = queryset.filter(
+                Q(**{f'{field}__gt': position[0]}) | Q(**{field: position[0], 'id__gt': position[1]})
+            ).order_by(field, 'id')
+        else:
+            rows = queryset.order_by(f'-{field}', '-id')
+            if position is not None:
+                rows = rows.filter(
+                    Q(**{f'{field}__lt': position[0]}) | Q(**{field: position[0], 'id__lt': position[1]})
+                )
+
+        # One extra row tells whether there is a further page
+        page = list(rows[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if direction == 'previous':
+            page.reverse()
+            self.has_next, self.has_previous = bool(page), has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = page
+        return page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        """Return ``(direction, (value, id))``; the position is None on the first page."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 'next', None
+        try:
+            direction, value, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            value = parse_datetime(value)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound('Invalid cursor')
+        if direction not in ('next', 'previous') or value is None:
+            raise NotFound('Invalid cursor')
+        return direction, (value, pk)
+
+    def encode_cursor(self, direction, row):
+        raw = f'{direction}|{getattr(row, self.ordering_field).isoformat()}|{row.pk}'
+        encoded = base64.urlsafe_b64encode(raw.encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor('next', self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor('previous', self.page[0])
+
+    def get_paginated_response(self, data):
+        """Return a paginated style Response object."""
+        return Response({
+            'count': self.count,
+            'count_is_estimate': self.count_is_estimate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
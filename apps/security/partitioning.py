@@ -0,0 +1,323 @@
+"""
+Time-partitioned RequestLog storage and retention.
+
+On PostgreSQL, ``security_requestlog`` can be converted (once, via the
+``partition_request_logs --convert`` management command) into a table
+partitioned by RANGE on ``timestamp`` with one partition per day or month
+(IP_TRACKING_PARTITION_INTERVAL at conversion time; the choice is recorded
+in the table's comment, so later settings changes cannot mix granularities).
+Retention then detaches and drops whole partitions, which is instant and
+leaves no dead tuples behind.
+
+A DEFAULT partition catches rows outside every range (clock skew, late
+backfills, a missed ``ensure_partitions`` run). Creating a range partition
+moves the rows it covers out of the default first, as PostgreSQL refuses
+to attach a range that overlaps rows already in the default partition.
+
+On other backends (or an unconverted PostgreSQL table) retention falls back
+to deleting by primary-key ranges in batches of
+IP_TRACKING_CLEANUP_BATCH_SIZE rows, sleeping IP_TRACKING_CLEANUP_SLEEP
+seconds between batches so the cleanup never holds long locks or floods
+replication.
+"""
+import logging
+import re
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+logger = logging.getLogger(__name__)
+
+_SUFFIX_FORMATS = {'day': '%Y%m%d', 'month': '%Y%m'}
+_INTERVAL_COMMENT = re.compile(r'partition_interval=(day|month)')
+
+
+def default_interval():
+    return getattr(settings, 'IP_TRACKING_PARTITION_INTERVAL', 'day')
+
+
+def partitions_ahead():
+    return getattr(settings, 'IP_TRACKING_PARTITIONS_AHEAD', 7)
+
+
+def cleanup_batch_size():
+    return getattr(settings, 'IP_TRACKING_CLEANUP_BATCH_SIZE', 5000)
+
+
+def cleanup_sleep():
+    return getattr(settings, 'IP_TRACKING_CLEANUP_SLEEP', 0.1)
+
+
+def _table():
+    from .models import RequestLog
+    return RequestLog._meta.db_table
+
+
+def _floor(moment, interval=None):
+    interval = interval or default_interval()
+    moment = moment.astimezone(dt_timezone.utc)
+    if interval == 'month':
+        return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+    return datetime(moment.year, moment.month, moment.day, tzinfo=dt_timezone.utc)
+
+
+def _next(start, interval=None):
+    interval = interval or default_interval()
+    if interval == 'month':
+        return datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+    return start + timedelta(days=1)
+
+
+def partition_name(start, interval=None):
+    return f"{_table()}_p{start.strftime(_SUFFIX_FORMATS[interval or default_interval()])}"
+
+
+def is_partitioned():
+    """Return True if RequestLog is stored in a partitioned PostgreSQL table."""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relkind = 'p' FROM pg_class c WHERE c.oid = to_regclass(%s)",
+            [_table()],
+        )
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def partition_interval():
+    """The interval the table was partitioned with (falls back to the setting)."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT obj_description(to_regclass(%s), 'pg_class')", [_table()])
+        row = cursor.fetchone()
+    match = _INTERVAL_COMMENT.search(row[0] or '') if row else None
+    return match.group(1) if match else default_interval()
+
+
+def list_partitions():
+    """Return ``[(name, start)]`` for the range partitions, oldest first."""
+    table = _table()
+    pattern = re.compile(rf'^{re.escape(table)}_p(\d{{6}}|\d{{8}})$')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.oid = to_regclass(%s)
+            """,
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = pattern.match(name)
+        if not match:
+            continue
+        suffix = match.group(1)
+        fmt = '%Y%m%d' if len(suffix) == 8 else '%Y%m'
+        start = datetime.strptime(suffix, fmt).replace(tzinfo=dt_timezone.utc)
+        partitions.append((name, start))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _create_partition(cursor, start, interval=None):
+    table = _table()
+    name = partition_name(start, interval)
+    default = f'{table}_default'
+    end = _next(start, interval)
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [default])
+    has_default = cursor.fetchone()[0]
+    if has_default:
+        # Rows for this range may already sit in the default partition; move
+        # them into the new partition while the default is detached
+        cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"')
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+        f'FOR VALUES FROM (%s) TO (%s)',
+        [start, end],
+    )
+    if has_default:
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM "{default}" WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+            f'INSERT INTO "{name}" SELECT * FROM moved',
+            [start, end],
+        )
+        if cursor.rowcount:
+            logger.info(f"Moved {cursor.rowcount} row(s) from {default} into {name}")
+        cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT')
+
+
+def ensure_partitions(ahead=None, now=None):
+    """Create partitions from the current interval up to ``ahead`` intervals ahead."""
+    if not is_partitioned():
+        return 0
+    ahead = partitions_ahead() if ahead is None else ahead
+    interval = partition_interval()
+    start = _floor(now or datetime.now(dt_timezone.utc), interval)
+    existing = {name for name, _ in list_partitions()}
+    created = 0
+    for _ in range(ahead + 1):
+        if partition_name(start, interval) not in existing:
+            with transaction.atomic(), connection.cursor() as cursor:
+                _create_partition(cursor, start, interval)
+            created += 1
+        start = _next(start, interval)
+    if created:
+        logger.info(f"Created {created} RequestLog partition(s)")
+    return created
+
+
+def drop_partitions_before(cutoff):
+    """
+    Detach and drop every partition whose whole range is older than ``cutoff``.
+
+    Returns the number of partitions dropped.
+    """
+    table = _table()
+    dropped = 0
+    for name, start in list_partitions():
+        interval = 'day' if len(name.rsplit('_p', 1)[1]) == 8 else 'month'
+        if _next(start, interval) > cutoff:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+        dropped += 1
+        logger.info(f"Dropped RequestLog partition {name}")
+    return dropped
+
+
+def chunked_delete(cutoff, batch_size=None, sleep=None):
+    """
+    Delete RequestLog rows older than ``cutoff`` in primary-key ranges of
+    ``batch_size`` ids, sleeping ``sleep`` seconds between batches.
+
+    Returns the number of rows deleted.
+    """
+    from .models import RequestLog
+
+    batch_size = batch_size or cleanup_batch_size()
+    sleep = cleanup_sleep() if sleep is None else sleep
+
+    old = RequestLog.objects.filter(timestamp__lt=cutoff)
+    bounds = old.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+
+    deleted = 0
+    low = bounds['low']
+    while low <= bounds['high']:
+        high = low + batch_size
+        # Nothing references RequestLog, so the collector fast-deletes this
+        # as a single DELETE without loading the rows
+        deleted += RequestLog.objects.filter(id__gte=low, id__lt=high, timestamp__lt=cutoff).delete()[0]
+        low = high
+        if sleep and low <= bounds['high']:
+            time.sleep(sleep)
+    return deleted
+
+
+def apply_retention(cutoff):
+    """
+    Remove RequestLog rows older than ``cutoff`` using the cheapest method
+    the backend supports. Returns ``(partitions_dropped, rows_deleted)``.
+    """
+    partitions_dropped = 0
+    if is_partitioned():
+        partitions_dropped = drop_partitions_before(cutoff)
+    # Rows older than the cutoff in the partially expired partition (or the
+    # whole table on unpartitioned backends)
+    rows_deleted = chunked_delete(cutoff)
+    return partitions_dropped, rows_deleted
+
+
+def convert_to_partitioned(interval=None, ahead=None):
+    """
+    Convert the existing RequestLog table into a RANGE-partitioned table
+    (PostgreSQL only), preserving indexes, the user foreign key and data.
+
+    Runs in a single transaction and copies all existing rows, so it should
+    be scheduled during a maintenance window on large tables.
+    """
+    if connection.vendor != 'postgresql':
+        raise RuntimeError('Partitioned RequestLog storage requires PostgreSQL')
+    if is_partitioned():
+        return False
+
+    interval = interval or default_interval()
+    if interval not in _SUFFIX_FORMATS:
+        raise ValueError(f"Partition interval must be one of {', '.join(_SUFFIX_FORMATS)}")
+    ahead = partitions_ahead() if ahead is None else ahead
+    table = _table()
+    legacy = f'{table}_unpartitioned'
+    sequence = f'{table}_part_id_seq'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Capture index and FK definitions while they still reference the
+        # original table name, then rename them out of the way.
+        cursor.execute(
+            """
+            SELECT i.relname, pg_get_indexdef(i.oid)
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary
+            """,
+            [table],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = to_regclass(%s) AND contype = 'f'
+            """,
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+
+        for name, _ in indexes:
+            cursor.execute(f'ALTER INDEX "{name}" RENAME TO "{name}_old"')
+        for name, _ in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{table}" RENAME CONSTRAINT "{name}" TO "{name}_old"')
+        cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+
+        cursor.execute(
+            f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS INCLUDING STORAGE) '
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f'CREATE SEQUENCE "{sequence}" OWNED BY "{table}"."id"')
+        cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN "id" SET DEFAULT nextval(\'"{sequence}"\')')
+        # The partition key must be part of the primary key
+        cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY ("id", "timestamp")')
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+
+        cursor.execute(f'SELECT MIN("timestamp"), MAX("id") FROM "{legacy}"')
+        oldest, max_id = cursor.fetchone()
+
+        start = _floor(oldest or datetime.now(dt_timezone.utc), interval)
+        end = _floor(datetime.now(dt_timezone.utc), interval)
+        for _ in range(ahead):
+            end = _next(end, interval)
+        while start <= end:
+            _create_partition(cursor, start, interval)
+            start = _next(start, interval)
+        cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+        # ensure_partitions keeps using this interval whatever the settings say
+        cursor.execute(f'COMMENT ON TABLE "{table}" IS \'partition_interval={interval}\'')
+
+        cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{legacy}"')
+        if max_id is not None:
+            cursor.execute('SELECT setval(%s, %s)', [sequence, max_id])
+        cursor.execute(f'DROP TABLE "{legacy}"')
+
+    logger.info(f"Converted {table} to {interval}-partitioned storage")
+    return True
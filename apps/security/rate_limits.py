@@ -0,0 +1,336 @@
+"""
+Token-bucket rate limiting with declarative route policies.
+
+RATE_LIMIT_POLICIES is an ordered list of policies; the first one matching
+a request's URL route (see routes.py) and method applies:
+
+    {
+        'name': 'bookings',
+        'routes': ['api/travel/bookings/create/'],   # exact route patterns
+        'prefixes': ['api/', 'properties/api/'],    # ...or route prefixes
+        'methods': ['POST'],                        # optional
+        'rate': {'anonymous': '5/m', 'authenticated': '30/m', 'staff': None},
+        'burst': 10,                                # bucket capacity
+        'key': 'user_or_ip',                        # 'ip', 'user' or 'user_or_ip'
+    }
+
+``rate`` is either one rate for everyone or a per-role mapping; a role
+mapped to None is not limited. Routes are matched as resolved, so an app
+included under several prefixes needs each of them listed, and router
+routes are matched in their resolved regex form
+(``properties/api/properties/$``).
+
+Each decision is one EVALSHA of a Lua token bucket in Redis (refill, take,
+expire in a single atomic call). Refill uses the Redis server's clock, so
+skewed clocks on web nodes cannot mint or withhold tokens. When Redis is
+unavailable decisions fall back to in-process buckets, which limit per
+worker rather than globally.
+"""
+import logging
+import math
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'security:rl'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+ROLES = ('anonymous', 'authenticated', 'staff')
+MAX_LOCAL_BUCKETS = 100_000
+# Seconds a JWT user's staff flag is cached (see identify)
+STAFF_CACHE_TIMEOUT = 60
+
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = burst
+    ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, math.floor(tokens), tostring(retry_after), tostring((burst - tokens) / rate)}
+"""
+
+Decision = namedtuple('Decision', ['allowed', 'limit', 'remaining', 'reset', 'retry_after', 'policy', 'window'])
+
+
+def parse_rate(rate):
+    """Parse ``'10/m'`` into ``(10, 60)``; None stays None (unlimited)."""
+    if rate is None:
+        return None
+    count, _, period = rate.partition('/')
+    period = period or 's'
+    multiplier = int(period[:-1]) if len(period) > 1 else 1
+    return int(count), multiplier * PERIODS[period[-1]]
+
+
+class Policy:
+    """One compiled entry of RATE_LIMIT_POLICIES."""
+
+    def __init__(self, config):
+        self.name = config['name']
+        self.routes = frozenset(route.lstrip('/') for route in config.get('routes', ()))
+        prefixes = config.get('prefixes') or ([config['prefix']] if config.get('prefix') else [])
+        self.prefixes = tuple(prefix.lstrip('/') for prefix in prefixes)
+        self.methods = frozenset(m.upper() for m in config['methods']) if config.get('methods') else None
+        self.key = config.get('key', 'user_or_ip')
+        rate = config['rate']
+        rates = rate if isinstance(rate, dict) else dict.fromkeys(ROLES, rate)
+        # role -> (limit, window seconds, tokens per second, burst)
+        self.limits = {}
+        for role in ROLES:
+            parsed = parse_rate(rates.get(role, rates.get('authenticated') if role == 'staff' else None))
+            if parsed is None:
+                self.limits[role] = None
+                continue
+            count, window = parsed
+            self.limits[role] = (count, window, count / window, config.get('burst', count))
+
+    def matches_route(self, route):
+        if route in self.routes:
+            return True
+        return bool(self.prefixes) and (route or '').startswith(self.prefixes)
+
+    def header(self, role):
+        limit = self.limits[role]
+        return f'{limit[0]};w={limit[1]};burst={limit[3]}'
+
+
+class LocalBuckets:
+    """In-process token buckets used when Redis is unavailable."""
+
+    def __init__(self, max_size=MAX_LOCAL_BUCKETS):
+        self.max_size = max_size
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now, cost=1):
+        with self._lock:
+            tokens, ts, _, _ = self._buckets.get(key, (burst, now, rate, burst))
+            tokens = min(burst, tokens + max(0.0, now - ts) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                allowed, retry_after = 1, 0.0
+            else:
+                allowed, retry_after = 0, (cost - tokens) / rate
+            if len(self._buckets) >= self.max_size and key not in self._buckets:
+                # Full buckets carry no state worth keeping; each refills at
+                # the rate of the policy that created it
+                self._buckets = {
+                    k: v for k, v in self._buckets.items() if v[0] + (now - v[1]) * v[2] < v[3]
+                }
+            # Stored with the bucket's own rate and burst for eviction
+            self._buckets[key] = (tokens, now, rate, burst)
+        return allowed, math.floor(tokens), retry_after, (burst - tokens) / rate
+
+
+class RateLimiter:
+    """Matches requests to policies and takes tokens from their buckets."""
+
+    def __init__(self, policies=None):
+        self.policies = [Policy(config) for config in (policies or [])]
+        self._route_policies = {}
+        self._local = LocalBuckets()
+        self._script = None
+        # Scripts bound to each event loop's client (see counters._get_async_client)
+        self._async_scripts = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def policy_for(self, route, method):
+        """Return the first policy matching ``route`` and ``method``, or None."""
+        candidates = self._route_policies.get(route)
+        if candidates is None:
+            candidates = [policy for policy in self.policies if policy.matches_route(route)]
+            if len(self._route_policies) < 10_000:
+                self._route_policies[route] = candidates
+        for policy in candidates:
+            if policy.methods is None or method in policy.methods:
+                return policy
+        return None
+
+    def _bucket(self, policy, role, identity):
+        limit = policy.limits[role]
+        if limit is None:
+            return None, None
+        return f'{KEY_PREFIX}:{policy.name}:{identity}', limit
+
+    def _decision(self, policy, limit, result):
+        allowed, remaining, retry_after, reset = result
+        return Decision(
+            allowed=bool(int(allowed)),
+            limit=limit[0],
+            remaining=int(remaining),
+            reset=math.ceil(float(reset)),
+            retry_after=math.ceil(float(retry_after)),
+            policy=policy,
+            window=limit[1],
+        )
+
+    def check(self, policy, role, identity):
+        """Take one token for ``identity``; returns a Decision, or None if unlimited."""
+        key, limit = self._bucket(policy, role, identity)
+        if key is None:
+            return None
+        _, _, rate, burst = limit
+
+        from .log_stream import get_stream_connection
+        conn = get_stream_connection()
+        if conn is not None:
+            try:
+                if self._script is None:
+                    with self._lock:
+                        if self._script is None:
+                            self._script = conn.register_script(TOKEN_BUCKET_SCRIPT)
+                return self._decision(policy, limit, self._script(keys=[key], args=[rate, burst, 1], client=conn))
+            except Exception as e:
+                logger.debug(f"Redis rate limiting unavailable, using in-process buckets: {e}")
+        return self._decision(policy, limit, self._local.take(key, rate, burst, time.time()))
+
+    async def acheck(self, policy, role, identity):
+        """Async counterpart of check() using redis.asyncio."""
+        import asyncio
+        from .counters import _get_async_client
+
+        key, limit = self._bucket(policy, role, identity)
+        if key is None:
+            return None
+        _, _, rate, burst = limit
+
+        try:
+            client, _ = _get_async_client()
+            if client is not None:
+                loop = asyncio.get_running_loop()
+                script = self._async_scripts.get(loop)
+                if script is None:
+                    script = self._async_scripts[loop] = client.register_script(TOKEN_BUCKET_SCRIPT)
+                return self._decision(policy, limit, await script(keys=[key], args=[rate, burst, 1]))
+        except Exception as e:
+            logger.debug(f"Redis rate limiting unavailable, using in-process buckets: {e}")
+        return self._decision(policy, limit, self._local.take(key, rate, burst, time.time()))
+
+
+def identify(request, policy, ip, user=None):
+    """
+    Return ``(role, identity)`` for bucketing ``request`` under ``policy``.
+
+    ``user`` is the session-authenticated user, if any. API clients using
+    JWT are recognised from the bearer token's signature and user id claim;
+    their staff flag is read from the shared cache, or from the database
+    once every STAFF_CACHE_TIMEOUT seconds. Anonymous clients are always
+    keyed by IP.
+    """
+    if user is not None:
+        role = 'staff' if user.is_staff else 'authenticated'
+        user_key = f'u:{user.pk}'
+    else:
+        user_id = _jwt_user_id(request)
+        role = _jwt_role(user_id)
+        user_key = f'u:{user_id}' if user_id is not None else None
+    return _identity(policy, ip, role, user_key)
+
+
+async def aidentify(request, policy, ip, user=None):
+    """Async counterpart of identify()."""
+    if user is not None:
+        role = 'staff' if user.is_staff else 'authenticated'
+        user_key = f'u:{user.pk}'
+    else:
+        user_id = _jwt_user_id(request)
+        role = await _ajwt_role(user_id)
+        user_key = f'u:{user_id}' if user_id is not None else None
+    return _identity(policy, ip, role, user_key)
+
+
+def _identity(policy, ip, role, user_key):
+    if policy.key == 'ip' or user_key is None:
+        return role, f'ip:{ip}'
+    return role, user_key
+
+
+def _jwt_user_id(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        from rest_framework_simplejwt.settings import api_settings
+        from rest_framework_simplejwt.tokens import AccessToken
+        token = AccessToken(header[7:].strip())
+        return token[api_settings.USER_ID_CLAIM]
+    except Exception:
+        return None
+
+
+def _staff_cache_key(user_id):
+    return f'{KEY_PREFIX}:staff:{user_id}'
+
+
+def _staff_users(user_id):
+    from django.contrib.auth import get_user_model
+    from rest_framework_simplejwt.settings import api_settings
+
+    return get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id, 'is_staff': True})
+
+
+def _jwt_role(user_id):
+    if user_id is None:
+        return 'anonymous'
+    try:
+        is_staff = cache.get(_staff_cache_key(user_id))
+        if is_staff is None:
+            is_staff = _staff_users(user_id).exists()
+            cache.set(_staff_cache_key(user_id), is_staff, STAFF_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.debug(f"Could not look up staff status of user {user_id}: {e}")
+        is_staff = False
+    return 'staff' if is_staff else 'authenticated'
+
+
+async def _ajwt_role(user_id):
+    if user_id is None:
+        return 'anonymous'
+    try:
+        is_staff = await cache.aget(_staff_cache_key(user_id))
+        if is_staff is None:
+            is_staff = await _staff_users(user_id).aexists()
+            await cache.aset(_staff_cache_key(user_id), is_staff, STAFF_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.debug(f"Could not look up staff status of user {user_id}: {e}")
+        is_staff = False
+    return 'staff' if is_staff else 'authenticated'
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide RateLimiter built from RATE_LIMIT_POLICIES."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(getattr(settings, 'RATE_LIMIT_POLICIES', []))
+    return _limiter
@@ -0,0 +1,143 @@
+"""
+Incrementally maintained hourly traffic rollups.
+
+``update_rollups`` folds RequestLog rows with ids above the stored
+watermark into HourlyIPTraffic, HourlyPathTraffic and HourlyCountryTraffic.
+Each batch aggregates one id range per dimension in the database, merges the
+deltas into the existing hourly rows and writes them back with a single
+bulk upsert per dimension, then advances the watermark in the same
+transaction. Batches stop short of rows that may still have uncommitted
+neighbours (see watermarks.py). With deferred GeoIP enrichment, rows are
+only rolled up once they have been enriched.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncHour
+
+from .counters import sensitive_paths
+from .enrichment import enriched_up_to, is_deferred
+from .routes import sensitive_route_ids
+from .watermarks import next_batch
+from .models import (
+    HourlyCountryTraffic,
+    HourlyIPTraffic,
+    HourlyPathTraffic,
+    RequestLog,
+    RollupWatermark,
+)
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'hourly_traffic'
+LOCK_KEY = 'security:rollups:lock'
+LOCK_TIMEOUT = 600
+BATCH_SIZE = 100_000
+
+MAX_BATCHES = 10
+
+# dimension -> (model, key field)
+DIMENSIONS = {
+    'ip': (HourlyIPTraffic, 'ip_address'),
+    'path': (HourlyPathTraffic, 'path'),
+    'country': (HourlyCountryTraffic, 'country'),
+}
+
+
+def _key_expression(dimension):
+    if dimension == 'country':
+        # Unknown countries are rolled up under ''
+        return Coalesce('country', Value(''))
+    if dimension == 'path':
+        # Interned route template, or the raw path for unresolved requests
+        return Coalesce('route__route', 'path')
+    return F(DIMENSIONS[dimension][1])
+
+
+def _merge(dimension, logs):
+    """Aggregate ``logs`` by (hour, key) and add the counts to the rollup rows."""
+    model, key_field = DIMENSIONS[dimension]
+
+    # Sampled rows stand for sample_weight requests each
+    annotations = {'request_count': Sum('sample_weight')}
+    if dimension == 'ip':
+        annotations['sensitive_count'] = Coalesce(Sum(
+            'sample_weight', filter=Q(path__in=sorted(sensitive_paths())) | Q(route_id__in=sensitive_route_ids())
+        ), 0)
+
+    deltas = (
+        logs
+        .annotate(rollup_hour=TruncHour('timestamp'), rollup_key=_key_expression(dimension))
+        .values('rollup_hour', 'rollup_key')
+        .annotate(**annotations)
+        .order_by()
+    )
+    deltas = {(row['rollup_hour'], row['rollup_key']): row for row in deltas}
+    if not deltas:
+        return 0
+
+    hours = {hour for hour, _ in deltas}
+    existing = {
+        (row.hour, getattr(row, key_field)): row
+        for row in model.objects.filter(
+            hour__in=hours,
+            **{f'{key_field}__in': {key for _, key in deltas}}
+        )
+    }
+
+    rows = []
+    update_fields = list(annotations)
+    for (hour, key), delta in deltas.items():
+        row = existing.get((hour, key)) or model(hour=hour, **{key_field: key})
+        for field in update_fields:
+            setattr(row, field, (getattr(row, field) or 0) + delta[field])
+        rows.append(row)
+
+    model.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['hour', key_field],
+        update_fields=update_fields,
+    )
+    return len(rows)
+
+
+def update_rollups(batch_size=None, max_batches=None):
+    """
+    Fold new RequestLog rows into the hourly rollups.
+
+    Processes up to ``max_batches`` id ranges of ``batch_size`` ids per call
+    and returns a summary dict. Concurrent runs are prevented with a cache
+    lock.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    max_batches = max_batches or MAX_BATCHES
+    if not cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+        logger.info("Rollup update already running, skipping")
+        return {'skipped': True}
+
+    try:
+        watermark, _ = RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+        totals = dict.fromkeys(DIMENSIONS, 0)
+        # With deferred GeoIP, only roll up rows whose country is final
+        limit = enriched_up_to() if is_deferred() else None
+        for _ in range(max_batches):
+            batch = next_batch(watermark.last_id, batch_size, limit)
+            if batch is None:
+                break
+            low, high = batch
+
+            logs = RequestLog.objects.filter(id__gte=low, id__lte=high)
+            with transaction.atomic():
+                for dimension in DIMENSIONS:
+                    totals[dimension] += _merge(dimension, logs)
+                watermark.last_id = high
+                watermark.save(update_fields=['last_id', 'updated_at'])
+
+        logger.info(f"Rolled up RequestLog ids up to {watermark.last_id}: {totals}")
+        return {'processed_up_to': watermark.last_id, 'rows': totals}
+    finally:
+        cache.delete(LOCK_KEY)
@@ -0,0 +1,104 @@
+"""
+URL route interning for request logs.
+
+Requests are resolved to their URL route pattern (``properties/<int:pk>/``
+rather than ``/properties/123/``) and each distinct pattern is stored once
+in RequestRoute. RequestLog rows carry the small route id; route ids are
+cached per process so interning costs no query after the first hit.
+"""
+import functools
+import logging
+import re
+import threading
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from .counters import sensitive_paths
+from .models import RequestRoute
+
+logger = logging.getLogger(__name__)
+
+_REGEX_CHARS = re.compile(r'[\^$]')
+
+_route_ids = {}
+_route_names = {}
+_lock = threading.Lock()
+_cached_resolve = None
+
+
+def route_cache_size():
+    return getattr(settings, 'IP_TRACKING_ROUTE_CACHE_SIZE', 10000)
+
+
+def _resolve(path_info):
+    try:
+        match = resolve(path_info)
+    except Resolver404:
+        return None
+    # The root pattern is the empty route
+    return (match.route or '/')[:255]
+
+
+def _get_cached_resolve():
+    """Build the LRU-cached resolver on first use, sized from settings."""
+    global _cached_resolve
+    if _cached_resolve is None:
+        with _lock:
+            if _cached_resolve is None:
+                _cached_resolve = functools.lru_cache(maxsize=route_cache_size())(_resolve)
+    return _cached_resolve
+
+
+def resolve_route(path_info):
+    """Return the route pattern ``path_info`` resolves to, or None."""
+    return _get_cached_resolve()(path_info)
+
+
+def route_for(request):
+    """
+    Return ``(route, view_name)`` for a request that went through URL
+    resolution, falling back to resolving its path (e.g. for requests
+    answered before the view, such as blocked IPs).
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return resolve_route(request.path_info), ''
+    return (match.route or '/')[:255], (match.view_name or match._func_path)[:255]
+
+
+def is_sensitive_route(route):
+    """A route is sensitive if its literal form is one of the sensitive paths."""
+    normalized = '/' + _REGEX_CHARS.sub('', route).strip('/')
+    return normalized in sensitive_paths()
+
+
+def cached_route_id(route):
+    """Return the interned id for ``route`` if this process already knows it."""
+    return _route_ids.get(route)
+
+
+def intern_route(route, view_name=''):
+    """Return the RequestRoute id for ``route``, creating the row on first use."""
+    route_id = _route_ids.get(route)
+    if route_id is None:
+        obj, _ = RequestRoute.objects.get_or_create(
+            route=route,
+            defaults={'is_sensitive': is_sensitive_route(route), 'view_name': view_name},
+        )
+        if view_name and not obj.view_name:
+            RequestRoute.objects.filter(pk=obj.pk).update(view_name=view_name)
+        with _lock:
+            _route_ids[route] = route_id = obj.pk
+            _route_names[route_id] = route
+    return route_id
+
+
+def cached_route_name(route_id):
+    """Return the route pattern for an id this process interned, or None."""
+    return _route_names.get(route_id)
+
+
+def sensitive_route_ids():
+    """Ids of all routes flagged as sensitive."""
+    return list(RequestRoute.objects.filter(is_sensitive=True).values_list('id', flat=True))
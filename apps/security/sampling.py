@@ -0,0 +1,138 @@
+"""
+Sampling policy for request logging.
+
+IP_TRACKING_SAMPLING decides which requests are written to RequestLog once
+the response is known. The real-time counters still see every request, so
+counts there stay exact; logged rows carry a ``sample_weight`` (the number
+of requests they stand for) so aggregates over RequestLog remain unbiased
+estimates of the full traffic.
+
+Rules, in order:
+
+1. Always log: blocked IPs, sensitive paths, authenticated writes and
+   error responses (each can be switched off under ``always_log``).
+2. Per-IP minimum: the first ``per_ip_minimum`` requests of every IP in
+   each ``per_ip_window`` seconds are logged, so low-volume clients are
+   always represented.
+3. Everything else is sampled at the rate configured for its route (or
+   ``default_rate``). Rates are rounded to 1-in-N so every kept row has an
+   integer weight of N.
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .counters import is_sensitive_path
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+DEFAULTS = {
+    'default_rate': 1.0,
+    'routes': {},
+    'always_log': {
+        'blocked': True,
+        'sensitive': True,
+        'authenticated_writes': True,
+        'errors': True,
+    },
+    'error_status': 400,
+    'per_ip_minimum': 0,
+    'per_ip_window': 60,
+    'max_tracked_ips': 100_000,
+}
+
+
+def _one_in(rate):
+    """Convert a sample rate to N for 1-in-N sampling (0 means never log)."""
+    if rate <= 0:
+        return 0
+    return max(1, round(1 / min(rate, 1.0)))
+
+
+class SamplingPolicy:
+    """
+    Decide whether (and with which weight) a finished request is logged.
+    """
+
+    def __init__(self, config=None):
+        config = {**DEFAULTS, **(config or {})}
+        self.always_log = {**DEFAULTS['always_log'], **config['always_log']}
+        self.error_status = config['error_status']
+        self.default_n = _one_in(config['default_rate'])
+        # Route templates as stored in RequestRoute, e.g. 'properties/'
+        self.route_n = {route.lstrip('/'): _one_in(rate) for route, rate in config['routes'].items()}
+        self.per_ip_minimum = config['per_ip_minimum']
+        self.per_ip_window = config['per_ip_window']
+        self.max_tracked_ips = config['max_tracked_ips']
+        self.enabled = self.default_n != 1 or any(n != 1 for n in self.route_n.values())
+
+        self._window = None
+        self._ip_counts = {}
+        self._lock = threading.Lock()
+
+    def weight(self, ip, route, path, method, status_code, authenticated=False, blocked=False):
+        """
+        Return the sample weight for a request: 0 if it should not be
+        logged, otherwise the number of requests the logged row represents.
+        """
+        if not self.enabled:
+            return 1
+
+        always = self.always_log
+        if (
+            (blocked and always['blocked'])
+            or (always['errors'] and status_code is not None and status_code >= self.error_status)
+            or (always['authenticated_writes'] and authenticated and method not in SAFE_METHODS)
+            or (always['sensitive'] and self._is_sensitive(route, path))
+        ):
+            return 1
+
+        if self.per_ip_minimum and self._within_ip_minimum(ip):
+            return 1
+
+        n = self.route_n.get(route, self.default_n) if route else self.default_n
+        if n <= 1:
+            return n
+        return n if random.random() * n < 1 else 0
+
+    def _is_sensitive(self, route, path):
+        if path and is_sensitive_path(path):
+            return True
+        if route:
+            from .routes import is_sensitive_route
+            return is_sensitive_route(route)
+        return False
+
+    def _within_ip_minimum(self, ip):
+        """Count ``ip`` in the current window; True while under the minimum."""
+        window = int(time.monotonic() // self.per_ip_window)
+        with self._lock:
+            if window != self._window:
+                self._window = window
+                self._ip_counts = {}
+            count = self._ip_counts.get(ip)
+            if count is None:
+                if len(self._ip_counts) >= self.max_tracked_ips:
+                    return False
+                count = 0
+            self._ip_counts[ip] = count + 1
+        return count < self.per_ip_minimum
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_sampling_policy():
+    """Return the process-wide sampling policy built from settings."""
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                _policy = SamplingPolicy(getattr(settings, 'IP_TRACKING_SAMPLING', None))
+    return _policy
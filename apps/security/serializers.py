@@ -7,10 +7,15 @@ from .models import RequestLog, BlockedIP, SuspiciousIP
 
 class RequestLogSerializer(serializers.ModelSerializer):
     """Serializer for RequestLog model."""
+    route = serializers.CharField(source='route.route', default=None, read_only=True)
+    view_name = serializers.CharField(source='route.view_name', default=None, read_only=True)
     
     class Meta:
         model = RequestLog
-        fields = ['id', 'ip_address', 'timestamp', 'path', 'method', 'country', 'city', 'user']
+        fields = [
+            'id', 'ip_address', 'timestamp', 'route', 'view_name', 'path', 'method', 'status_code', 'duration_us',
+            'db_queries', 'db_time_us', 'response_bytes', 'country', 'city', 'user',
+        ]
         read_only_fields = ['id', 'timestamp']
 
 
@@ -19,7 +24,7 @@ class BlockedIPSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = BlockedIP
-        fields = ['id', 'ip_address', 'reason', 'created_at', 'created_by']
+        fields = ['id', 'ip_address', 'prefix_length', 'reason', 'created_at', 'created_by']
         read_only_fields = ['id', 'created_at']
 
 
@@ -1,2 +1,15 @@
-# Signals for security app (if needed)
-# Placeholder for future signal handlers
+"""
+Signal handlers for the security app.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .blocklist import bump_version
+from .models import BlockedIP
+
+
+@receiver(post_save, sender=BlockedIP)
+@receiver(post_delete, sender=BlockedIP)
+def invalidate_blocklist(sender, **kwargs):
+    """Tell every worker to recompile its in-memory blocklist."""
+    bump_version()
@@ -0,0 +1,434 @@
+"""
+Pluggable destinations for request logs.
+
+The middleware hands every logged request to each sink configured in
+IP_TRACKING_LOG_SINKS (several may be active at once):
+
+    IP_TRACKING_LOG_SINKS = [
+        {'backend': 'database'},                       # buffered bulk_create
+        {'backend': 'stream'},                         # Redis stream (log_stream.py)
+        {'backend': 'file', 'directory': '/var/log/requestlogs', 'max_bytes': 64 * 2**20},
+    ]
+
+``backend`` is one of the names above or the dotted path of a
+RequestLogSink subclass; the remaining keys are passed to its constructor.
+
+The file sink appends gzip-compressed JSON lines from a background thread
+and rotates to a new file by size or age. Records use the same compact
+encoding as the Redis stream, so they carry every field anomaly detection
+reads, plus the route pattern itself (``rt``): files may be loaded into a
+database whose RequestRoute ids differ from the web node's, so the loader
+interns routes by pattern. Rotated files are shipped into RequestLog later
+with ``python manage.py load_request_log_files``.
+"""
+import atexit
+import glob
+import gzip
+import ipaddress
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import log_stream
+from .log_writer import get_log_writer
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = {
+    'database': 'apps.security.sinks.DatabaseSink',
+    'stream': 'apps.security.sinks.StreamSink',
+    'file': 'apps.security.sinks.FileSink',
+}
+
+OPEN_SUFFIX = '.jsonl.gz.open'
+CLOSED_SUFFIX = '.jsonl.gz'
+
+
+class RequestLogSink:
+    """Base class for request-log destinations."""
+    name = 'sink'
+
+    def write(self, **fields):
+        """Accept one request log; must not block on slow I/O."""
+        raise NotImplementedError
+
+    async def awrite(self, **fields):
+        """Async variant of write(); the default assumes write() does not block."""
+        self.write(**fields)
+
+    def flush(self):
+        """Persist anything buffered."""
+
+    def close(self):
+        """Flush and release resources at process exit."""
+        self.flush()
+
+    def stats(self):
+        return {}
+
+
+class DatabaseSink(RequestLogSink):
+    """Buffered bulk inserts into RequestLog through the shared RequestLogWriter."""
+    name = 'database'
+
+    def write(self, **fields):
+        get_log_writer().write(**fields)
+
+    async def awrite(self, **fields):
+        await get_log_writer().awrite(**fields)
+
+    def flush(self):
+        get_log_writer().flush()
+
+    def stats(self):
+        return get_log_writer().stats()
+
+
+class StreamSink(RequestLogSink):
+    """
+    Append to the Redis stream drained by ``drain_request_log_stream``.
+
+    With ``fallback`` (the default) records go to the database writer while
+    Redis is unavailable or the stream is full (``backpressure`` in stats()).
+    Without it they are dropped and counted as ``failed``.
+    """
+    name = 'stream'
+
+    def __init__(self, fallback=True):
+        self.fallback = fallback
+        self.published_count = 0
+        self.backpressure_count = 0
+        self.failed_count = 0
+
+    def write(self, **fields):
+        conn = log_stream.get_stream_connection()
+        if conn is not None:
+            try:
+                log_stream.publish(conn, **fields)
+                self.published_count += 1
+                return
+            except log_stream.StreamFull:
+                self.backpressure_count += 1
+            except Exception as e:
+                logger.warning(f"Request log stream unavailable: {e}")
+        self._fallback(fields)
+
+    async def awrite(self, **fields):
+        from asgiref.sync import sync_to_async
+
+        conn = log_stream.get_stream_connection()
+        if conn is not None:
+            try:
+                await sync_to_async(log_stream.publish, thread_sensitive=False)(conn, **fields)
+                self.published_count += 1
+                return
+            except log_stream.StreamFull:
+                self.backpressure_count += 1
+            except Exception as e:
+                logger.warning(f"Request log stream unavailable: {e}")
+        if self.fallback:
+            await get_log_writer().awrite(**fields)
+        else:
+            self.failed_count += 1
+
+    def _fallback(self, fields):
+        if self.fallback:
+            get_log_writer().write(**fields)
+        else:
+            self.failed_count += 1
+
+    def stats(self):
+        return {
+            'published': self.published_count,
+            'backpressure': self.backpressure_count,
+            'failed': self.failed_count,
+        }
+
+
+class FileSink(RequestLogSink):
+    """
+    Rotating, gzip-compressed, append-only JSON-lines files.
+
+    Requests only enqueue the encoded record; a background thread writes to
+    ``<directory>/requests-<host>-<pid>-<start>.jsonl.gz.open`` and renames
+    the file to ``.jsonl.gz`` once it exceeds ``max_bytes`` (uncompressed)
+    or ``max_age`` seconds. Only closed files are picked up by the loader.
+    When the queue is full records are dropped and counted.
+    """
+    name = 'file'
+
+    def __init__(self, directory=None, max_bytes=None, max_age=None, max_queue=None, flush_interval=1.0):
+        self.directory = str(directory or getattr(settings, 'IP_TRACKING_LOG_FILE_DIR', 'request_logs'))
+        self.max_bytes = max_bytes or getattr(settings, 'IP_TRACKING_LOG_FILE_MAX_BYTES', 64 * 1024 * 1024)
+        self.max_age = max_age or getattr(settings, 'IP_TRACKING_LOG_FILE_MAX_AGE', 300)
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue or getattr(settings, 'IP_TRACKING_LOG_MAX_BUFFER', 10000))
+        self._file = None
+        self._path = None
+        self._opened_at = None
+        self._last_stamp = 0
+        self._flushed_at = 0.0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+        self.written_count = 0
+        self.dropped_count = 0
+        self.rotated_count = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._close_orphans()
+
+    def write(self, **fields):
+        from .routes import cached_route_name
+
+        record = log_stream.encode_record(**fields)
+        route = cached_route_name(fields.get('route_id'))
+        if route is not None:
+            record['rt'] = route
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_count += 1
+            return
+        self._ensure_thread()
+        self._wake.set()
+
+    def flush(self):
+        """Write out everything queued so far (from the calling thread)."""
+        with self._lock:
+            self._drain()
+            if self._file is not None:
+                self._file.flush()
+
+    def rotate(self):
+        """Close the current file so the loader can ship it."""
+        with self._lock:
+            self._drain()
+            self._close_current()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self.rotate()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written_count,
+            'dropped': self.dropped_count,
+            'rotated': self.rotated_count,
+        }
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='request-log-file-sink', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            # Records only leave the queue under the lock, so flush() and
+            # rotate() never miss one the thread has taken but not written
+            with self._lock:
+                self._drain()
+                if self._file is not None:
+                    now = time.time()
+                    if now - self._opened_at >= self.max_age:
+                        self._close_current()
+                    elif now - self._flushed_at >= self.flush_interval:
+                        self._file.flush()
+                        self._flushed_at = now
+
+    def _drain(self):
+        while True:
+            try:
+                self._write_line(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _write_line(self, record):
+        if self._file is None:
+            self._open()
+        line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+        self._file.write(line)
+        self._bytes += len(line)
+        self.written_count += 1
+        if self._bytes >= self.max_bytes:
+            self._close_current()
+
+    def _open(self):
+        self._opened_at = time.time()
+        # Strictly increasing, so files rotated within one millisecond
+        # never share (and overwrite) a name
+        self._last_stamp = max(int(self._opened_at * 1000), self._last_stamp + 1)
+        name = f'requests-{socket.gethostname()}-{os.getpid()}-{self._last_stamp}'
+        self._path = os.path.join(self.directory, name + OPEN_SUFFIX)
+        self._file = gzip.open(self._path, 'ab')
+        self._bytes = 0
+
+    def _close_current(self):
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            os.replace(self._path, self._path[:-len('.open')])
+            self.rotated_count += 1
+        except OSError as e:
+            logger.error(f"Failed to rotate request log file {self._path}: {e}")
+        self._file = None
+        self._path = None
+
+    def _close_orphans(self):
+        """Finalize files left open by dead processes on this host."""
+        host = socket.gethostname()
+        for path in glob.glob(os.path.join(self.directory, f'requests-{host}-*{OPEN_SUFFIX}')):
+            try:
+                pid = int(os.path.basename(path)[len(f'requests-{host}-'):].split('-')[0])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                try:
+                    os.replace(path, path[:-len('.open')])
+                except OSError:
+                    pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def build_sink(config):
+    """Instantiate one entry of IP_TRACKING_LOG_SINKS."""
+    if isinstance(config, str):
+        config = {'backend': config}
+    options = dict(config)
+    backend = options.pop('backend')
+    return import_string(BACKENDS.get(backend, backend))(**options)
+
+
+def _default_config():
+    if getattr(settings, 'IP_TRACKING_LOG_INGESTION', 'buffered') == 'stream':
+        return [{'backend': 'stream'}]
+    return [{'backend': 'database'}]
+
+
+def _configs():
+    return getattr(settings, 'IP_TRACKING_LOG_SINKS', None) or _default_config()
+
+
+def stream_enabled():
+    """True if request logs are published to the Redis stream (drain_request_log_stream has work)."""
+    for config in _configs():
+        backend = config if isinstance(config, str) else config.get('backend')
+        if BACKENDS.get(backend, backend) == BACKENDS['stream']:
+            return True
+    return False
+
+
+_sinks = None
+_sinks_lock = threading.Lock()
+
+
+def get_sinks():
+    """Return the process-wide list of sinks built from IP_TRACKING_LOG_SINKS."""
+    global _sinks
+    if _sinks is None:
+        with _sinks_lock:
+            if _sinks is None:
+                sinks = []
+                for config in _configs():
+                    try:
+                        sinks.append(build_sink(config))
+                    except Exception as e:
+                        logger.error(f"Could not configure request log sink {config!r}: {e}")
+                for sink in sinks:
+                    atexit.register(sink.close)
+                _sinks = sinks
+    return _sinks
+
+
+def load_files(directory=None, batch_size=5000, delete=False):
+    """
+    Bulk-insert closed request log files from ``directory`` into RequestLog.
+
+    Each loaded file is moved to ``<directory>/loaded/`` (or deleted with
+    ``delete=True``) so it is never loaded twice. A file whose gzip trailer
+    is missing (its writer was killed) is loaded up to the last complete
+    line. Lines that are not valid records are skipped and counted.
+
+    Routes are interned by their pattern (``rt``); a bare route id from an
+    older file is kept only if it exists here. Returns
+    ``(files, rows, skipped)``.
+    """
+    from django.db import transaction
+    from .models import RequestLog, RequestRoute
+    from .routes import intern_route
+
+    directory = str(directory or getattr(settings, 'IP_TRACKING_LOG_FILE_DIR', 'request_logs'))
+    loaded_dir = os.path.join(directory, 'loaded')
+    files = rows = skipped = 0
+    known_route_ids = None
+    for path in sorted(glob.glob(os.path.join(directory, f'*{CLOSED_SUFFIX}'))):
+        records = []
+        bad_lines = 0
+        try:
+            with gzip.open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        continue
+                    try:
+                        fields = json.loads(line)
+                        record = log_stream.decode_record(fields)
+                        # An invalid address would fail the whole INSERT on PostgreSQL
+                        ipaddress.ip_address(record.ip_address)
+                    except (ValueError, KeyError, TypeError, AttributeError, OverflowError) as e:
+                        bad_lines += 1
+                        logger.debug(f"Skipping malformed request log in {path}: {e}")
+                        continue
+                    if fields.get('rt'):
+                        record.route_id = intern_route(fields['rt'])
+                    elif record.route_id is not None:
+                        if known_route_ids is None:
+                            known_route_ids = set(RequestRoute.objects.values_list('id', flat=True))
+                        if int(record.route_id) not in known_route_ids:
+                            record.route_id = None
+                    records.append(record)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            logger.warning(f"{path} is truncated, loading {len(records)} complete record(s): {e}")
+        if bad_lines:
+            logger.warning(f"Skipped {bad_lines} malformed line(s) in {path}")
+
+        with transaction.atomic():
+            RequestLog.objects.bulk_create(records, batch_size=batch_size)
+        if delete:
+            os.remove(path)
+        else:
+            os.makedirs(loaded_dir, exist_ok=True)
+            os.replace(path, os.path.join(loaded_dir, os.path.basename(path)))
+        files += 1
+        rows += len(records)
+        skipped += bad_lines
+        logger.info(f"Loaded {len(records)} request log(s) from {path}")
+    return files, rows, skipped
@@ -6,9 +6,11 @@ Task 4: Anomaly detection to flag suspicious IPs using basic machine learning.
 import logging
 from celery import shared_task
 from django.utils import timezone
-from django.db.models import Count, Q
+from django.db.models import Case, Count, Q, Sum, When
+from django.db.models.functions import Coalesce
 from datetime import timedelta
 
+from .counters import sensitive_paths, sensitive_threshold, volume_threshold
 from .models import RequestLog, SuspiciousIP
 
 logger = logging.getLogger(__name__)
@@ -33,131 +35,156 @@ def detect_suspicious_ips():
     - IPs exceeding 100 requests/hour
     - IPs accessing sensitive paths (e.g., /admin, /login)
     
+    Per-IP features come from the real-time Redis counters (see counters.py)
+    when they hold any traffic, otherwise from a single aggregation pass
+    over the last hour of RequestLog. All flags are written back with one bulk upsert.
+
     This task runs hourly via Celery Beat.
     """
-    one_hour_ago = timezone.now() - timedelta(hours=1)
-    
-    # Get all requests from the last hour
-    recent_logs = RequestLog.objects.filter(timestamp__gte=one_hour_ago)
-    
-    if recent_logs.count() == 0:
+    from django.conf import settings
+    from .log_stream import get_stream_connection
+
+    rows = None
+    source = 'counters'
+    conn = get_stream_connection() if getattr(settings, 'IP_TRACKING_REALTIME_COUNTERS', True) else None
+    if conn is not None:
+        try:
+            from .counters import read_window
+            rows = read_window(conn)
+        except Exception as e:
+            logger.error(f"Reading sliding-window counters failed, scanning RequestLog instead: {e}")
+
+    # An empty window also means Redis may just have been restarted or
+    # flushed, or the counters were only switched on; RequestLog still has
+    # the last hour either way.
+    if not rows:
+        source = 'RequestLog'
+        rows = _aggregate_features(timezone.now() - timedelta(hours=1))
+
+    if not rows:
         logger.info("No recent logs to analyze")
         return "No logs to analyze"
-    
-    flagged_count = 0
-    
-    # Rule-based detection: High volume IPs
-    high_volume_ips = (
-        recent_logs
-        .values('ip_address')
-        .annotate(request_count=Count('id'))
-        .filter(request_count__gt=100)
-    )
-    
-    for entry in high_volume_ips:
-        ip = entry['ip_address']
-        count = entry['request_count']
-        reason = f'High request volume: {count} requests in the last hour (threshold: 100)'
-        
-        suspicious_ip, created = SuspiciousIP.objects.get_or_create(
-            ip_address=ip,
-            defaults={
-                'reason': reason,
-                'request_count': count
-            }
-        )
-        
-        if not created:
-            suspicious_ip.reason = reason
-            suspicious_ip.request_count = count
-            suspicious_ip.save(update_fields=['reason', 'request_count', 'last_seen'])
-        
-        flagged_count += 1
-        logger.info(f"Flagged IP {ip} for high volume: {count} requests/hour")
-    
-    # Rule-based detection: Sensitive paths
-    sensitive_paths = ['/admin', '/login', '/api/admin', '/api/login']
-    sensitive_access = (
-        recent_logs
-        .filter(path__in=sensitive_paths)
-        .values('ip_address')
-        .annotate(access_count=Count('id'))
-        .filter(access_count__gte=10)
-    )
-    
-    for entry in sensitive_access:
-        ip = entry['ip_address']
-        count = entry['access_count']
-        
-        paths_accessed = recent_logs.filter(
-            ip_address=ip,
-            path__in=sensitive_paths,
-            timestamp__gte=one_hour_ago
-        ).values_list('path', flat=True).distinct()
-        
-        reason = f'Repeated access to sensitive paths ({count} times): {", ".join(paths_accessed)}'
-        
-        suspicious_ip, created = SuspiciousIP.objects.get_or_create(
-            ip_address=ip,
-            defaults={
-                'reason': reason,
-                'request_count': count
-            }
-        )
-        
-        if not created:
-            suspicious_ip.reason = reason
-            suspicious_ip.request_count = count
-            suspicious_ip.save(update_fields=['reason', 'request_count', 'last_seen'])
-        
-        flagged_count += 1
-        logger.info(f"Flagged IP {ip} for sensitive path access: {count} times")
-    
-    # ML-based anomaly detection using scikit-learn
+
+    # ip -> (reason, request_count); later rules take precedence
+    flagged = _apply_rules(rows)
+
+    # ML-based anomaly detection using scikit-learn. Once a persisted model
+    # exists, ML scoring is done every few minutes by score_recent_traffic.
     if ML_AVAILABLE:
         try:
-            flagged_ml = _ml_anomaly_detection(recent_logs)
-            flagged_count += flagged_ml
+            from .anomaly import load_latest_model
+            if load_latest_model() is None:
+                flagged.update(_score_features(rows))
         except Exception as e:
             logger.error(f"ML anomaly detection failed: {e}")
     else:
         logger.debug("ML-based anomaly detection skipped (scikit-learn not available)")
-    
-    logger.info(f"Anomaly detection completed. Flagged {flagged_count} suspicious IP(s).")
-    return f"Flagged {flagged_count} suspicious IP(s)"
-    
 
-def _ml_anomaly_detection(recent_logs):
+    _upsert_suspicious(flagged)
+
+    logger.info(f"Anomaly detection completed from {source}. Flagged {len(flagged)} suspicious IP(s).")
+    return f"Flagged {len(flagged)} suspicious IP(s)"
+
+
+def _aggregate_features(since):
     """
-    Use scikit-learn Isolation Forest for ML-based anomaly detection.
-    Detects IPs with unusual behavior patterns.
+    Build the per-IP feature table for RequestLog rows newer than ``since``
+    in one GROUP BY query.
+
+    Returns dicts with request_count, unique_paths, sensitive_path_count and
+    sensitive_paths (the distinct sensitive paths accessed). Paths are keyed
+    by their interned route, falling back to the raw path.
     """
-    if not ML_AVAILABLE:
+    from .aggregates import DistinctConcat
+    from .routes import sensitive_route_ids
+
+    endpoint = Coalesce('route__route', 'path')
+    sensitive = Q(path__in=sorted(sensitive_paths())) | Q(route_id__in=sensitive_route_ids())
+    rows = list(
+        RequestLog.objects
+        .filter(timestamp__gte=since)
+        .values('ip_address')
+        .annotate(
+            # Sampled rows stand for sample_weight requests each
+            request_count=Sum('sample_weight'),
+            unique_paths=Count(endpoint, distinct=True),
+            sensitive_path_count=Coalesce(Sum('sample_weight', filter=sensitive), 0),
+            sensitive_path_list=DistinctConcat(Case(When(sensitive, then=endpoint))),
+        )
+        .order_by()
+    )
+    for row in rows:
+        paths = row.pop('sensitive_path_list')
+        row['sensitive_paths'] = sorted(paths.split(',')) if paths else []
+    return rows
+
+
+def _apply_rules(rows):
+    """Apply the volume and sensitive-path rules to per-IP feature rows."""
+    volume_limit = volume_threshold()
+    sensitive_limit = sensitive_threshold()
+    flagged = {}
+    for row in rows:
+        ip = row['ip_address']
+
+        # Rule-based detection: High volume IPs
+        if row['request_count'] > volume_limit:
+            count = row['request_count']
+            flagged[ip] = (_volume_reason(count), count)
+            logger.info(f"Flagged IP {ip} for high volume: {count} requests/hour")
+
+        # Rule-based detection: Sensitive paths
+        if row['sensitive_path_count'] >= sensitive_limit:
+            count = row['sensitive_path_count']
+            flagged[ip] = (_sensitive_reason(count, row['sensitive_paths']), count)
+            logger.info(f"Flagged IP {ip} for sensitive path access: {count} times")
+    return flagged
+
+
+def _volume_reason(count):
+    return f'High request volume: {count} requests in the last hour (threshold: {volume_threshold()})'
+
+
+def _sensitive_reason(count, paths):
+    return f'Repeated access to sensitive paths ({count} times): {", ".join(paths)}'
+
+
+def _upsert_suspicious(flagged):
+    """Create or refresh SuspiciousIP rows for all flagged IPs in one statement."""
+    if not flagged:
         return 0
-    
-    flagged_count = 0
+    SuspiciousIP.objects.bulk_create(
+        [
+            SuspiciousIP(ip_address=ip, reason=reason, request_count=count)
+            for ip, (reason, count) in flagged.items()
+        ],
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['ip_address'],
+        update_fields=['reason', 'request_count', 'last_seen'],
+    )
+    return len(flagged)
+
+
+def _score_features(rows):
+    """
+    Fit an Isolation Forest over per-IP feature rows (dicts with
+    request_count, unique_paths and sensitive_path_count).
+
+    Returns ``{ip: (reason, request_count)}`` for the outliers.
+    """
+    flagged = {}
     
     try:
-        # Aggregate features per IP
-        ip_features = (
-            recent_logs
-            .values('ip_address')
-            .annotate(
-                request_count=Count('id'),
-                unique_paths=Count('path', distinct=True),
-                sensitive_path_count=Count('id', filter=Q(path__in=['/admin', '/login', '/api/admin', '/api/login']))
-            )
-        )
-        
-        if len(ip_features) < 2:
+        if len(rows) < 2:
             # Need at least 2 IPs for ML to work
-            return 0
+            return flagged
         
         # Prepare features for ML
         features = []
         ip_list = []
         
-        for entry in ip_features:
+        for entry in rows:
             ip_list.append(entry['ip_address'])
             features.append([
                 entry['request_count'],
@@ -189,20 +216,7 @@ def _ml_anomaly_detection(recent_logs):
                     f'{feature_values[2]} sensitive path accesses'
                 )
                 
-                suspicious_ip, created = SuspiciousIP.objects.get_or_create(
-                    ip_address=ip,
-                    defaults={
-                        'reason': reason,
-                        'request_count': feature_values[0]
-                    }
-                )
-                
-                if not created:
-                    suspicious_ip.reason = reason
-                    suspicious_ip.request_count = feature_values[0]
-                    suspicious_ip.save(update_fields=['reason', 'request_count', 'last_seen'])
-                
-                flagged_count += 1
+                flagged[ip] = (reason, feature_values[0])
                 logger.info(f"ML flagged IP {ip} as anomalous")
     
     except ImportError:
@@ -210,7 +224,61 @@ def _ml_anomaly_detection(recent_logs):
     except Exception as e:
         logger.error(f"ML anomaly detection error: {e}")
     
-    return flagged_count
+    return flagged
+
+
+@shared_task
+def train_anomaly_model(hours=24):
+    """
+    Train and save a new version of the anomaly model on recent traffic
+    (see anomaly.py). Runs daily via Celery Beat.
+    """
+    from .anomaly import train_model
+
+    bundle = train_model(hours=hours)
+    if bundle is None:
+        return "No model trained"
+    return f"Trained anomaly model v{bundle['version']} on {bundle['n_samples']} samples"
+
+
+@shared_task
+def score_recent_traffic():
+    """
+    Score the latest slice of traffic against the persisted anomaly model
+    and flag outliers. Runs every few minutes via Celery Beat; no-op until
+    a model has been trained.
+    """
+    from .anomaly import score_recent
+
+    flagged = score_recent()
+    if flagged is None:
+        return "No anomaly model trained yet"
+    _upsert_suspicious(flagged)
+    for ip in flagged:
+        logger.info(f"ML flagged IP {ip} as anomalous")
+    return f"Flagged {len(flagged)} suspicious IP(s)"
+
+
+@shared_task(ignore_result=True)
+def drain_request_log_stream():
+    """
+    Persist request logs queued in the Redis stream (IP_TRACKING_LOG_INGESTION
+    = 'stream' or a 'stream' entry in IP_TRACKING_LOG_SINKS) into RequestLog
+    with batched bulk_create. Returns at once when no stream sink is configured.
+
+    Scheduled every few seconds via Celery Beat.
+    """
+    import os
+    import socket
+    from .log_stream import drain
+
+    metrics = drain(consumer=f'{socket.gethostname()}-{os.getpid()}')
+    if metrics.get('written'):
+        logger.info(
+            f"Drained {metrics['written']} request log(s) from stream "
+            f"(lag: {metrics.get('lag')}, pending: {metrics.get('pending')})"
+        )
+    return metrics
 
 
 @shared_task
@@ -218,13 +286,52 @@ def cleanup_old_logs():
     """
     Cleanup task to delete old request logs based on retention policy.
     Helps with privacy compliance and database management.
+
+    Drops whole partitions when RequestLog is partitioned (PostgreSQL) and
+    otherwise deletes in throttled primary-key batches (see partitioning.py).
     """
     from django.conf import settings
+    from .partitioning import apply_retention
     
     retention_days = getattr(settings, 'IP_TRACKING_RETENTION_DAYS', 90)
     cutoff_date = timezone.now() - timedelta(days=retention_days)
     
-    deleted_count, _ = RequestLog.objects.filter(timestamp__lt=cutoff_date).delete()
+    partitions_dropped, deleted_count = apply_retention(cutoff_date)
     
-    logger.info(f"Cleaned up {deleted_count} old request logs (older than {retention_days} days)")
-    return f"Deleted {deleted_count} old logs"
+    logger.info(
+        f"Cleaned up {deleted_count} old request logs and {partitions_dropped} partition(s) "
+        f"(older than {retention_days} days)"
+    )
+    return f"Deleted {deleted_count} old logs, dropped {partitions_dropped} partition(s)"
+
+
+@shared_task
+def update_traffic_rollups():
+    """
+    Fold RequestLog rows added since the last run into the hourly rollup
+    tables (see rollups.py). Runs every few minutes via Celery Beat.
+    """
+    from .rollups import update_rollups
+
+    return update_rollups()
+
+
+@shared_task
+def enrich_request_log_geo():
+    """
+    Fill in country/city for RequestLog rows written without geolocation
+    (IP_TRACKING_GEOIP_MODE = 'deferred', see enrichment.py).
+    """
+    from .enrichment import enrich_logs, is_deferred
+
+    if not is_deferred():
+        return {'skipped': True}
+    return enrich_logs()
+
+
+@shared_task(ignore_result=True)
+def maintain_request_log_partitions():
+    """Pre-create upcoming RequestLog partitions (no-op unless partitioned)."""
+    from .partitioning import ensure_partitions
+
+    return ensure_partitions()
@@ -1,3 +1,1749 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gc
+import glob
+import gzip
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+import ipaddress
+
+from . import anomaly, backfill, counters, enrichment, export, log_stream, partitioning, rate_limits, rollups, routes
+from .blocklist import (
+    BlocklistMatcher,
+    CompiledBlocklist,
+    bulk_block,
+    get_blocklist,
+    parse_entries,
+    parse_entry,
+)
+from .geoip import GEOIP_DB_FILENAME, GeoIPService, LRUCache, is_public_ip
+from .log_writer import RequestLogWriter, get_log_writer
+from .middleware import QueryTimer
+from .models import (
+    AnomalyBackfillScore,
+    BlockedIP,
+    HourlyCountryTraffic,
+    HourlyIPTraffic,
+    HourlyPathTraffic,
+    RequestLog,
+    RequestRoute,
+    RollupWatermark,
+    SuspiciousIP,
+)
+from .sinks import CLOSED_SUFFIX, OPEN_SUFFIX, FileSink, RequestLogSink, StreamSink, load_files, stream_enabled
+from .sampling import SamplingPolicy
+from .tasks import _aggregate_features, _upsert_suspicious, detect_suspicious_ips
+from .utils import parse_moment
+from .watermarks import next_batch
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class RecordingSink(RequestLogSink):
+    """Keeps the request logs the middleware hands to its sinks."""
+    name = 'recording'
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, **fields):
+        self.records.append(fields)
+
+
+def reset_request_state(testcase):
+    """
+    Forget process-wide state that would outlive a test's rolled-back rows
+    (cached route ids, the compiled blocklist) and flush logs buffered by
+    requests the test makes.
+    """
+    cache.clear()
+    routes._route_ids.clear()
+    routes._route_names.clear()
+    get_blocklist().invalidate()
+    # Compile on the test thread; the async path would refresh on another
+    # thread, outside the test transaction
+    get_blocklist().is_blocked('127.0.0.1')
+    testcase.addCleanup(get_log_writer().flush)
+    testcase.addCleanup(get_blocklist().invalidate)
+
+
+def _stop_flusher(writer):
+    writer._stop.set()
+    writer._wake.set()
+
+
+class RequestLogWriterTests(TestCase):
+    def make_writer(self, **kwargs):
+        kwargs.setdefault('flush_interval', 60)
+        writer = RequestLogWriter(sync_writes=False, **kwargs)
+        self.addCleanup(_stop_flusher, writer)
+        return writer
+
+    def test_records_are_buffered_until_flush(self):
+        writer = self.make_writer(batch_size=10)
+        for i in range(3):
+            self.assertTrue(writer.write(ip_address=f'203.0.113.{i}', path='/a'))
+
+        self.assertEqual(RequestLog.objects.count(), 0)
+        self.assertEqual(writer.stats()['buffered'], 3)
+
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(RequestLog.objects.count(), 3)
+        self.assertEqual(writer.stats(), {'buffered': 0, 'enqueued': 3, 'flushed': 3, 'dropped': 0, 'failed': 0})
+
+    def test_full_batch_is_flushed_by_the_writing_request(self):
+        writer = self.make_writer(batch_size=2)
+        writer.write(ip_address='203.0.113.1', path='/a')
+        self.assertEqual(RequestLog.objects.count(), 0)
+        writer.write(ip_address='203.0.113.2', path='/b')
+        self.assertEqual(RequestLog.objects.count(), 2)
+
+    def test_records_are_dropped_when_the_buffer_is_full(self):
+        writer = self.make_writer(batch_size=10, max_buffer=1)
+        self.assertTrue(writer.write(ip_address='203.0.113.1', path='/a'))
+        self.assertFalse(writer.write(ip_address='203.0.113.2', path='/b'))
+        self.assertEqual(writer.stats()['dropped'], 1)
+        self.assertEqual(writer.flush(), 1)
+
+    def test_flush_of_an_empty_buffer_is_a_no_op(self):
+        self.assertEqual(self.make_writer().flush(), 0)
+
+    def test_sync_writes_bypass_the_buffer(self):
+        writer = RequestLogWriter(sync_writes=True)
+        writer.write(ip_address='203.0.113.1', path='/a')
+        self.assertEqual(RequestLog.objects.count(), 1)
+        self.assertEqual(writer.stats()['buffered'], 0)
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+@override_settings(IP_TRACKING_LOG_INGESTION='stream', IP_TRACKING_LOG_SINKS=[])
+class LogStreamTests(TestCase):
+    def setUp(self):
+        self.conn = fakeredis.FakeStrictRedis()
+        patcher = mock.patch.object(log_stream, 'get_stream_connection', return_value=self.conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Forget the stream length cached by earlier tests
+        log_stream._length_checked_at = None
+
+    def test_records_round_trip_through_the_stream_encoding(self):
+        fields = log_stream.encode_record(
+            ip_address='203.0.113.7', path='/a', method='POST', country='France',
+            status_code=201, duration_us=1500, sample_weight=4,
+        )
+        record = log_stream.decode_record({k.encode(): v.encode() for k, v in fields.items()})
+        self.assertEqual(
+            (record.ip_address, record.path, record.method, record.country, record.city),
+            ('203.0.113.7', '/a', 'POST', 'France', None),
+        )
+        self.assertEqual((record.status_code, record.duration_us, record.sample_weight), (201, 1500, 4))
+
+    def test_drain_persists_and_removes_published_entries(self):
+        for i in range(3):
+            log_stream.publish(self.conn, ip_address=f'203.0.113.{i}', path='/a', method='GET')
+
+        metrics = log_stream.drain()
+
+        self.assertEqual(metrics['written'], 3)
+        self.assertEqual(RequestLog.objects.count(), 3)
+        self.assertEqual(self.conn.xlen(log_stream.stream_key()), 0)
+
+    def test_malformed_entries_are_dead_lettered(self):
+        log_stream.publish(self.conn, ip_address='203.0.113.1', path='/a', method='GET')
+        self.conn.xadd(log_stream.stream_key(), {'i': '203.0.113.2'})
+
+        metrics = log_stream.drain()
+
+        self.assertEqual(metrics['written'], 1)
+        self.assertEqual(metrics['dead_letter'], 1)
+
+    def test_publish_applies_backpressure_instead_of_trimming(self):
+        with override_settings(IP_TRACKING_LOG_STREAM_MAXLEN=2):
+            log_stream.publish(self.conn, ip_address='203.0.113.1', path='/a', method='GET')
+            log_stream.publish(self.conn, ip_address='203.0.113.2', path='/a', method='GET')
+            with self.assertRaises(log_stream.StreamFull):
+                log_stream.publish(self.conn, ip_address='203.0.113.3', path='/a', method='GET')
+        self.assertEqual(self.conn.xlen(log_stream.stream_key()), 2)
+
+    def test_publish_is_one_round_trip(self):
+        log_stream.publish(self.conn, ip_address='203.0.113.1', path='/a', method='GET')
+        with mock.patch.object(self.conn, 'execute_command', wraps=self.conn.execute_command) as commands, \
+                mock.patch.object(log_stream, 'LENGTH_CHECK_INTERVAL', 0):
+            log_stream.publish(self.conn, ip_address='203.0.113.2', path='/a', method='GET')
+
+        # XLEN and XADD go out together in the pipeline
+        commands.assert_not_called()
+        self.assertEqual((log_stream._length, self.conn.xlen(log_stream.stream_key())), (2, 2))
+
+    def test_backpressure_lifts_once_the_stream_drains(self):
+        with override_settings(IP_TRACKING_LOG_STREAM_MAXLEN=1):
+            log_stream.publish(self.conn, ip_address='203.0.113.1', path='/a', method='GET')
+            log_stream.drain()
+            with mock.patch.object(log_stream, 'LENGTH_CHECK_INTERVAL', 0):
+                log_stream.publish(self.conn, ip_address='203.0.113.2', path='/a', method='GET')
+        self.assertEqual(self.conn.xlen(log_stream.stream_key()), 1)
+
+    @override_settings(IP_TRACKING_LOG_STREAM_KEY='tenant:requestlog')
+    def test_settings_are_read_at_call_time(self):
+        log_stream.publish(self.conn, ip_address='203.0.113.1', path='/a', method='GET')
+
+        self.assertEqual(self.conn.xlen('tenant:requestlog'), 1)
+        self.assertEqual(log_stream.drain()['written'], 1)
+
+    @override_settings(IP_TRACKING_LOG_INGESTION='buffered')
+    def test_drain_does_nothing_without_a_stream_sink(self):
+        with mock.patch.object(log_stream, 'get_stream_connection') as connection:
+            self.assertEqual(log_stream.drain(), {'written': 0, 'lag': None})
+        connection.assert_not_called()
+        self.assertFalse(self.conn.exists(log_stream.stream_key()))
+
+        with override_settings(IP_TRACKING_LOG_SINKS=['database', {'backend': 'stream'}]):
+            self.assertTrue(stream_enabled())
+
+    def test_stream_sink_falls_back_to_the_database_when_full(self):
+        sink = StreamSink()
+        with override_settings(IP_TRACKING_LOG_STREAM_MAXLEN=1), \
+                mock.patch('apps.security.sinks.get_log_writer', return_value=RequestLogWriter(sync_writes=True)):
+            sink.write(ip_address='203.0.113.1', path='/a', method='GET')
+            sink.write(ip_address='203.0.113.2', path='/a', method='GET')
+
+        self.assertEqual(sink.stats(), {'published': 1, 'backpressure': 1, 'failed': 0})
+        self.assertEqual(list(RequestLog.objects.values_list('ip_address', flat=True)), ['203.0.113.2'])
+
+
+def _city(country, city):
+    return SimpleNamespace(country=SimpleNamespace(name=country), city=SimpleNamespace(name=city))
+
+
+class GeoIPServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.geoip_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.geoip_dir)
+
+    def test_lru_evicts_the_least_recently_used_entry(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+    def test_is_public_ip(self):
+        self.assertTrue(is_public_ip('8.8.8.8'))
+        self.assertTrue(is_public_ip('2001:4860:4860::8888'))
+        for ip in ('10.1.2.3', '127.0.0.1', '169.254.0.1', '::1', 'not-an-ip'):
+            self.assertFalse(is_public_ip(ip), ip)
+
+    def test_private_addresses_are_never_looked_up(self):
+        service = GeoIPService(geoip_path=self.geoip_dir)
+        with mock.patch.object(service, '_get_reader', side_effect=AssertionError('reader opened')):
+            self.assertEqual(service.locate('192.168.1.10'), (None, None))
+            self.assertEqual(service.locate_many(['10.0.0.1', '127.0.0.1']), {
+                '10.0.0.1': (None, None), '127.0.0.1': (None, None),
+            })
+
+    def test_lookups_are_served_from_the_lru_after_the_first(self):
+        service = GeoIPService(geoip_path=self.geoip_dir)
+        reader = mock.Mock()
+        reader.city.return_value = _city('Germany', 'Berlin')
+        with mock.patch.object(service, '_get_reader', return_value=reader):
+            self.assertEqual(service.locate('8.8.8.8'), ('Germany', 'Berlin'))
+            self.assertEqual(service.locate('8.8.8.8'), ('Germany', 'Berlin'))
+            self.assertEqual(service.locate_many(['8.8.8.8']), {'8.8.8.8': ('Germany', 'Berlin')})
+        self.assertEqual(reader.city.call_count, 1)
+
+    def test_shared_cache_keys_carry_the_database_version(self):
+        service = GeoIPService(geoip_path=self.geoip_dir)
+        old_key = service._cache_key('8.8.8.8')
+        service._version = 1700000000
+        self.assertNotEqual(service._cache_key('8.8.8.8'), old_key)
+
+    def test_missing_database_resolves_to_nothing(self):
+        service = GeoIPService(geoip_path=self.geoip_dir)
+        self.assertEqual(service.locate('8.8.8.8'), (None, None))
+
+    def test_unreadable_database_never_raises(self):
+        with open(os.path.join(self.geoip_dir, GEOIP_DB_FILENAME), 'wb') as f:
+            f.write(b'not a maxmind database')
+        service = GeoIPService(geoip_path=self.geoip_dir)
+
+        self.assertEqual(service.locate('8.8.8.8'), (None, None))
+        self.assertEqual(service.locate_many(['8.8.4.4']), {'8.8.4.4': (None, None)})
+        self.assertEqual(async_to_sync(service.alocate)('1.1.1.1'), (None, None))
+
+    def test_a_missing_database_is_checked_once_per_interval(self):
+        service = GeoIPService(geoip_path=self.geoip_dir)
+        with mock.patch('apps.security.geoip.os.stat', side_effect=FileNotFoundError) as stat:
+            service.locate('8.8.8.8')
+            service.locate('8.8.4.4')
+        self.assertEqual(stat.call_count, 1)
+
+    def test_async_lookups_refresh_the_reader_off_the_event_loop(self):
+        service = GeoIPService(geoip_path=self.geoip_dir)
+        reader = mock.Mock()
+        reader.city.return_value = _city('Germany', 'Berlin')
+        loop_thread = []
+
+        def refresh():
+            self.assertNotIn(threading.get_ident(), loop_thread)
+            service._reader, service._last_check = reader, time.monotonic()
+
+        async def locate(ip):
+            loop_thread.append(threading.get_ident())
+            return await service.alocate(ip)
+
+        with mock.patch.object(service, '_refresh_reader', side_effect=refresh) as refreshed:
+            self.assertEqual(async_to_sync(locate)('8.8.8.8'), ('Germany', 'Berlin'))
+            self.assertEqual(async_to_sync(locate)('8.8.4.4'), ('Germany', 'Berlin'))
+        self.assertEqual(refreshed.call_count, 1)
+
+
+class BlocklistTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+
+    def test_compiled_table_matches_hosts_and_ranges(self):
+        blocklist = CompiledBlocklist(ipaddress.ip_network(cidr) for cidr in (
+            '203.0.113.7/32', '198.51.100.0/24', '10.0.0.0/8', '2001:db8::/32',
+        ))
+        for ip in ('203.0.113.7', '198.51.100.200', '10.255.0.1', '2001:db8:1::1', '::ffff:198.51.100.1'):
+            self.assertIn(ip, blocklist)
+        for ip in ('203.0.113.8', '198.51.101.1', '11.0.0.1', '2001:db9::1', 'garbage'):
+            self.assertNotIn(ip, blocklist)
+        self.assertEqual(blocklist.size, 4)
+
+    def test_matcher_recompiles_when_the_blocklist_changes(self):
+        matcher = BlocklistMatcher(check_interval=0)
+        self.assertFalse(matcher.is_blocked('198.51.100.9'))
+
+        BlockedIP.objects.create(ip_address='198.51.100.0', prefix_length=24)
+
+        self.assertTrue(matcher.is_blocked('198.51.100.9'))
+        self.assertTrue(async_to_sync(matcher.ais_blocked)('198.51.100.10'))
+        self.assertFalse(matcher.is_blocked('198.51.101.9'))
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_blocked_clients_get_403(self):
+        BlockedIP.objects.create(ip_address='198.51.100.0', prefix_length=24)
+        # The process-wide matcher only rechecks the table every few seconds
+        get_blocklist().invalidate()
+        self.assertEqual(self.client.get('/api/security/', REMOTE_ADDR='198.51.100.9').status_code, 403)
+        self.assertEqual(self.client.get('/api/security/', REMOTE_ADDR='198.51.101.9').status_code, 200)
+
+    def test_a_host_and_a_range_may_share_an_address(self):
+        BlockedIP.objects.create(ip_address='10.0.0.0')
+        BlockedIP.objects.create(ip_address='10.0.0.0', prefix_length=8)
+        BlockedIP.objects.create(ip_address='10.0.0.0', prefix_length=16)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BlockedIP.objects.create(ip_address='10.0.0.0')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BlockedIP.objects.create(ip_address='10.0.0.0', prefix_length=8)
+
+
+@override_settings(RATE_LIMIT_ENABLED=False, IP_TRACKING_REALTIME_COUNTERS=False)
+class AsyncMiddlewareTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        self.sink = RecordingSink()
+        patcher = mock.patch('apps.security.middleware.get_sinks', return_value=[self.sink])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_requests_are_logged_on_the_async_path(self):
+        response = await self.async_client.get('/api/security/')
+
+        self.assertEqual(response.status_code, 200)
+        [record] = self.sink.records
+        self.assertEqual((record['method'], record['status_code'], record['sample_weight']), ('GET', 200, 1))
+        self.assertIsNotNone(record['route_id'])
+
+    def test_blocked_clients_get_403_on_the_async_path(self):
+        BlockedIP.objects.create(ip_address='127.0.0.0', prefix_length=8)
+        get_blocklist().invalidate()
+        get_blocklist().is_blocked('127.0.0.1')
+
+        response = async_to_sync(self.async_client.get)('/api/security/')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.sink.records[0]['status_code'], 403)
+
+
+class AsyncRedisClientTests(TestCase):
+    def test_client_uses_the_cache_connection_settings(self):
+        client = counters._build_async_client({
+            'LOCATION': 'rediss://cache.internal:6380/3,rediss://replica.internal:6380/3',
+            'OPTIONS': {
+                'PASSWORD': 'secret',
+                'SOCKET_TIMEOUT': 2,
+                'CONNECTION_POOL_KWARGS': {'ssl_cert_reqs': None},
+            },
+        })
+        pool = client.connection_pool
+        self.assertEqual(pool.connection_class.__name__, 'SSLConnection')
+        self.assertEqual(
+            {key: pool.connection_kwargs.get(key) for key in ('host', 'port', 'db', 'password', 'socket_timeout')},
+            {'host': 'cache.internal', 'port': 6380, 'db': 3, 'password': 'secret', 'socket_timeout': 2},
+        )
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': 'redis://cache.internal:6379/1'}})
+    def test_each_event_loop_gets_its_own_client(self):
+        async def get_client():
+            return counters._get_async_client()[0]
+
+        first = asyncio.run(get_client())
+        second = asyncio.run(get_client())
+        self.assertIsNot(first, second)
+        del first, second
+        gc.collect()
+        # Entries go away with their loops
+        self.assertEqual(len(counters._async_clients), 0)
+
+    def test_no_client_without_a_redis_cache(self):
+        async def get_client():
+            return counters._get_async_client()
+
+        self.assertEqual(asyncio.run(get_client()), (None, None))
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class SlidingWindowCounterTests(TestCase):
+    def setUp(self):
+        self.conn = fakeredis.FakeStrictRedis()
+        # The script is registered once per process
+        patcher = mock.patch.object(counters, '_script', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(IP_TRACKING_VOLUME_THRESHOLD=3)
+    def test_volume_crossing_is_reported_once(self):
+        results = [counters.record_hit(self.conn, '203.0.113.5', '/api/x') for _ in range(5)]
+
+        self.assertEqual([total for total, _, _ in results], [1, 2, 3, 4, 5])
+        self.assertEqual([crossed for _, _, crossed in results], [0, 0, 0, counters.CROSSED_VOLUME, 0])
+
+    @override_settings(IP_TRACKING_SENSITIVE_THRESHOLD=2)
+    def test_sensitive_paths_are_counted_separately(self):
+        counters.record_hit(self.conn, '203.0.113.5', '/api/x')
+        counters.record_hit(self.conn, '203.0.113.5', '/admin/')
+        self.assertEqual(
+            list(counters.record_hit(self.conn, '203.0.113.5', '/admin')),
+            [3, 2, counters.CROSSED_SENSITIVE],
+        )
+
+    def test_read_window_returns_per_ip_features(self):
+        for path in ('/a', '/b', '/b', '/login'):
+            counters.record_hit(self.conn, '203.0.113.5', path)
+        counters.record_hit(self.conn, '198.51.100.7', '/a')
+
+        rows = {row['ip_address']: row for row in counters.read_window(self.conn)}
+
+        self.assertEqual(rows['203.0.113.5'], {
+            'ip_address': '203.0.113.5',
+            'request_count': 4,
+            'unique_paths': 3,
+            'sensitive_path_count': 1,
+            'sensitive_paths': ['/login'],
+        })
+        self.assertEqual(rows['198.51.100.7']['request_count'], 1)
+
+    def test_ips_that_left_the_window_are_pruned(self):
+        counters.record_hit(self.conn, '203.0.113.5', '/a')
+        later = time.time() + counters.window_seconds() + 2 * counters.BUCKET_SECONDS
+
+        self.assertEqual(counters.read_window(self.conn, now=later), [])
+        self.assertEqual(self.conn.zcard(counters.ACTIVE_KEY), 0)
+
+    def test_flag_crossing_flags_the_ip(self):
+        self.assertFalse(counters.flag_crossing('203.0.113.5', (3, 0, 0)))
+        self.assertTrue(counters.flag_crossing('203.0.113.5', (101, 0, counters.CROSSED_VOLUME)))
+
+        flagged = SuspiciousIP.objects.get(ip_address='203.0.113.5')
+        self.assertEqual(flagged.request_count, 101)
+        self.assertIn('High request volume', flagged.reason)
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+@override_settings(IP_TRACKING_REALTIME_COUNTERS=True)
+@mock.patch('apps.security.tasks.ML_AVAILABLE', False)
+@override_settings(IP_TRACKING_VOLUME_THRESHOLD=3)
+class DetectSuspiciousIPsTests(TestCase):
+    def setUp(self):
+        self.conn = fakeredis.FakeStrictRedis()
+        patcher = mock.patch('apps.security.log_stream.get_stream_connection', return_value=self.conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(counters, '_script', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ips_are_flagged_from_the_counters(self):
+        for _ in range(5):
+            counters.record_hit(self.conn, '203.0.113.5', '/a')
+
+        self.assertEqual(detect_suspicious_ips(), 'Flagged 1 suspicious IP(s)')
+        self.assertEqual(SuspiciousIP.objects.get().request_count, 5)
+
+    def test_an_empty_window_falls_back_to_request_log(self):
+        # e.g. Redis was just restarted: the counters know nothing yet
+        RequestLog.objects.bulk_create(
+            [RequestLog(ip_address='203.0.113.5', path='/a') for _ in range(4)]
+            + [RequestLog(ip_address='198.51.100.7', path='/a')]
+        )
+
+        self.assertEqual(detect_suspicious_ips(), 'Flagged 1 suspicious IP(s)')
+        flagged = SuspiciousIP.objects.get()
+        self.assertEqual((flagged.ip_address, flagged.request_count), ('203.0.113.5', 4))
+
+    def test_nothing_to_analyze(self):
+        self.assertEqual(detect_suspicious_ips(), 'No logs to analyze')
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.now = datetime(2024, 3, 10, 12, tzinfo=dt_timezone.utc)
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='203.0.113.5', path='/a', timestamp=self.now - timedelta(days=days))
+            for days in (40, 35, 31, 3, 0, 20, 45)
+        ])
+
+    def test_chunked_delete_only_removes_old_rows(self):
+        cutoff = self.now - timedelta(days=30)
+
+        self.assertEqual(partitioning.chunked_delete(cutoff, batch_size=2, sleep=0), 4)
+        self.assertEqual(RequestLog.objects.count(), 3)
+        self.assertFalse(RequestLog.objects.filter(timestamp__lt=cutoff).exists())
+
+    def test_nothing_to_delete(self):
+        self.assertEqual(partitioning.chunked_delete(self.now - timedelta(days=60), sleep=0), 0)
+
+    @skipIf(connection.vendor == 'postgresql', 'RequestLog may be partitioned')
+    def test_unpartitioned_backends_fall_back_to_chunked_deletes(self):
+        with self.settings(IP_TRACKING_CLEANUP_SLEEP=0):
+            self.assertEqual(partitioning.apply_retention(self.now - timedelta(days=30)), (0, 4))
+        self.assertEqual(partitioning.ensure_partitions(), 0)
+        with self.assertRaises(RuntimeError):
+            partitioning.convert_to_partitioned()
+
+    def test_partition_boundaries(self):
+        december = datetime(2023, 12, 31, 23, 59, tzinfo=dt_timezone.utc)
+        self.assertEqual(partitioning._floor(december, 'month'), datetime(2023, 12, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(
+            partitioning._next(partitioning._floor(december, 'month'), 'month'),
+            datetime(2024, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        self.assertEqual(partitioning.partition_name(self.now, 'day'), 'security_requestlog_p20240310')
+        self.assertEqual(partitioning.partition_name(self.now, 'month'), 'security_requestlog_p202403')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitioning requires PostgreSQL')
+class PartitionTests(TestCase):
+    def test_convert_ensure_and_drop(self):
+        now = datetime.now(dt_timezone.utc)
+        RequestLog.objects.create(ip_address='203.0.113.5', path='/a')
+        with connection.cursor() as cursor:
+            # Run the deferred FK checks now, as committing would: the legacy
+            # table cannot be dropped while it has pending trigger events
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        self.assertTrue(partitioning.convert_to_partitioned(interval='month', ahead=1))
+        self.assertTrue(partitioning.is_partitioned())
+        # Recorded at conversion, whatever the setting says
+        self.assertEqual(partitioning.partition_interval(), 'month')
+
+        # Beyond every range: lands in the default partition
+        future = partitioning._floor(now, 'month') + timedelta(days=400)
+        RequestLog.objects.create(ip_address='203.0.113.5', path='/b', timestamp=future)
+        self.assertEqual(partitioning.ensure_partitions(ahead=0, now=future), 1)
+        name = partitioning.partition_name(partitioning._floor(future, 'month'), 'month')
+        self.assertIn(name, [partition for partition, _ in partitioning.list_partitions()])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM "{name}"')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('SELECT COUNT(*) FROM "security_requestlog_default"')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+        cutoff = partitioning._next(partitioning._floor(now, 'month'), 'month')
+        self.assertEqual(partitioning.apply_retention(cutoff), (1, 0))
+        self.assertEqual(list(RequestLog.objects.values_list('path', flat=True)), ['/b'])
+
+
+@override_settings(IP_TRACKING_WATERMARK_GRACE=0, IP_TRACKING_GEOIP_MODE='inline')
+class RollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hour = datetime(2024, 3, 10, 12, tzinfo=dt_timezone.utc)
+
+    def log(self, ip='203.0.113.5', path='/a', minutes=0, **fields):
+        return RequestLog.objects.create(
+            ip_address=ip, path=path, timestamp=self.hour + timedelta(minutes=minutes), **fields
+        )
+
+    def test_logs_are_rolled_up_per_hour_and_dimension(self):
+        self.log(country='France')
+        self.log(path='/login', minutes=10, country='France')
+        self.log(ip='198.51.100.7', minutes=20, sample_weight=10)
+        self.log(minutes=70)
+
+        result = rollups.update_rollups()
+
+        self.assertEqual(result['rows'], {'ip': 3, 'path': 3, 'country': 3})
+        self.assertEqual(
+            HourlyIPTraffic.objects.get(hour=self.hour, ip_address='203.0.113.5').request_count, 2
+        )
+        self.assertEqual(
+            HourlyIPTraffic.objects.get(hour=self.hour, ip_address='203.0.113.5').sensitive_count, 1
+        )
+        # Sampled rows count for their weight
+        self.assertEqual(HourlyPathTraffic.objects.get(hour=self.hour, path='/a').request_count, 11)
+        self.assertEqual(
+            dict(HourlyCountryTraffic.objects.filter(hour=self.hour).values_list('country', 'request_count')),
+            {'France': 2, '': 10},
+        )
+
+    def test_new_logs_are_added_to_existing_rollups(self):
+        self.log()
+        rollups.update_rollups()
+        last = self.log(minutes=5)
+
+        result = rollups.update_rollups()
+
+        self.assertEqual(result['processed_up_to'], last.id)
+        self.assertEqual(HourlyIPTraffic.objects.get().request_count, 2)
+        # Nothing new: nothing is counted twice
+        rollups.update_rollups()
+        self.assertEqual(HourlyIPTraffic.objects.get().request_count, 2)
+
+    def test_small_batches_cover_every_row(self):
+        for minute in range(7):
+            self.log(minutes=minute)
+
+        rollups.update_rollups(batch_size=2, max_batches=10)
+
+        self.assertEqual(HourlyIPTraffic.objects.get().request_count, 7)
+
+    def test_a_running_update_is_not_repeated(self):
+        cache.add(rollups.LOCK_KEY, 1)
+        self.assertEqual(rollups.update_rollups(), {'skipped': True})
+
+    @override_settings(IP_TRACKING_WATERMARK_GRACE=60)
+    def test_recent_rows_wait_out_the_grace_period(self):
+        settled = [self.log(minutes=minute) for minute in range(3)]
+        RequestLog.objects.filter(id__in=[log.id for log in settled]).update(
+            logged_at=datetime.now(dt_timezone.utc) - timedelta(minutes=5)
+        )
+        # A concurrent writer may still commit ids below these
+        self.log(minutes=3)
+        self.log(minutes=4)
+
+        self.assertEqual(next_batch(0, 100), (settled[0].id, settled[-1].id))
+        result = rollups.update_rollups()
+
+        self.assertEqual(result['processed_up_to'], settled[-1].id)
+        self.assertEqual(HourlyIPTraffic.objects.get().request_count, 3)
+
+    @override_settings(IP_TRACKING_WATERMARK_GRACE=60)
+    def test_nothing_settled_yet(self):
+        self.log()
+        self.assertIsNone(next_batch(0, 100))
+
+    def test_batches_stop_at_the_limit(self):
+        logs = [self.log(minutes=minute) for minute in range(4)]
+
+        self.assertEqual(next_batch(0, 100, limit=logs[1].id), (logs[0].id, logs[1].id))
+        self.assertIsNone(next_batch(logs[1].id, 100, limit=logs[1].id))
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class TrafficAPITests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        self.client.force_login(get_user_model().objects.create_user('analyst@example.com', 'pw'))
+        hour = datetime(2024, 3, 10, 12, tzinfo=dt_timezone.utc)
+        HourlyIPTraffic.objects.create(hour=hour, ip_address='203.0.113.5', request_count=5)
+        HourlyIPTraffic.objects.create(hour=hour, ip_address='198.51.100.7', request_count=9)
+
+    def get(self, dimension='ip', **params):
+        return self.client.get(f'/api/security/traffic/{dimension}/', params)
+
+    def test_top_keys_over_the_range(self):
+        response = self.get(start='2024-03-10T00:00:00Z', end='2024-03-11T00:00:00Z')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['ip_address'], row['request_count']) for row in response.json()['results']],
+            [('198.51.100.7', 9), ('203.0.113.5', 5)],
+        )
+
+    def test_malformed_parameters_are_rejected(self):
+        for params in (
+            {'start': 'yesterday'},
+            # Well-formed but impossible
+            {'end': '2024-13-01T00:00:00'},
+            {'limit': 'many'},
+            {'key': 'not-an-ip'},
+        ):
+            with self.subTest(params=params):
+                response = self.get(**params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_unknown_dimension(self):
+        self.assertEqual(self.get('browser').status_code, 404)
+
+    def test_naive_datetimes_use_the_current_time_zone(self):
+        with timezone.override('Europe/Lisbon'), warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            # 13:00 in Lisbon (UTC+0 in March) excludes the 12:00 UTC hour
+            response = self.get(start='2024-03-10T13:00:00', end='2024-03-11T00:00:00')
+        self.assertEqual(response.json()['results'], [])
+
+        with timezone.override('America/New_York'):
+            # 08:00 in New York is 12:00 UTC
+            response = self.get(start='2024-03-10T08:00:00', end='2024-03-10T09:00:00', key='203.0.113.5')
+        self.assertEqual([row['request_count'] for row in response.json()['results']], [5])
+
+
+@override_settings(IP_TRACKING_REALTIME_COUNTERS=False)
+@mock.patch('apps.security.tasks.ML_AVAILABLE', False)
+class SuspiciousIPAggregationTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        self.since = datetime.now(dt_timezone.utc) - timedelta(hours=1)
+
+    def test_features_are_aggregated_per_ip(self):
+        detail = routes.intern_route('properties/<int:pk>/')
+        admin = routes.intern_route('admin/')
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='203.0.113.5', path='/properties/1/', route_id=detail),
+            RequestLog(ip_address='203.0.113.5', path='/properties/2/', route_id=detail, sample_weight=5),
+            RequestLog(ip_address='203.0.113.5', path='/admin/', route_id=admin),
+            RequestLog(ip_address='203.0.113.5', path='/login'),
+            RequestLog(ip_address='198.51.100.7', path='/properties/3/', route_id=detail),
+            # Outside the window
+            RequestLog(ip_address='203.0.113.5', path='/login', timestamp=self.since - timedelta(minutes=1)),
+        ])
+
+        rows = {row['ip_address']: row for row in _aggregate_features(self.since)}
+
+        self.assertEqual(rows['203.0.113.5'], {
+            'ip_address': '203.0.113.5',
+            'request_count': 8,
+            # Both detail pages are one route
+            'unique_paths': 3,
+            'sensitive_path_count': 2,
+            'sensitive_paths': ['/login', 'admin/'],
+        })
+        self.assertEqual(rows['198.51.100.7']['sensitive_paths'], [])
+
+    def test_flags_are_upserted_in_place(self):
+        SuspiciousIP.objects.create(ip_address='203.0.113.5', reason='old', request_count=1)
+
+        _upsert_suspicious({'203.0.113.5': ('new', 50), '198.51.100.7': ('other', 20)})
+
+        self.assertEqual(SuspiciousIP.objects.count(), 2)
+        flagged = SuspiciousIP.objects.get(ip_address='203.0.113.5')
+        self.assertEqual((flagged.reason, flagged.request_count), ('new', 50))
+
+    @override_settings(IP_TRACKING_VOLUME_THRESHOLD=2)
+    def test_detection_runs_a_fixed_number_of_queries(self):
+        RequestLog.objects.bulk_create(
+            [RequestLog(ip_address=f'203.0.113.{i}', path='/a') for i in range(20) for _ in range(3)]
+        )
+
+        # Sensitive route ids, the aggregation, the upsert
+        with self.assertNumQueries(3):
+            self.assertEqual(detect_suspicious_ips(), 'Flagged 20 suspicious IP(s)')
+        self.assertEqual(SuspiciousIP.objects.count(), 20)
+
+
+@skipUnless(anomaly.ML_AVAILABLE, 'scikit-learn is not installed')
+class AnomalyModelTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, model_dir)
+        self.model_dir = model_dir
+        patcher = override_settings(IP_TRACKING_MODEL_DIR=model_dir)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.now = datetime.now(dt_timezone.utc)
+
+    def log(self, ip, path, seconds, method='GET', **fields):
+        return RequestLog(
+            ip_address=ip, path=path, method=method,
+            timestamp=self.now - timedelta(minutes=5) + timedelta(seconds=seconds), **fields
+        )
+
+    def test_features_per_ip(self):
+        RequestLog.objects.bulk_create([
+            self.log('203.0.113.5', '/a', 0),
+            self.log('203.0.113.5', '/a', 10),
+            self.log('203.0.113.5', '/b', 30),
+            self.log('203.0.113.5', '/login', 40, method='POST'),
+            self.log('198.51.100.7', '/a', 0, method='DELETE', sample_weight=3),
+        ])
+
+        ips, X = anomaly.extract_features(self.now - timedelta(hours=1))
+        features = {ip: dict(zip(anomaly.FEATURE_NAMES, row)) for ip, row in zip(ips, X)}
+
+        first = features['203.0.113.5']
+        self.assertEqual(
+            [first[name] for name in ('request_count', 'unique_paths', 'sensitive_path_count')],
+            [4, 3, 1],
+        )
+        self.assertEqual(
+            [first[name] for name in ('get_ratio', 'post_ratio', 'other_method_ratio')],
+            [0.75, 0.25, 0.0],
+        )
+        self.assertAlmostEqual(first['interarrival_mean'], 40 / 3)
+        self.assertAlmostEqual(first['interarrival_std'], (200 / 9) ** 0.5)
+        self.assertAlmostEqual(first['path_entropy'], 1.5)
+        # A sampled row counts for its weight
+        self.assertEqual(features['198.51.100.7']['request_count'], 3)
+        self.assertEqual(features['198.51.100.7']['other_method_ratio'], 1.0)
+
+    def test_no_traffic(self):
+        ips, X = anomaly.extract_features(self.now - timedelta(hours=1))
+        self.assertEqual((ips, X.shape), ([], (0, len(anomaly.FEATURE_NAMES))))
+        self.assertIsNone(anomaly.train_model(hours=1))
+        self.assertIsNone(anomaly.score_recent())
+
+    def test_models_are_versioned_and_score_recent_traffic(self):
+        logs = [
+            self.log(f'10.0.{i}.1', path, offset)
+            for i in range(40) for offset, path in ((0, '/a'), (30, '/b'))
+        ]
+        logs += [self.log('203.0.113.66', '/admin', offset) for offset in range(200)]
+        RequestLog.objects.bulk_create(logs)
+
+        first = anomaly.train_model(hours=1)
+        second = anomaly.train_model(hours=1)
+
+        self.assertEqual((first['version'], second['version']), (1, 2))
+        self.assertEqual(anomaly.load_latest_model()['version'], 2)
+        flagged = anomaly.score_recent()
+        self.assertIn('203.0.113.66', flagged)
+        self.assertEqual(flagged['203.0.113.66'][1], 200)
+
+    def test_models_with_other_features_are_ignored(self):
+        import joblib
+
+        joblib.dump({'features': ['request_count']}, os.path.join(self.model_dir, 'anomaly-v1.joblib'))
+
+        self.assertIsNone(anomaly.load_latest_model())
+
+
+class RouteInterningTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        self.sink = RecordingSink()
+        patcher = mock.patch('apps.security.middleware.get_sinks', return_value=[self.sink])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_routes_are_interned_once(self):
+        route_id = routes.intern_route('api/security/traffic/<str:dimension>/', 'security:api_traffic')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(routes.intern_route('api/security/traffic/<str:dimension>/'), route_id)
+        self.assertEqual(routes.cached_route_name(route_id), 'api/security/traffic/<str:dimension>/')
+        self.assertFalse(RequestRoute.objects.get(pk=route_id).is_sensitive)
+        self.assertTrue(RequestRoute.objects.get(pk=routes.intern_route('api/login/')).is_sensitive)
+
+    def test_paths_resolve_to_their_route(self):
+        self.assertEqual(routes.resolve_route('/api/security/traffic/ip/'), 'api/security/traffic/<str:dimension>/')
+        self.assertIsNone(routes.resolve_route('/no/such/page/'))
+
+    @override_settings(IP_TRACKING_ROUTE_CACHE_SIZE=1)
+    def test_route_cache_is_sized_when_first_used(self):
+        with mock.patch.object(routes, '_cached_resolve', None):
+            routes.resolve_route('/api/security/traffic/ip/')
+            routes.resolve_route('/api/security/traffic/browser/')
+
+            info = routes._cached_resolve.cache_info()
+        self.assertEqual((info.maxsize, info.currsize), (1, 1))
+
+    @override_settings(RATE_LIMIT_ENABLED=False, IP_TRACKING_STORE_RAW_PATH=False)
+    def test_resolved_requests_are_logged_by_route_only(self):
+        self.client.get('/api/security/traffic/ip/')
+        self.client.get('/no/such/page/')
+
+        resolved, unresolved = self.sink.records
+        self.assertEqual(routes.cached_route_name(resolved['route_id']), 'api/security/traffic/<str:dimension>/')
+        self.assertEqual(resolved['path'], '')
+        self.assertEqual((unresolved['route_id'], unresolved['path']), (None, '/no/such/page/'))
+
+    @override_settings(RATE_LIMIT_ENABLED=False, IP_TRACKING_STORE_RAW_PATH=True)
+    def test_raw_paths_can_be_kept(self):
+        self.client.get('/api/security/traffic/ip/')
+
+        [record] = self.sink.records
+        self.assertIsNotNone(record['route_id'])
+        self.assertEqual(record['path'], '/api/security/traffic/ip/')
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class RequestLogAPITests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        # Keep the API's own requests out of the logs it returns
+        patcher = mock.patch('apps.security.middleware.get_sinks', return_value=[RecordingSink()])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(get_user_model().objects.create_user('analyst@example.com', 'pw'))
+
+        traffic = routes.intern_route('api/security/traffic/<str:dimension>/')
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='203.0.113.5', route_id=traffic, path='/api/security/traffic/ip/'),
+            RequestLog(ip_address='203.0.113.5', route_id=traffic, path=''),
+            RequestLog(ip_address='203.0.113.5', path='/no/such/page/'),
+        ])
+
+    def paths(self, **params):
+        response = self.client.get('/api/security/logs/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['path'] for row in response.json()['results'])
+
+    @override_settings(IP_TRACKING_STORE_RAW_PATH=False)
+    def test_a_resolvable_path_matches_its_route(self):
+        self.assertEqual(self.paths(path='/api/security/traffic/country/'), ['', '/api/security/traffic/ip/'])
+        self.assertEqual(self.paths(path='/no/such/page/'), ['/no/such/page/'])
+
+    @override_settings(IP_TRACKING_STORE_RAW_PATH=True)
+    def test_raw_paths_are_matched_exactly(self):
+        self.assertEqual(self.paths(path='/api/security/traffic/ip/'), ['/api/security/traffic/ip/'])
+        self.assertEqual(self.paths(path='/api/security/traffic/country/'), [])
+
+    def test_filter_by_route(self):
+        self.assertEqual(
+            self.paths(route='api/security/traffic/<str:dimension>/'),
+            ['', '/api/security/traffic/ip/'],
+        )
+
+    def test_filter_by_ip(self):
+        self.assertEqual(len(self.paths(ip='203.0.113.5')), 3)
+        self.assertEqual(self.paths(ip='198.51.100.7'), [])
+
+    def test_malformed_filters_are_rejected(self):
+        for url in ('/api/security/logs/', '/api/security/suspicious/', '/api/security/blocked/'):
+            for params in ({'ip': 'not-an-ip'}, {'ip': '203.0.113.0/24'}, {'start': 'yesterday'}):
+                with self.subTest(url=url, params=params):
+                    response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('error', response.json())
+
+
+class SamplingPolicyTests(TestCase):
+    def weight(self, policy, route='properties/', path='/properties/', method='GET', status_code=200, **kwargs):
+        return policy.weight('203.0.113.5', route, path, method, status_code, **kwargs)
+
+    def test_everything_is_logged_by_default(self):
+        policy = SamplingPolicy()
+        self.assertFalse(policy.enabled)
+        self.assertEqual(self.weight(policy), 1)
+
+    def test_rates_become_integer_weights(self):
+        policy = SamplingPolicy({'default_rate': 0.3, 'routes': {'/properties/': 0.1, 'health/': 0}})
+
+        with mock.patch('apps.security.sampling.random.random', return_value=0.05):
+            self.assertEqual(self.weight(policy), 10)
+            self.assertEqual(self.weight(policy, route='other/', path='/other/'), 3)
+        with mock.patch('apps.security.sampling.random.random', return_value=0.5):
+            self.assertEqual(self.weight(policy), 0)
+        self.assertEqual(self.weight(policy, route='health/', path='/health/'), 0)
+
+    def test_some_requests_are_always_logged(self):
+        policy = SamplingPolicy({'default_rate': 0})
+
+        self.assertEqual(self.weight(policy), 0)
+        self.assertEqual(self.weight(policy, blocked=True), 1)
+        self.assertEqual(self.weight(policy, status_code=500), 1)
+        self.assertEqual(self.weight(policy, method='POST', authenticated=True), 1)
+        self.assertEqual(self.weight(policy, method='POST'), 0)
+        self.assertEqual(self.weight(policy, route='admin/', path='/admin/'), 1)
+
+    def test_always_log_rules_can_be_switched_off(self):
+        policy = SamplingPolicy({'default_rate': 0, 'always_log': {'errors': False}})
+
+        self.assertEqual(self.weight(policy, status_code=500), 0)
+        self.assertEqual(self.weight(policy, blocked=True), 1)
+
+    def test_every_ip_gets_a_minimum_of_logged_requests(self):
+        policy = SamplingPolicy({'default_rate': 0, 'per_ip_minimum': 2, 'max_tracked_ips': 2})
+
+        self.assertEqual([self.weight(policy) for _ in range(3)], [1, 1, 0])
+        self.assertEqual(policy.weight('198.51.100.7', 'properties/', '/properties/', 'GET', 200), 1)
+        # Beyond max_tracked_ips new IPs are simply sampled
+        self.assertEqual(policy.weight('198.51.100.8', 'properties/', '/properties/', 'GET', 200), 0)
+
+
+@override_settings(RATE_LIMIT_ENABLED=False)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        patcher = mock.patch('apps.security.middleware.get_sinks', return_value=[RecordingSink()])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(get_user_model().objects.create_user('analyst@example.com', 'pw'))
+
+        self.start = datetime(2024, 3, 10, 12, tzinfo=dt_timezone.utc)
+        # Pairs of rows share a timestamp: only the id tells them apart
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='203.0.113.5', path='/a', timestamp=self.start + timedelta(seconds=i // 2))
+            for i in range(7)
+        ])
+        self.expected = list(RequestLog.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+
+    def get(self, url='/api/security/logs/', **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, page):
+        ids = [row['id'] for row in page['results']]
+        while page['next']:
+            page = self.get(page['next'])
+            ids += [row['id'] for row in page['results']]
+        return ids
+
+    def test_pages_cover_every_row_once_in_order(self):
+        first = self.get(page_size=3)
+
+        self.assertEqual((first['count'], first['count_is_estimate'], first['previous']), (7, False, None))
+        self.assertEqual(self.walk(first), self.expected)
+
+    def test_new_rows_do_not_shift_later_pages(self):
+        first = self.get(page_size=3)
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='203.0.113.5', path='/a', timestamp=self.start + timedelta(hours=1))
+            for _ in range(2)
+        ])
+
+        self.assertEqual(self.walk(first), self.expected)
+
+    def test_previous_returns_the_same_page(self):
+        first = self.get(page_size=3)
+        second = self.get(first['next'])
+
+        previous = self.get(second['previous'])
+
+        self.assertEqual([row['id'] for row in previous['results']], self.expected[:3])
+        self.assertEqual([row['id'] for row in second['results']], self.expected[3:6])
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursor in ('garbage', 'bmV4dHxub3QtYS1kYXRlfDE='):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/api/security/logs/', {'cursor': cursor}).status_code, 404)
+
+    def test_legacy_page_numbers_still_work(self):
+        page = self.get(page=1)
+        self.assertEqual(page['count'], 7)
+        self.assertEqual([row['id'] for row in page['results']], self.expected)
+
+
+class BlocklistImportTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+
+    def test_entries_are_normalized(self):
+        self.assertEqual(parse_entry('203.0.113.7'), ('203.0.113.7', None))
+        self.assertEqual(parse_entry('203.0.113.7/32'), ('203.0.113.7', None))
+        self.assertEqual(parse_entry('198.51.100.77/24'), ('198.51.100.0', 24))
+        self.assertEqual(parse_entry('2001:DB8::1'), ('2001:db8::1', None))
+        with self.assertRaises(ValueError):
+            parse_entry('203.0.113.300')
+
+    def test_the_model_normalizes_ranges_on_clean(self):
+        blocked = BlockedIP(ip_address='10.1.2.3', prefix_length=8)
+        blocked.clean()
+        self.assertEqual((blocked.ip_address, blocked.prefix_length), ('10.0.0.0', 8))
+
+    def test_plain_text_feeds(self):
+        entries, skipped = parse_entries([
+            '; Spamhaus DROP List',
+            '198.51.100.0/24 ; SBL123',
+            '203.0.113.7  # scanner',
+            'not-an-ip',
+            '',
+        ])
+        self.assertEqual(entries, [('198.51.100.0', 24, 'SBL123'), ('203.0.113.7', None, 'scanner')])
+        self.assertEqual(skipped, 1)
+
+    def test_csv_feeds_with_a_header(self):
+        entries, skipped = parse_entries([
+            'first_seen,ip,description',
+            '2024-03-10,203.0.113.7,Botnet C2',
+            '2024-03-10,bogus,Botnet C2',
+            '2024-03-11,2001:db8::/32,Scanner',
+        ])
+        self.assertEqual(entries, [('203.0.113.7', None, 'Botnet C2'), ('2001:db8::', 32, 'Scanner')])
+        self.assertEqual(skipped, 1)
+
+    def test_bulk_block_skips_duplicates_and_existing_entries(self):
+        BlockedIP.objects.create(ip_address='203.0.113.7', reason='original')
+
+        created = bulk_block([
+            ('203.0.113.7', None, 'again'),
+            ('198.51.100.0', 24, ''),
+            ('198.51.100.0', 24, 'duplicate'),
+            # Same address, different prefix: a separate entry
+            ('198.51.100.0', None, ''),
+        ], reason='feed')
+
+        self.assertEqual(created, 2)
+        self.assertEqual(BlockedIP.objects.get(ip_address='203.0.113.7').reason, 'original')
+        self.assertEqual(BlockedIP.objects.get(ip_address='198.51.100.0', prefix_length=24).reason, 'feed')
+        self.assertTrue(get_blocklist().is_blocked('198.51.100.200'))
+
+    def test_bulk_block_counts_only_its_own_rows(self):
+        insert = BlockedIP.objects.bulk_create
+        others = iter(['192.0.2.1', '192.0.2.2'])
+
+        def with_concurrent_writer(*args, **kwargs):
+            BlockedIP.objects.create(ip_address=next(others), reason='another import')
+            return insert(*args, **kwargs)
+
+        with mock.patch.object(BlockedIP.objects, 'bulk_create', side_effect=with_concurrent_writer):
+            created = bulk_block([('198.51.100.0', 24, ''), ('203.0.113.7', None, '')], batch_size=1)
+
+        self.assertEqual(created, 2)
+        self.assertEqual(BlockedIP.objects.count(), 4)
+
+    def call(self, *args):
+        out = io.StringIO()
+        call_command('block_ip', *args, stdout=out)
+        return out.getvalue()
+
+    def test_block_ip_stores_host_prefixes_as_addresses(self):
+        self.assertIn('Successfully blocked', self.call('203.0.113.7/32', '--reason', 'Brute force'))
+        self.assertIn('already blocked', self.call('203.0.113.7'))
+
+        blocked = BlockedIP.objects.get()
+        self.assertEqual((blocked.ip_address, blocked.prefix_length, blocked.reason), ('203.0.113.7', None, 'Brute force'))
+
+    def test_block_ip_imports_and_exports_files(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        feed = os.path.join(directory, 'feed.txt')
+        with open(feed, 'w') as f:
+            f.write('198.51.100.0/24 ; SBL123\n203.0.113.7\ngarbage\n')
+
+        output = self.call('--file', feed)
+        self.assertIn('Blocked 2 new', output)
+        self.assertIn('1 unparseable lines skipped', output)
+
+        export = os.path.join(directory, 'export.csv')
+        self.call('--export', export)
+        with open(export) as f:
+            rows = [line.split(',')[:2] for line in f.read().splitlines()]
+        self.assertEqual(rows, [
+            ['cidr', 'reason'],
+            ['198.51.100.0/24', 'SBL123'],
+            ['203.0.113.7', 'Imported via management command'],
+        ])
+
+        # '-' writes to the command's own stdout
+        rows = [line.split(',')[:2] for line in self.call('--export', '-').splitlines()]
+        self.assertEqual(rows[1], ['198.51.100.0/24', 'SBL123'])
+
+
+class RateLimitPolicyTests(TestCase):
+    def setUp(self):
+        self.limiter = rate_limits.RateLimiter(settings.RATE_LIMIT_POLICIES)
+
+    def policy(self, path, method='GET'):
+        policy = self.limiter.policy_for(routes.resolve_route(path), method)
+        return policy and policy.name
+
+    def test_rates(self):
+        self.assertEqual(rate_limits.parse_rate('10/m'), (10, 60))
+        self.assertEqual(rate_limits.parse_rate('100/5m'), (100, 300))
+        self.assertEqual(rate_limits.parse_rate('3'), (3, 1))
+        self.assertIsNone(rate_limits.parse_rate(None))
+
+    def test_writes_are_matched_under_both_property_mounts(self):
+        for path in (
+            '/properties/api/properties/',
+            '/api/properties/api/properties/',
+            '/properties/api/properties/5/add_review/',
+            '/api/properties/api/properties/5/add_review/',
+            '/properties/api/reviews/',
+            '/properties/api/5/add-review/',
+            '/api/travel/bookings/',
+        ):
+            with self.subTest(path=path):
+                self.assertEqual(self.policy(path, 'POST'), 'writes')
+        # Reads fall through to the general API policy
+        self.assertEqual(self.policy('/properties/api/properties/'), 'api')
+        self.assertEqual(self.policy('/graphql/graphql/', 'POST'), 'api')
+        self.assertEqual(self.policy('/api/crm/graphql/', 'POST'), 'api')
+
+    def test_security_and_auth_endpoints(self):
+        self.assertEqual(self.policy('/api/security/login/', 'POST'), 'security-login')
+        self.assertEqual(self.policy('/api/security/logs/'), 'security-logs')
+        self.assertEqual(self.policy('/api/security/traffic/ip/'), 'security-traffic')
+        self.assertEqual(self.policy('/api/messaging/register/', 'POST'), 'auth')
+        self.assertEqual(self.policy('/api/token/', 'POST'), 'auth')
+
+    def test_pages_outside_every_policy(self):
+        self.assertIsNone(self.policy('/'))
+        self.assertIsNone(self.policy('/no/such/page/'))
+
+    def test_roles(self):
+        policy = rate_limits.Policy({
+            'name': 'p', 'prefix': '/api/', 'rate': {'anonymous': '5/m', 'authenticated': '30/m'},
+        })
+        self.assertTrue(policy.matches_route('api/x/'))
+        self.assertEqual(policy.limits['anonymous'], (5, 60, 5 / 60, 5))
+        # Staff default to the authenticated rate
+        self.assertEqual(policy.limits['staff'], policy.limits['authenticated'])
+        self.assertEqual(policy.header('authenticated'), '30;w=60;burst=30')
+
+    def test_identities(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        user = get_user_model().objects.create_user('guest@example.com', 'pw')
+        shared = rate_limits.Policy({'name': 'p', 'rate': '5/m'})
+        per_ip = rate_limits.Policy({'name': 'p', 'rate': '5/m', 'key': 'ip'})
+        anonymous = SimpleNamespace(META={})
+        bearer = SimpleNamespace(META={'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'})
+
+        self.assertEqual(rate_limits.identify(anonymous, shared, '203.0.113.5'), ('anonymous', 'ip:203.0.113.5'))
+        self.assertEqual(rate_limits.identify(anonymous, shared, '203.0.113.5', user), ('authenticated', f'u:{user.pk}'))
+        self.assertEqual(rate_limits.identify(bearer, shared, '203.0.113.5'), ('authenticated', f'u:{user.pk}'))
+        self.assertEqual(rate_limits.identify(bearer, per_ip, '203.0.113.5'), ('authenticated', 'ip:203.0.113.5'))
+
+    def test_staff_role_for_session_and_jwt_users(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        cache.clear()
+        staff = get_user_model().objects.create_user('admin@example.com', 'pw', is_staff=True)
+        policy = rate_limits.Policy({'name': 'p', 'rate': '5/m'})
+        bearer = SimpleNamespace(META={'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(staff)}'})
+
+        self.assertEqual(rate_limits.identify(bearer, policy, '203.0.113.5', staff), ('staff', f'u:{staff.pk}'))
+        self.assertEqual(rate_limits.identify(bearer, policy, '203.0.113.5'), ('staff', f'u:{staff.user_id}'))
+        self.assertEqual(
+            async_to_sync(rate_limits.aidentify)(bearer, policy, '203.0.113.5'), ('staff', f'u:{staff.user_id}'),
+        )
+        # The flag is cached between lookups
+        get_user_model().objects.filter(pk=staff.pk).update(is_staff=False)
+        with self.assertNumQueries(0):
+            self.assertEqual(rate_limits.identify(bearer, policy, '203.0.113.5')[0], 'staff')
+        cache.clear()
+        self.assertEqual(rate_limits.identify(bearer, policy, '203.0.113.5')[0], 'authenticated')
+
+
+class TokenBucketTests(TestCase):
+    def test_local_buckets_refill_over_time(self):
+        buckets = rate_limits.LocalBuckets()
+
+        self.assertEqual([buckets.take('k', 1.0, 2, now=100.0)[0] for _ in range(3)], [1, 1, 0])
+        allowed, remaining, retry_after, _ = buckets.take('k', 1.0, 2, now=100.5)
+        self.assertEqual((allowed, remaining, retry_after), (0, 0, 0.5))
+        self.assertEqual(buckets.take('k', 1.0, 2, now=101.0)[0], 1)
+
+    def test_eviction_uses_each_buckets_own_policy(self):
+        buckets = rate_limits.LocalBuckets(max_size=2)
+        # A slow bucket that is still refilling and a fast one that is full again
+        buckets.take('slow', 0.01, 10, now=100.0)
+        buckets.take('fast', 100.0, 10, now=100.0)
+
+        buckets.take('new', 100.0, 10, now=101.0)
+
+        self.assertEqual(set(buckets._buckets), {'slow', 'new'})
+        self.assertEqual(buckets.take('slow', 0.01, 10, now=101.0)[1], 8)
+
+    @skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_redis_buckets_use_the_server_clock(self):
+        conn = fakeredis.FakeStrictRedis()
+        limiter = rate_limits.RateLimiter([{'name': 'p', 'rate': {'anonymous': '2/m', 'staff': None}}])
+        policy = limiter.policies[0]
+
+        with mock.patch('apps.security.log_stream.get_stream_connection', return_value=conn):
+            decisions = [limiter.check(policy, 'anonymous', 'ip:203.0.113.5') for _ in range(3)]
+            self.assertIsNone(limiter.check(policy, 'staff', 'u:1'))
+
+        self.assertEqual([decision.allowed for decision in decisions], [True, True, False])
+        self.assertEqual(decisions[-1].retry_after, 30)
+        self.assertTrue(conn.exists(f'{rate_limits.KEY_PREFIX}:p:ip:203.0.113.5'))
+
+
+@override_settings(
+    RATE_LIMIT_ENABLED=True,
+    RATE_LIMIT_POLICIES=[{'name': 'home', 'routes': ['api/security/'], 'rate': '2/m', 'key': 'ip'}],
+)
+class RateLimitMiddlewareTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        patcher = mock.patch.object(rate_limits, '_limiter', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_over_the_limit_get_429(self):
+        responses = [self.client.get('/api/security/') for _ in range(3)]
+
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429])
+        self.assertEqual(responses[0]['RateLimit-Remaining'], '1')
+        self.assertEqual(responses[0]['RateLimit-Policy'], '2;w=60;burst=2')
+        self.assertEqual(responses[2]['Retry-After'], '30')
+        # Other clients have their own bucket
+        self.assertEqual(self.client.get('/api/security/', REMOTE_ADDR='203.0.113.9').status_code, 200)
+        # Unlisted routes are not limited
+        self.assertNotIn('RateLimit-Limit', self.client.get('/api/security/login/'))
+
+
+class FakeGeoIPService:
+    def __init__(self, locations):
+        self.locations = locations
+        self.lookups = []
+
+    def locate_many(self, ips):
+        ips = set(ips)
+        self.lookups.extend(ips)
+        return {ip: self.locations.get(ip, (None, None)) for ip in ips}
+
+
+@override_settings(IP_TRACKING_GEOIP_MODE='deferred', IP_TRACKING_WATERMARK_GRACE=0)
+class EnrichmentTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        self.service = FakeGeoIPService({'203.0.113.5': ('France', 'Paris')})
+        patcher = mock.patch('apps.security.enrichment.get_geoip_service', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def logs(self, *ips):
+        RequestLog.objects.bulk_create([RequestLog(ip_address=ip, path='/a') for ip in ips])
+        return list(RequestLog.objects.order_by('id').values_list('id', flat=True))
+
+    def test_each_ip_is_looked_up_once_per_batch(self):
+        ids = self.logs('203.0.113.5', '203.0.113.5', '198.51.100.7', '203.0.113.5')
+
+        result = enrichment.enrich_logs()
+
+        self.assertEqual(result, {'processed_up_to': ids[-1], 'updated': 3, 'unique_ips': 2})
+        self.assertEqual(sorted(self.service.lookups), ['198.51.100.7', '203.0.113.5'])
+        self.assertEqual(
+            list(RequestLog.objects.order_by('id').values_list('country', flat=True)),
+            ['France', 'France', None, 'France'],
+        )
+        self.assertEqual(enrichment.enriched_up_to(), ids[-1])
+
+    def test_the_first_run_starts_at_the_rollup_watermark(self):
+        ids = self.logs('203.0.113.5', '203.0.113.5', '203.0.113.5')
+        RollupWatermark.objects.create(name=rollups.WATERMARK_NAME, last_id=ids[1])
+
+        self.assertEqual(enrichment.enrich_logs()['updated'], 1)
+        self.assertEqual(RequestLog.objects.filter(country='France').get().id, ids[2])
+
+    @override_settings(IP_TRACKING_WATERMARK_GRACE=60)
+    def test_recent_rows_wait_out_the_grace_period(self):
+        self.logs('203.0.113.5')
+
+        self.assertEqual(enrichment.enrich_logs(), {'processed_up_to': 0, 'updated': 0, 'unique_ips': 0})
+
+    def test_rollups_wait_for_enrichment(self):
+        ids = self.logs('203.0.113.5', '203.0.113.5')
+        RollupWatermark.objects.create(name=enrichment.WATERMARK_NAME, last_id=ids[0])
+
+        self.assertEqual(rollups.update_rollups()['processed_up_to'], ids[0])
+        enrichment.enrich_logs()
+        self.assertEqual(rollups.update_rollups()['processed_up_to'], ids[1])
+        self.assertEqual(HourlyCountryTraffic.objects.get(country='France').request_count, 1)
+
+    @override_settings(RATE_LIMIT_ENABLED=False, IP_TRACKING_REALTIME_COUNTERS=False)
+    def test_the_middleware_skips_geolocation(self):
+        sink = RecordingSink()
+        with mock.patch('apps.security.middleware.get_sinks', return_value=[sink]), \
+                mock.patch('apps.security.middleware.get_geoip_service') as geoip:
+            self.client.get('/api/security/')
+
+        geoip.assert_not_called()
+        self.assertEqual((sink.records[0]['country'], sink.records[0]['city']), (None, None))
+
+
+@override_settings(IP_TRACKING_WATERMARK_GRACE=0)
+class ExportTests(TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+        self.day = datetime(2024, 3, 10, 12, tzinfo=dt_timezone.utc)
+
+    def logs(self, count, day=0):
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='203.0.113.5', path=f'/{i}', timestamp=self.day + timedelta(days=day, minutes=i))
+            for i in range(count)
+        ])
+
+    def read_csv(self):
+        rows = []
+        for path in sorted(glob.glob(os.path.join(self.output, 'date=*', '*.csv.gz'))):
+            with gzip.open(path, 'rt', newline='') as f:
+                reader = csv.reader(f)
+                self.assertEqual(next(reader), export.COLUMNS)
+                rows += [(os.path.basename(os.path.dirname(path)), row) for row in reader]
+        return rows
+
+    def test_rows_are_partitioned_by_day(self):
+        self.logs(3)
+        self.logs(2, day=1)
+        last_id = RequestLog.objects.latest('id').id
+
+        self.assertEqual(export.export_logs(self.output, fmt='csv'), (5, last_id))
+
+        rows = self.read_csv()
+        self.assertEqual([day for day, _ in rows], ['date=2024-03-10'] * 3 + ['date=2024-03-11'] * 2)
+        self.assertEqual(rows[0][1][export.COLUMNS.index('path')], '/0')
+        self.assertEqual(export.read_watermark(self.output), last_id)
+
+    def test_later_runs_resume_from_the_watermark(self):
+        self.logs(3)
+        export.export_logs(self.output, fmt='csv')
+        self.logs(2)
+
+        self.assertEqual(export.export_logs(self.output, fmt='csv')[0], 2)
+        self.assertEqual(export.export_logs(self.output, fmt='csv')[0], 0)
+        self.assertEqual(len(self.read_csv()), 5)
+
+    def test_an_interrupted_export_resumes_from_its_last_checkpoint(self):
+        self.logs(5)
+
+        def interrupt(rows, last_id):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            export.export_logs(self.output, fmt='csv', checkpoint_rows=2, progress=interrupt)
+        self.assertEqual(export.read_watermark(self.output), RequestLog.objects.order_by('id')[1].id)
+        self.assertEqual(glob.glob(os.path.join(self.output, '*', '*.tmp')), [])
+
+        self.assertEqual(export.export_logs(self.output, fmt='csv', checkpoint_rows=2)[0], 3)
+        # Every row exactly once
+        path = export.COLUMNS.index('path')
+        self.assertEqual(sorted(row[path] for _, row in self.read_csv()), [f'/{i}' for i in range(5)])
+
+    @override_settings(IP_TRACKING_WATERMARK_GRACE=60)
+    def test_unsettled_rows_wait_for_the_next_run(self):
+        self.logs(2)
+        RequestLog.objects.update(logged_at=datetime.now(dt_timezone.utc) - timedelta(minutes=5))
+        settled = RequestLog.objects.latest('id').id
+        # Committed late: lower ids may still be on their way
+        self.logs(1)
+
+        self.assertEqual(export.export_logs(self.output, fmt='csv'), (2, settled))
+
+        RequestLog.objects.update(logged_at=datetime.now(dt_timezone.utc) - timedelta(minutes=5))
+        self.assertEqual(export.export_logs(self.output, fmt='csv')[0], 1)
+
+    def test_the_range_is_part_of_the_watermark(self):
+        self.logs(3)
+        self.logs(2, day=1)
+        since = self.day + timedelta(days=1)
+
+        self.assertEqual(export.export_logs(self.output, fmt='csv', since=since)[0], 2)
+        self.assertEqual(export.read_state(self.output)['since'], since.isoformat())
+        with self.assertRaisesMessage(ValueError, 'new output directory'):
+            export.export_logs(self.output, fmt='csv', since=self.day)
+        with self.assertRaisesMessage(ValueError, 'new output directory'):
+            export.export_logs(self.output, fmt='csv')
+
+        self.logs(1, day=2)
+        self.assertEqual(export.export_logs(self.output, fmt='csv', since=since)[0], 1)
+        with self.assertRaisesMessage(CommandError, 'new output directory'):
+            call_command('export_request_logs', '--output', self.output, '--format', 'csv', stdout=io.StringIO())
+
+    @skipUnless(export.PARQUET_AVAILABLE, 'pyarrow is not installed')
+    def test_parquet_output(self):
+        import pyarrow.parquet as pq
+
+        user = get_user_model().objects.create_user('guest@example.com', 'pw')
+        self.logs(2)
+        RequestLog.objects.update(user=user)
+
+        export.export_logs(self.output)
+
+        [path] = glob.glob(os.path.join(self.output, 'date=2024-03-10', '*.parquet'))
+        table = pq.read_table(path)
+        self.assertEqual(table.column_names, export.COLUMNS)
+        self.assertEqual(table.column('user_id').to_pylist(), [str(user.pk)] * 2)
+
+    def test_the_command_rejects_bad_dates(self):
+        with self.assertRaisesMessage(CommandError, 'yesterday'):
+            call_command('export_request_logs', '--output', self.output, '--format', 'csv', '--since', 'yesterday')
+
+
+@override_settings(RATE_LIMIT_ENABLED=False, IP_TRACKING_REALTIME_COUNTERS=False)
+class ResponseMetricsTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        self.sink = RecordingSink()
+        patcher = mock.patch('apps.security.middleware.get_sinks', return_value=[self.sink])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_query_timer_counts_every_query(self):
+        with QueryTimer() as timer:
+            list(RequestLog.objects.all())
+            BlockedIP.objects.count()
+        RequestLog.objects.count()
+
+        self.assertEqual(timer.count, 2)
+        self.assertGreater(timer.elapsed, 0)
+
+    def test_responses_are_measured(self):
+        self.client.force_login(get_user_model().objects.create_user('analyst@example.com', 'pw'))
+        self.sink.records.clear()
+
+        response = self.client.get('/api/security/logs/')
+
+        [record] = self.sink.records
+        self.assertEqual(record['status_code'], 200)
+        self.assertEqual(record['response_bytes'], len(response.content))
+        self.assertGreater(record['duration_us'], 0)
+        # At least the session, the user and the page itself
+        self.assertGreaterEqual(record['db_queries'], 3)
+        self.assertIsNotNone(record['db_time_us'])
+
+    def test_errors_are_recorded_with_their_status(self):
+        self.client.get('/no/such/page/')
+
+        self.assertEqual(self.sink.records[0]['status_code'], 404)
+
+    def test_database_usage_is_not_measured_on_the_async_path(self):
+        async_to_sync(self.async_client.get)('/api/security/')
+
+        [record] = self.sink.records
+        self.assertEqual(record['status_code'], 200)
+        self.assertIsNone(record['db_queries'])
+        self.assertIsNotNone(record['duration_us'])
+
+
+class FileSinkTests(TestCase):
+    def setUp(self):
+        reset_request_state(self)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def make_sink(self, **kwargs):
+        sink = FileSink(self.directory, **kwargs)
+        self.addCleanup(sink.close)
+        return sink
+
+    def closed_files(self):
+        return glob.glob(os.path.join(self.directory, f'*{CLOSED_SUFFIX}'))
+
+    def write_file(self, name, lines):
+        with gzip.open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(b''.join(lines))
+
+    def record(self, **fields):
+        fields.setdefault('ip_address', '203.0.113.5')
+        fields.setdefault('path', '/a')
+        fields.setdefault('method', 'GET')
+        return json.dumps(log_stream.encode_record(**fields)).encode() + b'\n'
+
+    def test_rotated_files_are_loaded_once(self):
+        route_id = routes.intern_route('properties/<int:pk>/')
+        sink = self.make_sink()
+        sink.write(ip_address='203.0.113.5', path='', method='GET', route_id=route_id, status_code=200)
+        sink.write(ip_address='198.51.100.7', path='/no/such/page/', method='POST')
+        self.assertEqual(self.closed_files(), [])
+
+        sink.rotate()
+
+        self.assertEqual(len(self.closed_files()), 1)
+        self.assertEqual(load_files(self.directory), (1, 2, 0))
+        self.assertEqual(load_files(self.directory), (0, 0, 0))
+        self.assertEqual(len(glob.glob(os.path.join(self.directory, 'loaded', '*'))), 1)
+        logged = RequestLog.objects.get(ip_address='203.0.113.5')
+        self.assertEqual((logged.route.route, logged.status_code), ('properties/<int:pk>/', 200))
+
+    def test_files_rotate_by_size(self):
+        sink = self.make_sink(max_bytes=1)
+        for _ in range(3):
+            sink.write(ip_address='203.0.113.5', path='/a', method='GET')
+        sink.flush()
+
+        self.assertEqual(len(self.closed_files()), 3)
+        self.assertEqual(sink.stats()['rotated'], 3)
+
+    def test_malformed_lines_are_skipped(self):
+        self.write_file('requests-a.jsonl.gz', [
+            self.record(),
+            b'not json\n',
+            self.record(ip_address='999.1.1.1'),
+            json.dumps({'i': '203.0.113.5'}).encode() + b'\n',
+            self.record(path='/b'),
+            # Cut off mid-line by a killed writer
+            self.record(path='/c')[:-10],
+        ])
+
+        self.assertEqual(load_files(self.directory, delete=True), (1, 2, 3))
+        self.assertEqual(sorted(RequestLog.objects.values_list('path', flat=True)), ['/a', '/b'])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_routes_are_matched_by_pattern(self):
+        record = log_stream.encode_record(ip_address='203.0.113.5', path='', method='GET', route_id=999)
+        # Route ids differ between databases; the pattern travels with the record
+        self.write_file('requests-a.jsonl.gz', [
+            json.dumps({**record, 'rt': 'api/security/logs/'}).encode() + b'\n',
+            json.dumps(record).encode() + b'\n',
+        ])
+
+        load_files(self.directory)
+
+        self.assertEqual(
+            sorted(RequestLog.objects.values_list('route__route', flat=True), key=str),
+            [None, 'api/security/logs/'],
+        )
+
+    def test_files_left_open_by_dead_processes_are_closed(self):
+        orphan = os.path.join(self.directory, f'requests-{socket.gethostname()}-999999999-1{OPEN_SUFFIX}')
+        with gzip.open(orphan, 'wb') as f:
+            f.write(self.record())
+
+        self.make_sink()
+
+        self.assertEqual(self.closed_files(), [orphan[:-len('.open')]])
+
+    def test_the_command_reports_skipped_lines(self):
+        self.write_file('requests-a.jsonl.gz', [self.record(), b'{}\n'])
+        out = io.StringIO()
+
+        call_command('load_request_log_files', '--directory', self.directory, stdout=out)
+
+        self.assertIn('Loaded 1 request log(s) from 1 file(s)', out.getvalue())
+        self.assertIn('Skipped 1 malformed line(s)', out.getvalue())
+
+
+class ParseMomentTests(TestCase):
+    def test_dates_and_datetimes(self):
+        self.assertEqual(parse_moment('2024-03-10'), datetime(2024, 3, 10, tzinfo=dt_timezone.utc))
+        self.assertEqual(parse_moment('2024-03-10T12:30'), datetime(2024, 3, 10, 12, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(
+            parse_moment('2024-03-10T12:30:00+02:00'),
+            datetime(2024, 3, 10, 10, 30, tzinfo=dt_timezone.utc),
+        )
+
+    def test_invalid_values(self):
+        # Garbage, and well-formed but impossible dates
+        for value in ('yesterday', '2024-13-01', '2024-02-30T00:00:00', ''):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_moment(value)
+
+
+class SerialExecutor:
+    """Stands in for the process pool: runs each window in the test process."""
+
+    def __init__(self, max_workers=None, mp_context=None, initializer=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@skipUnless(anomaly.ML_AVAILABLE, 'scikit-learn is not installed')
+class BackfillTests(TestCase):
+    def setUp(self):
+        # Workers share the test transaction only when run in-process
+        for patcher in (
+            mock.patch.object(backfill, 'ProcessPoolExecutor', SerialExecutor),
+            mock.patch.object(backfill.connections, 'close_all'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.start = datetime(2024, 3, 10, tzinfo=dt_timezone.utc)
+        logs = [
+            RequestLog(ip_address='203.0.113.5', path='/a', timestamp=self.start + timedelta(minutes=minute))
+            for minute in range(5)
+        ]
+        logs += [RequestLog(ip_address='198.51.100.7', path='/login', timestamp=self.start + timedelta(minutes=70))]
+        logs += [RequestLog(ip_address='198.51.100.8', path='/a', timestamp=self.start + timedelta(minutes=75))]
+        RequestLog.objects.bulk_create(logs)
+
+    def test_windows(self):
+        self.assertEqual(
+            backfill.split_windows(self.start, self.start + timedelta(minutes=90), 60),
+            [
+                (self.start, self.start + timedelta(minutes=60)),
+                (self.start + timedelta(minutes=60), self.start + timedelta(minutes=90)),
+            ],
+        )
+        for minutes in (0, -5):
+            with self.subTest(window_minutes=minutes), self.assertRaises(ValueError):
+                backfill.split_windows(self.start, self.start + timedelta(minutes=90), minutes)
+
+    def test_rules_are_reapplied_per_window(self):
+        run = backfill.run_backfill(
+            self.start, self.start + timedelta(hours=2), volume_threshold=4, sensitive_threshold=1,
+        )
+
+        self.assertEqual((run.status, run.windows_total, run.windows_done, run.flagged_count), ('completed', 2, 2, 2))
+        self.assertEqual(
+            sorted(run.scores.values_list('ip_address', 'request_count', 'flagged_by')),
+            [('198.51.100.7', 1, 'sensitive'), ('203.0.113.5', 5, 'volume')],
+        )
+        # Live flags are never touched
+        self.assertFalse(SuspiciousIP.objects.exists())
+
+    def test_every_ip_window_can_be_stored(self):
+        run = backfill.run_backfill(
+            self.start, self.start + timedelta(hours=2), volume_threshold=100, sensitive_threshold=1, store_all=True,
+        )
+
+        self.assertEqual(run.flagged_count, 1)
+        self.assertEqual(AnomalyBackfillScore.objects.filter(run=run).count(), 3)
+
+    def test_the_command_validates_its_range(self):
+        for args, message in (
+            (['--since', '2024-13-01'], 'Invalid date'),
+            (['--since', '2024-03-11', '--until', '2024-03-10'], 'must be before'),
+            (['--model', 'newest'], 'version number'),
+            (['--window-minutes', '0'], '--window-minutes must be at least 1'),
+            (['--workers', '0'], '--workers must be at least 1'),
+        ):
+            with self.subTest(args=args), self.assertRaisesMessage(CommandError, message):
+                call_command('backfill_anomaly_scores', *args, stdout=io.StringIO())
+
+    def test_the_command_runs_a_backfill(self):
+        out = io.StringIO()
+
+        call_command(
+            'backfill_anomaly_scores', '--since', '2024-03-10', '--until', '2024-03-10T02:00',
+            '--volume-threshold', '4', stdout=out,
+        )
+
+        self.assertIn('scored 2 window(s)', out.getvalue())
+        self.assertIn('1 flagged IP window(s)', out.getvalue())
@@ -13,4 +13,5 @@ urlpatterns = [
     path('logs/', views.api_request_logs, name='api_logs'),
     path('suspicious/', views.api_suspicious_ips, name='api_suspicious'),
     path('blocked/', views.api_blocked_ips, name='api_blocked'),
+    path('traffic/<str:dimension>/', views.api_traffic, name='api_traffic'),
 ]
@@ -0,0 +1,28 @@
+"""
+Small helpers shared by the security app's management commands.
+"""
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def parse_moment(value):
+    """
+    Parse an ISO 8601 date or datetime into an aware datetime.
+
+    Dates mean midnight and naive datetimes are taken as UTC. Raises
+    ValueError for anything else.
+    """
+    try:
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        # Well-formed but impossible, e.g. month 13
+        moment = day = None
+    if moment is None:
+        if day is None:
+            raise ValueError(f'Invalid date or datetime: {value}')
+        moment = datetime.combine(day, time.min)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt_timezone.utc)
+    return moment
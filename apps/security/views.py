@@ -1,23 +1,22 @@
 """
 Views for IP Tracking application.
 
-Task 3: Implement rate limiting on sensitive views.
+Task 3: Implement rate limiting on sensitive views. The limits are
+RATE_LIMIT_POLICIES entries enforced by RateLimitMiddleware.
 """
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
-from django_ratelimit.decorators import ratelimit
-from django_ratelimit.exceptions import Ratelimited
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from django.db.models import Q
 
 from .models import RequestLog, BlockedIP, SuspiciousIP
 
 
-@ratelimit(key='ip', rate='5/m', method='POST', block=True)
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
 def login_view(request):
@@ -37,7 +36,6 @@ def login_view(request):
     })
 
 
-@ratelimit(key='user_or_ip', rate='10/m', block=True)
 @login_required
 def sensitive_view(request):
     """
@@ -51,60 +49,230 @@ def sensitive_view(request):
     })
 
 
+def _parse_time_range(params):
+    """
+    Parse optional ``start``/``end`` ISO 8601 query params; raises ValueError.
+
+    Datetimes without an offset are taken in the current time zone.
+    """
+    from django.utils import timezone
+    from django.utils.dateparse import parse_datetime
+
+    bounds = {}
+    for name in ('start', 'end'):
+        if params.get(name):
+            try:
+                value = parse_datetime(params[name])
+            except ValueError:
+                # Well-formed but impossible, e.g. month 13
+                value = None
+            if value is None:
+                raise ValueError(f'{name} must be an ISO 8601 datetime')
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            bounds[name] = value
+    return bounds.get('start'), bounds.get('end')
+
+
+def _parse_ip(value, name='ip'):
+    """Parse an optional IP address query param; raises ValueError."""
+    import ipaddress
+
+    if not value:
+        return None
+    try:
+        return str(ipaddress.ip_address(value.strip()))
+    except ValueError:
+        raise ValueError(f'{name} must be an IPv4 or IPv6 address')
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-@ratelimit(key='user', rate='10/m', block=True)
 def api_request_logs(request):
     """
-    API endpoint to retrieve request logs.
+    API endpoint to retrieve request logs, newest first.
     Rate limited: 10 requests/minute for authenticated users.
+
+    Query params:
+    - ip, country: exact match
+    - path: request path. Matched exactly when IP_TRACKING_STORE_RAW_PATH
+      keeps raw paths; otherwise a path that resolves is matched by its
+      route, so ``/properties/5/`` returns every ``properties/<int:pk>/`` hit
+    - route: URL pattern as stored in RequestRoute, e.g. 'properties/<int:pk>/'
+    - start, end: ISO 8601 datetimes
+    - cursor, page_size: keyset pagination (see pagination.KeysetPagination)
+    - page: legacy page-number pagination (runs a full COUNT(*))
     """
+    from django.conf import settings
+    from .pagination import KeysetPagination
+    from .routes import resolve_route
     from .serializers import RequestLogSerializer
-    from rest_framework.pagination import PageNumberPagination
 
-    logs = RequestLog.objects.all().order_by('-timestamp')
-    
-    # Pagination
-    paginator = PageNumberPagination()
-    paginator.page_size = 50
+    params = request.query_params
+    try:
+        start, end = _parse_time_range(params)
+        ip = _parse_ip(params.get('ip'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    logs = RequestLog.objects.select_related('route')
+    if ip:
+        logs = logs.filter(ip_address=ip)
+    if params.get('country'):
+        logs = logs.filter(country=params['country'])
+    if params.get('route'):
+        logs = logs.filter(route__route=params['route'])
+    if params.get('path'):
+        # Without raw paths, resolved requests are only stored as their route
+        route = None if getattr(settings, 'IP_TRACKING_STORE_RAW_PATH', False) else resolve_route(params['path'])
+        if route:
+            logs = logs.filter(Q(route__route=route) | Q(path=params['path']))
+        else:
+            logs = logs.filter(path=params['path'])
+    if start:
+        logs = logs.filter(timestamp__gte=start)
+    if end:
+        logs = logs.filter(timestamp__lt=end)
+
+    if 'page' in params:
+        from rest_framework.pagination import PageNumberPagination
+        paginator = PageNumberPagination()
+        paginator.page_size = 50
+        logs = logs.order_by('-timestamp', '-id')
+    else:
+        paginator = KeysetPagination('timestamp')
+
     page = paginator.paginate_queryset(logs, request)
-    
-    if page is not None:
-        serializer = RequestLogSerializer(page, many=True)
-        return paginator.get_paginated_response(serializer.data)
-    
-    serializer = RequestLogSerializer(logs, many=True)
-    return Response(serializer.data)
+    serializer = RequestLogSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-@ratelimit(key='user', rate='10/m', block=True)
 def api_suspicious_ips(request):
     """
-    API endpoint to retrieve suspicious IPs.
+    API endpoint to retrieve suspicious IPs, most recently flagged first.
     Rate limited: 10 requests/minute for authenticated users.
+
+    Query params: ip, start, end (on flagged_at), cursor, page_size.
     """
+    from .pagination import KeysetPagination
     from .serializers import SuspiciousIPSerializer
-    
-    suspicious = SuspiciousIP.objects.all().order_by('-flagged_at')
-    serializer = SuspiciousIPSerializer(suspicious, many=True)
-    return Response(serializer.data)
+
+    params = request.query_params
+    try:
+        start, end = _parse_time_range(params)
+        ip = _parse_ip(params.get('ip'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    suspicious = SuspiciousIP.objects.all()
+    if ip:
+        suspicious = suspicious.filter(ip_address=ip)
+    if start:
+        suspicious = suspicious.filter(flagged_at__gte=start)
+    if end:
+        suspicious = suspicious.filter(flagged_at__lt=end)
+
+    paginator = KeysetPagination('flagged_at')
+    page = paginator.paginate_queryset(suspicious, request)
+    serializer = SuspiciousIPSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-@ratelimit(key='user', rate='10/m', block=True)
 def api_blocked_ips(request):
     """
-    API endpoint to retrieve blocked IPs.
+    API endpoint to retrieve blocked IPs, newest first.
     Rate limited: 10 requests/minute for authenticated users.
+
+    Query params: ip, start, end (on created_at), cursor, page_size.
     """
+    from .pagination import KeysetPagination
     from .serializers import BlockedIPSerializer
-    
-    blocked = BlockedIP.objects.all().order_by('-created_at')
-    serializer = BlockedIPSerializer(blocked, many=True)
-    return Response(serializer.data)
+
+    params = request.query_params
+    try:
+        start, end = _parse_time_range(params)
+        ip = _parse_ip(params.get('ip'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    blocked = BlockedIP.objects.all()
+    if ip:
+        blocked = blocked.filter(ip_address=ip)
+    if start:
+        blocked = blocked.filter(created_at__gte=start)
+    if end:
+        blocked = blocked.filter(created_at__lt=end)
+
+    paginator = KeysetPagination('created_at')
+    page = paginator.paginate_queryset(blocked, request)
+    serializer = BlockedIPSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def api_traffic(request, dimension):
+    """
+    API endpoint to query hourly traffic rollups.
+    Rate limited: 30 requests/minute for authenticated users.
+
+    dimension: 'ip', 'path' or 'country'
+    Query params:
+    - start, end: ISO 8601 datetimes (default: the last 24 hours)
+    - key: restrict to one IP / path / country
+    - group: 'total' (default, top keys over the range) or 'hour' (time series)
+    - limit: maximum rows returned (default 50, max 1000)
+    """
+    from datetime import timedelta
+    from django.db.models import Sum
+    from django.utils import timezone
+    from .rollups import DIMENSIONS
+
+    if dimension not in DIMENSIONS:
+        return Response(
+            {'error': f'dimension must be one of: {", ".join(DIMENSIONS)}'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    model, key_field = DIMENSIONS[dimension]
+
+    params = request.query_params
+    try:
+        start, end = _parse_time_range(params)
+        if dimension == 'ip' and params.get('key') is not None:
+            # Matched against an inet column
+            _parse_ip(params['key'], 'key')
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    end = end or timezone.now()
+    start = start or end - timedelta(hours=24)
+    try:
+        limit = min(max(int(params.get('limit', 50)), 1), 1000)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = model.objects.filter(hour__gte=start, hour__lt=end)
+    if params.get('key') is not None:
+        rows = rows.filter(**{key_field: params['key']})
+
+    sums = {'request_count': Sum('request_count')}
+    if dimension == 'ip':
+        sums['sensitive_count'] = Sum('sensitive_count')
+
+    if params.get('group') == 'hour':
+        results = rows.values('hour', key_field, *sums).order_by('-hour', '-request_count')[:limit]
+    else:
+        results = rows.values(key_field).annotate(**sums).order_by('-request_count')[:limit]
+
+    return Response({
+        'dimension': dimension,
+        'start': start,
+        'end': end,
+        'results': list(results),
+    })
 
 
 def home_view(request):
@@ -118,6 +286,7 @@ def home_view(request):
             'api_logs': '/api/security/logs/ (requires authentication)',
             'api_suspicious': '/api/security/suspicious/ (requires authentication)',
             'api_blocked': '/api/security/blocked/ (requires authentication)',
+            'api_traffic': '/api/security/traffic/<ip|path|country>/ (requires authentication)',
         },
         'note': 'This request has been logged. Check admin panel to see your IP address.'
     })
@@ -0,0 +1,61 @@
+"""
+Id watermarks over RequestLog.
+
+The incremental jobs (hourly rollups, deferred GeoIP enrichment) walk
+RequestLog by id behind a RollupWatermark. Ids are allocated at INSERT but
+only become visible at COMMIT, and concurrent bulk inserts commit out of
+id order: while one writer's batch is still open, a later batch with
+higher ids can already be visible. A watermark moved to the highest
+visible id would skip the earlier batch for good.
+
+``next_batch`` therefore only extends a batch up to rows inserted more
+than IP_TRACKING_WATERMARK_GRACE seconds ago (``RequestLog.logged_at``).
+Every lower id was allocated before such a row, by a transaction that has
+long since committed or rolled back, so nothing can appear below the
+watermark afterwards.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from .models import RequestLog
+
+
+def _settled():
+    """Q matching rows inserted more than the grace period ago."""
+    grace = getattr(settings, 'IP_TRACKING_WATERMARK_GRACE', 60)
+    settled_before = timezone.now() - timedelta(seconds=grace)
+    return Q(logged_at__isnull=True) | Q(logged_at__lte=settled_before)
+
+
+def next_batch(after_id, batch_size, limit=None):
+    """
+    ``(low, high)`` of the next id range above ``after_id`` that is safe to
+    process: at most ``batch_size`` ids wide, not above ``limit``, and
+    ending at a settled row. Returns None when there is nothing to do yet.
+    """
+    low = RequestLog.objects.filter(id__gt=after_id).aggregate(low=Min('id'))['low']
+    if low is None or (limit is not None and low > limit):
+        return None
+    end = low + batch_size - 1
+    if limit is not None:
+        end = min(end, limit)
+    high = RequestLog.objects.filter(
+        _settled(), id__gte=low, id__lte=end,
+    ).aggregate(high=Max('id'))['high']
+    if high is None:
+        return None
+    return low, high
+
+
+def settled_up_to(after_id, using='default'):
+    """
+    Highest id above ``after_id`` below which every row is final, or None
+    when there is nothing settled yet. For jobs that walk the whole range
+    in one pass (see export.py).
+    """
+    return RequestLog.objects.using(using).filter(
+        _settled(), id__gt=after_id,
+    ).aggregate(high=Max('id'))['high']
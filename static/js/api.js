@@ -149,17 +149,47 @@ class APIClient {
     /**
      * Properties Methods
      */
-    async getProperties(filters = {}) {
-        const queryParams = new URLSearchParams(filters).toString();
-        const url = `/api/properties/api/list/${queryParams ? '?' + queryParams : ''}`;
+    /**
+     * Get one page of properties: { next, results }.
+     * Pass the previous page's `next` URL as `cursorUrl` to continue.
+     */
+    async getProperties(filters = {}, cursorUrl = null) {
+        let url;
+        if (cursorUrl) {
+            const next = new URL(cursorUrl, API_BASE_URL);
+            url = next.pathname + next.search;
+        } else {
+            const queryParams = new URLSearchParams(filters).toString();
+            url = `/api/properties/api/list/${queryParams ? '?' + queryParams : ''}`;
+        }
         return await this.request(url, {
             requireAuth: false,
         });
     }
+
+    /**
+     * Iterate over all matching properties, one page request at a time:
+     *   for await (const property of api.iterateProperties({ page_size: 50 })) { ... }
+     */
+    async *iterateProperties(filters = {}) {
+        let page = await this.getProperties(filters);
+        while (true) {
+            yield* page.results;
+            if (!page.next) return;
+            page = await this.getProperties(filters, page.next);
+        }
+    }
     
+    /**
+     * Backward compatibility: every property as a plain array, as the
+     * listing returned before it was paginated.
+     */
     async getPropertiesOld() {
-        // Backward compatibility
-        return await this.getProperties();
+        const properties = [];
+        for await (const property of this.iterateProperties()) {
+            properties.push(property);
+        }
+        return properties;
     }
     
     async getProperty(id) {
@@ -249,5 +279,85 @@ class APIClient {
     }
 }
 
+/**
+ * Infinite scroll over a cursor-paginated endpoint.
+ *
+ * Appends rendered items to `container` and loads the next page whenever a
+ * sentinel element below it scrolls into view:
+ *
+ *   new InfiniteScroll({
+ *       container: document.getElementById('properties-container'),
+ *       loadPage: (cursorUrl) => api.getProperties({ page_size: 24 }, cursorUrl),
+ *       renderItem: (property) => `<div>...</div>`,
+ *   }).start();
+ */
+class InfiniteScroll {
+    constructor({ container, loadPage, renderItem, onEmpty = null, onError = null, rootMargin = '400px' }) {
+        this.container = container;
+        this.loadPage = loadPage;
+        this.renderItem = renderItem;
+        this.onEmpty = onEmpty;
+        this.onError = onError;
+        this.rootMargin = rootMargin;
+        this.next = null;
+        this.loading = false;
+        this.done = false;
+        this.count = 0;
+        this.sentinel = document.createElement('div');
+        this.sentinel.className = 'infinite-scroll-sentinel';
+        this.observer = null;
+    }
+
+    async start() {
+        this.container.innerHTML = '';
+        this.container.after(this.sentinel);
+        await this.loadMore();
+        if (this.done) return;
+
+        if ('IntersectionObserver' in window) {
+            this.observer = new IntersectionObserver((entries) => {
+                if (entries.some(entry => entry.isIntersecting)) this.loadMore();
+            }, { rootMargin: this.rootMargin });
+            this.observer.observe(this.sentinel);
+        } else {
+            // Fallback for old browsers: explicit "Load more" button
+            this.sentinel.innerHTML = '<button class="btn btn-secondary">Load more</button>';
+            this.sentinel.querySelector('button').addEventListener('click', () => this.loadMore());
+        }
+    }
+
+    async loadMore() {
+        if (this.loading || this.done) return;
+        this.loading = true;
+        this.sentinel.classList.add('loading');
+        try {
+            const page = await this.loadPage(this.next);
+            this.container.insertAdjacentHTML('beforeend', page.results.map(this.renderItem).join(''));
+            this.count += page.results.length;
+            this.next = page.next;
+            if (!this.next) this.finish();
+            if (this.count === 0 && this.onEmpty) this.onEmpty();
+        } catch (error) {
+            console.error('Infinite scroll error:', error);
+            this.finish();
+            if (this.onError) this.onError(error);
+        } finally {
+            this.loading = false;
+            this.sentinel.classList.remove('loading');
+        }
+    }
+
+    finish() {
+        this.done = true;
+        this.destroy();
+    }
+
+    destroy() {
+        if (this.observer) this.observer.disconnect();
+        this.observer = null;
+        this.sentinel.remove();
+    }
+}
+
 // Create global API client instance
 const api = new APIClient();
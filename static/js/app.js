@@ -67,48 +67,52 @@ async function loadProperties() {
     const propertiesContainer = document.getElementById('properties-container');
     if (!propertiesContainer) return;
     
-    try {
-        propertiesContainer.innerHTML = '<div class="loading">Loading properties...</div>';
-        const properties = await api.getProperties();
-        
-        if (properties.length === 0) {
+    propertiesContainer.innerHTML = '<div class="loading">Loading properties...</div>';
+    new InfiniteScroll({
+        container: propertiesContainer,
+        loadPage: (cursorUrl) => api.getProperties({ page_size: 24 }, cursorUrl),
+        renderItem: renderPropertyCard,
+        onEmpty: () => {
             propertiesContainer.innerHTML = '<div class="no-properties">No properties available at the moment.</div>';
-            return;
-        }
-        
-        propertiesContainer.innerHTML = properties.map(property => {
-            const price = property.price_per_night || property.price || 0;
-            const rating = property.average_rating || 0;
-            const reviewCount = property.review_count || 0;
-            const imageUrl = property.image_url || '';
-            const image = property.image || '';
-            
-            return `
-            <div class="property-card" onclick="window.location.href='/properties/${property.id}/'">
-                <div class="property-image">
-                    ${imageUrl ? `<img src="${escapeHtml(imageUrl)}" alt="${escapeHtml(property.title)}" onerror="this.parentElement.innerHTML='<div class=\\'placeholder-image\\'>🏠</div>'">` : 
-                      image ? `<img src="${escapeHtml(image)}" alt="${escapeHtml(property.title)}" onerror="this.parentElement.innerHTML='<div class=\\'placeholder-image\\'>🏠</div>'">` :
-                      '<div class="placeholder-image">🏠</div>'}
-                </div>
-                <div class="property-info">
-                    <div class="property-header-row">
-                        <h3>${escapeHtml(property.title)}</h3>
-                        ${rating > 0 ? `<span class="property-rating">⭐ ${rating} (${reviewCount})</span>` : ''}
-                    </div>
-                    <p class="property-location">📍 ${escapeHtml(property.location || property.city || 'Location not specified')}</p>
-                    <p class="property-description">${escapeHtml((property.description || '').substring(0, 150))}${(property.description || '').length > 150 ? '...' : ''}</p>
-                    <div class="property-footer">
-                        <span class="property-price">$${parseFloat(price).toFixed(2)}/night</span>
-                        <button class="btn btn-primary" onclick="event.stopPropagation(); window.location.href='/properties/${property.id}/'">View Details</button>
-                    </div>
-                </div>
+        },
+        onError: (error) => {
+            console.error('Error loading properties:', error);
+            propertiesContainer.insertAdjacentHTML('beforeend', `<div class="error">Error loading properties: ${escapeHtml(error.message)}</div>`);
+        },
+    }).start();
+}
+
+/**
+ * Render one property card
+ */
+function renderPropertyCard(property) {
+    const price = property.price_per_night || property.price || 0;
+    const rating = property.average_rating || 0;
+    const reviewCount = property.review_count || 0;
+    const imageUrl = property.image_url || '';
+    const image = property.image || '';
+    
+    return `
+    <div class="property-card" onclick="window.location.href='/properties/${property.id}/'">
+        <div class="property-image">
+            ${imageUrl ? `<img src="${escapeHtml(imageUrl)}" alt="${escapeHtml(property.title)}" onerror="this.parentElement.innerHTML='<div class=\\'placeholder-image\\'>🏠</div>'">` : 
+              image ? `<img src="${escapeHtml(image)}" alt="${escapeHtml(property.title)}" onerror="this.parentElement.innerHTML='<div class=\\'placeholder-image\\'>🏠</div>'">` :
+              '<div class="placeholder-image">🏠</div>'}
+        </div>
+        <div class="property-info">
+            <div class="property-header-row">
+                <h3>${escapeHtml(property.title)}</h3>
+                ${rating > 0 ? `<span class="property-rating">⭐ ${rating} (${reviewCount})</span>` : ''}
             </div>
-        `;
-        }).join('');
-    } catch (error) {
-        console.error('Error loading properties:', error);
-        propertiesContainer.innerHTML = `<div class="error">Error loading properties: ${error.message}</div>`;
-    }
+            <p class="property-location">📍 ${escapeHtml(property.location || property.city || 'Location not specified')}</p>
+            <p class="property-description">${escapeHtml((property.description || '').substring(0, 150))}${(property.description || '').length > 150 ? '...' : ''}</p>
+            <div class="property-footer">
+                <span class="property-price">$${parseFloat(price).toFixed(2)}/night</span>
+                <button class="btn btn-primary" onclick="event.stopPropagation(); window.location.href='/properties/${property.id}/'">View Details</button>
+            </div>
+        </div>
+    </div>
+`;
 }
 
 /**